@@ -0,0 +1,134 @@
+import os
+import re
+from functools import lru_cache
+from .postings import PositionBuffer
+
+# Text analysis shared by indexing and queries: tokenize, lowercase, drop
+# stopwords, stem. Stopwords still take up a position, so phrase offsets
+# stay right when one is removed from the middle of a phrase.
+DEFAULT_ANALYZER = os.getenv("ANALYZER", "standard")
+STEM_CACHE_SIZE = int(os.getenv("STEM_CACHE_SIZE", "65536"))
+
+WORD_PATTERN = re.compile(r"\w+(?:['’]\w+)*")  # Unicode word characters, inner apostrophes kept
+WHITESPACE_PATTERN = re.compile(r"\S+")
+
+# Lucene's English stopword set
+ENGLISH_STOPWORDS = frozenset("""
+    a an and are as at be but by for if in into is it no not of on or such
+    that the their then there these they this to was will with
+""".split())
+
+VOWELS = set("aeiouy")
+
+
+def light_stem(word):
+    """Light English stemmer: folds plurals and -ed/-ing onto the base word.
+
+    Deliberately conservative (no derivational suffixes) and only applied to
+    ASCII words, so other languages pass through untouched.
+    """
+    if len(word) <= 3 or not (word.isascii() and word.isalpha()):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith("sses") or word.endswith(("ches", "shes", "xes", "zes")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            if len(stem) >= 3 and VOWELS.intersection(stem):
+                if stem[-1] == stem[-2] and stem[-1] not in "lsz":
+                    stem = stem[:-1]  # running -> run
+                word = stem
+            break
+    return word
+
+
+class Analyzer:
+    def __init__(self, pattern=WORD_PATTERN, stopwords=(), stemmer=None, stem_cache=STEM_CACHE_SIZE):
+        self.pattern = pattern
+        self.stopwords = frozenset(stopwords)
+        # Natural-language term frequencies are heavily skewed, so a small
+        # memo of recent words saves nearly every stemmer call
+        self.stem = lru_cache(maxsize=stem_cache)(stemmer) if stemmer else None
+
+    def iter_tokens(self, chunks):
+        """Lowercased tokens from an iterable of text chunks.
+
+        A token that reaches the end of a chunk is carried into the next one,
+        so the output is the same as for the joined text.
+        """
+        carry = ""
+        for chunk in chunks:
+            text = carry + chunk
+            end = 0
+            for match in self.pattern.finditer(text):
+                if match.end() >= len(text) - 1:
+                    break  # may continue in the next chunk (also past a trailing apostrophe)
+                yield match.group().lower()
+                end = match.end()
+            carry = text[end:]
+        for match in self.pattern.finditer(carry):
+            yield match.group().lower()
+
+    def iter_spans(self, chunks):
+        """(start, end) offsets in the joined text of the tokens iter_tokens yields."""
+        carry = ""
+        base = 0  # offset of `carry` in the joined text
+        for chunk in chunks:
+            text = carry + chunk
+            end = 0
+            for match in self.pattern.finditer(text):
+                if match.end() >= len(text) - 1:
+                    break
+                yield base + match.start(), base + match.end()
+                end = match.end()
+            carry = text[end:]
+            base += end
+        for match in self.pattern.finditer(carry):
+            yield base + match.start(), base + match.end()
+
+    def iter_terms(self, chunks):
+        # (position, term) pairs after stopword removal and stemming
+        stopwords = self.stopwords
+        stem = self.stem
+        for pos, token in enumerate(self.iter_tokens(chunks)):
+            if token in stopwords:
+                continue
+            yield pos, stem(token) if stem else token
+
+    def analyze(self, chunks):
+        """term -> PositionBuffer for a document given as text chunks."""
+        term_positions = {}
+        for pos, term in self.iter_terms(chunks):
+            positions = term_positions.get(term)
+            if positions is None:
+                positions = term_positions[term] = PositionBuffer()
+            positions.append(pos)
+        return term_positions
+
+    def terms(self, text):
+        return [term for _, term in self.iter_terms([text])]
+
+    def stem_cache_info(self):
+        return self.stem.cache_info() if self.stem else None
+
+
+ANALYZERS = {
+    "standard": Analyzer(stopwords=ENGLISH_STOPWORDS, stemmer=light_stem),
+    "simple": Analyzer(),  # words, lowercased
+    "whitespace": Analyzer(pattern=WHITESPACE_PATTERN),  # lower().split(), the original tokenizer
+}
+
+
+def register_analyzer(name, analyzer):
+    ANALYZERS[name] = analyzer
+
+
+def get_analyzer(name=None):
+    name = name or DEFAULT_ANALYZER
+    if name not in ANALYZERS:
+        raise ValueError(f"Unknown analyzer: {name}")
+    return ANALYZERS[name]
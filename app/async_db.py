@@ -0,0 +1,137 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import database
+from . import compaction
+from . import shards
+
+# Async facade over database.py for the FastAPI routes. Reads run on a pool
+# sized to the reader connections, writes on a single thread (SQLite has one
+# writer anyway), so a slow query never blocks the event loop.
+QUERY_WORKERS = database.READER_POOL_SIZE
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "30"))  # seconds
+
+_readers = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-write")
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class _Job:
+    """Tracks which thread runs a query so it can be interrupted; shard
+    searches it starts in worker processes stop at its deadline instead."""
+
+    def __init__(self, fn, args, timeout=None):
+        self.fn = fn
+        self.args = args
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.thread_id = None
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.finished:
+                return None  # cancelled before it started
+            self.thread_id = threading.get_ident()
+        try:
+            with shards.deadline(self.deadline):
+                return self.fn(*self.args)
+        finally:
+            with self.lock:
+                self.finished = True
+
+    def cancel(self):
+        with self.lock:
+            if not self.finished and self.thread_id is not None:
+                for pool in database.get_pools():
+                    pool.interrupt(self.thread_id)
+            self.finished = True
+
+
+async def run(fn, *args, timeout=None, executor=_readers):
+    """Run a blocking database call off the event loop.
+
+    On timeout or cancellation the running SQLite statement is interrupted,
+    which releases its reader connection straight away. timeout=None waits
+    indefinitely (used for writes, which must not be abandoned half way).
+    """
+    job = _Job(fn, args, timeout)
+    future = asyncio.get_running_loop().run_in_executor(executor, job)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        job.cancel()
+        raise QueryTimeout(f"Query exceeded {timeout:g}s")
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
+
+
+async def search_documents(query, limit=10, timeout=None, search_after=None, source=None, highlight=None):
+    return await run(database.search_documents, query, limit, search_after, source, highlight,
+                     timeout=timeout or QUERY_TIMEOUT)
+
+
+async def filtered_search(query="", limit=10, timeout=None, search_after=None, filters=None, aggs=None,
+                          source=None, highlight=None):
+    return await run(database.filtered_search, query, limit, search_after, filters, aggs, source, highlight,
+                     timeout=timeout or QUERY_TIMEOUT)
+
+
+async def get_all_documents(limit=100, timeout=None, search_after=None, source=None):
+    return await run(database.get_all_documents, limit, search_after, source, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def get_document_status(doc_id, timeout=None):
+    return await run(database.get_document_status, doc_id, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def document_status_counts(timeout=None):
+    return await run(database.document_status_counts, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def get_raw_documents(limit=100, timeout=None, search_after=None):
+    return await run(database.get_raw_documents, limit, search_after, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def get_raw_extracted_text(limit=100, timeout=None, search_after=None, shard=0):
+    return await run(database.get_raw_extracted_text, limit, search_after, shard, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def get_raw_inverted_index(limit=100, timeout=None, search_after=None, shard=0):
+    return await run(database.get_raw_inverted_index, limit, search_after, shard, timeout=timeout or QUERY_TIMEOUT)
+
+
+async def iter_pages(fetch, cursor, page_size, search_after=None):
+    """Yield pages from a keyset-paged listing until it runs out.
+
+    `fetch(limit, search_after)` returns one page; `cursor(row)` gives the
+    search_after for the next one. Only one page is held at a time and no
+    reader connection is kept between pages, however slow the consumer is.
+    """
+    while True:
+        rows = await run(fetch, page_size, search_after, timeout=QUERY_TIMEOUT)
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        search_after = cursor(rows[-1])
+
+
+async def insert_document(doc_id, title, content, file_path=None, fields=None):
+    return await run(database.insert_document, doc_id, title, content, file_path, fields, executor=_writer)
+
+
+async def bulk_write(ops):
+    return await run(database.bulk_write, ops, executor=_writer)
+
+
+async def compact():
+    # Runs on its own thread: it commits in small batches, so holding the
+    # single writer thread for the whole pass would stall uploads
+    return await run(compaction.compact, executor=None)
@@ -0,0 +1,111 @@
+import json
+import time
+from . import async_db
+
+BULK_BATCH_SIZE = 1000  # operations per transaction
+BULK_ACTIONS = ("index", "create", "delete")
+
+
+async def iter_lines(stream):
+    # Split an async byte stream into lines without buffering the whole body
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer.extend(chunk)
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def iter_operations(lines, id_field="id", content_field="content"):
+    """Yield (action, doc_id, source, error) tuples from NDJSON bulk lines.
+
+    Lines follow the Elasticsearch format: an action line such as
+    {"index": {"_id": "1"}} followed by a source line (none for delete).
+    ``create`` is handled like ``index``. A line that is not an action line
+    is treated as an implicit index of that document, with its id taken
+    from ``id_field``.
+    """
+    pending = None
+    async for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield (pending[0] if pending else "index", pending[1] if pending else None, None, f"invalid JSON: {e}")
+            pending = None
+            continue
+        if pending is not None:
+            action, doc_id = pending
+            pending = None
+            if not isinstance(obj, dict):
+                yield (action, doc_id, None, "source must be a JSON object")
+                continue
+            yield (action, doc_id or obj.get(id_field), _source(obj, content_field, id_field), None)
+            continue
+        if isinstance(obj, dict) and len(obj) == 1 and next(iter(obj)) in BULK_ACTIONS:
+            action, meta = next(iter(obj.items()))
+            doc_id = meta.get("_id") if isinstance(meta, dict) else None
+            if action == "delete":
+                yield (action, doc_id, None, None if doc_id else "delete requires _id")
+            else:
+                pending = ("index", doc_id)
+            continue
+        if not isinstance(obj, dict):
+            yield ("index", None, None, "source must be a JSON object")
+            continue
+        yield ("index", obj.get("_id", obj.get(id_field)), _source(obj, content_field, id_field), None)
+    if pending is not None:
+        yield (pending[0], pending[1], None, "action line without a source line")
+
+
+def _source(obj, content_field, id_field="id"):
+    # The other top-level keys become structured fields (see doc_values.py)
+    content = obj.get(content_field)
+    if not isinstance(content, str):
+        content = "" if content is None else json.dumps(content)
+    fields = {key: value for key, value in obj.items() if key not in (content_field, id_field, "_id", "title")}
+    return {"title": obj.get("title"), "content": content, "fields": fields}
+
+
+async def run_bulk(stream, id_field="id", content_field="content", batch_size=BULK_BATCH_SIZE):
+    """Stream a _bulk body into bulk_write() batches; returns the ES-style response."""
+    started = time.perf_counter()
+    items = []
+    batch = []
+    errors = False
+
+    async def flush():
+        results = await async_db.bulk_write(batch)
+        for action, doc_id, status, result in results:
+            items.append({action: {"_id": doc_id, "status": status, "result": result}})
+        batch.clear()
+
+    async for action, doc_id, source, error in iter_operations(iter_lines(stream), id_field, content_field):
+        if error is None and doc_id is None:
+            error = f"document has no '{id_field}'"
+        if error is not None:
+            # Flush first so items stay in request order
+            if batch:
+                await flush()
+            errors = True
+            items.append({action: {"_id": doc_id, "status": 400, "error": error}})
+            continue
+        doc_id = str(doc_id)
+        if action == "delete":
+            batch.append(("delete", doc_id))
+        else:
+            batch.append(("index", doc_id, source["title"] or doc_id, source["content"], source["fields"]))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return {"took": int((time.perf_counter() - started) * 1000), "errors": errors, "items": items}
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", str(32 * 1024 * 1024)))
+POSTINGS_CACHE_BYTES = int(os.getenv("POSTINGS_CACHE_BYTES", str(64 * 1024 * 1024)))
+TERM_ID_CACHE_BYTES = int(os.getenv("TERM_ID_CACHE_BYTES", str(16 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))  # seconds
+POSTING_SIZE = 96  # rough bytes per cached (doc_id, tf, length) row
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by an approximate byte size, with per-entry TTL."""
+
+    def __init__(self, max_bytes, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+results = LRUCache(RESULT_CACHE_BYTES)
+postings = LRUCache(POSTINGS_CACHE_BYTES)
+# (shard, term) -> id from that shard's terms table. Ids never change, so entries don't expire;
+# only committed ids are stored (see database.term_ids).
+term_ids = LRUCache(TERM_ID_CACHE_BYTES, ttl=float("inf"))
+
+# Bumped after every committed index change. Query results are keyed by it, so
+# a re-index makes every older result unreachable; postings read before a
+# commit are only stored if it has not moved (see put_postings).
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def generation():
+    return _generation
+
+
+def invalidate_terms(terms, shard=0):
+    """Called after commit with every term whose postings changed in a shard."""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        for term in terms:
+            postings.discard((shard, term))
+
+
+def put_postings(key, rows, read_at):
+    """Cache postings rows read at generation `read_at`, unless an index change
+    committed since. Checked under the lock invalidate_terms holds, so a stale
+    read cannot land after its term was discarded."""
+    with _generation_lock:
+        if read_at == _generation:
+            postings.put(key, rows, POSTING_SIZE * len(rows))
+
+
+def stats():
+    return {"generation": _generation, "results": results.stats(), "postings": postings.stats(),
+            "term_ids": term_ids.stats()}
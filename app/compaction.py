@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from .database import transaction, read_connection, get_pools
+
+# Background compaction. Re-indexing writes a new version of a document's
+# postings and a new extracted_text row; the old ones stay behind until this
+# purges them. Every step is a short write transaction of bounded size, so
+# indexing and uploads interleave with it instead of waiting it out. With
+# several shards each step runs over every shard in turn.
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", "600"))  # seconds; 0 disables
+COMPACTION_BATCH = int(os.getenv("COMPACTION_BATCH", "500"))  # documents / rows per transaction
+FTS_MERGE_PAGES = 500  # pages of FTS5 b-tree merged per transaction
+VACUUM_PAGES = 1000  # free pages returned to the OS per transaction
+
+last_report = None
+
+
+def purge_stale_postings(batch_size=COMPACTION_BATCH, shard=0):
+    # Walk doc_stats in doc_id order; every version but the live one is stale
+    deleted = 0
+    after = ""
+    while True:
+        with transaction(shard) as db:
+            docs = db.execute("SELECT doc_id, version FROM doc_stats WHERE doc_id > ? ORDER BY doc_id LIMIT ?",
+                              (after, batch_size)).fetchall()
+            if not docs:
+                return deleted
+            before = db.total_changes
+            db.executemany("DELETE FROM inverted_index WHERE doc_id = ? AND version != ?",
+                           [(row[0], row[1]) for row in docs])
+            deleted += db.total_changes - before
+        after = docs[-1][0]
+
+
+def purge_stale_extracted_text(batch_size=COMPACTION_BATCH, shard=0):
+    # Keep only the newest extracted_text row per document, scanning by id
+    deleted = 0
+    after = 0
+    while True:
+        with transaction(shard) as db:
+            ids = [row[0] for row in db.execute(
+                "SELECT id FROM extracted_text WHERE id > ? ORDER BY id LIMIT ?", (after, batch_size))]
+            if not ids:
+                return deleted
+            before = db.total_changes
+            db.execute(f"""
+                DELETE FROM extracted_text WHERE id IN ({",".join("?" * len(ids))})
+                AND EXISTS (SELECT 1 FROM extracted_text newer
+                            WHERE newer.doc_id = extracted_text.doc_id AND newer.id > extracted_text.id)
+            """, ids)
+            deleted += db.total_changes - before
+        after = ids[-1]
+
+
+def merge_fts(pages=FTS_MERGE_PAGES, shard=0):
+    # Incremental FTS5 merge; a step that changes fewer than 2 rows means
+    # there is nothing left to merge (see the FTS5 'merge' command docs)
+    steps = 0
+    while True:
+        with transaction(shard) as db:
+            before = db.total_changes
+            db.execute("INSERT INTO fts_documents (fts_documents, rank) VALUES ('merge', ?)", (pages,))
+            done = db.total_changes - before < 2
+        steps += 1
+        if done:
+            return steps
+
+
+def incremental_vacuum(pages=VACUUM_PAGES, shard=0):
+    # Only possible when the database was created with auto_vacuum=INCREMENTAL
+    with read_connection(shard) as db:
+        if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+    freed = 0
+    while True:
+        with transaction(shard) as db:
+            free = db.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            db.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+            freed += free - db.execute("PRAGMA freelist_count").fetchone()[0]
+    return freed
+
+
+def database_bytes():
+    return sum(os.path.getsize(pool.path + suffix) for pool in get_pools()
+               for suffix in ("", "-wal") if os.path.exists(pool.path + suffix))
+
+
+def compact(batch_size=COMPACTION_BATCH):
+    """Run one full compaction pass and return a report of what it did."""
+    global last_report
+    started = time.perf_counter()
+    size_before = database_bytes()
+    report = dict.fromkeys(("postings_deleted", "extracted_text_deleted", "fts_merge_steps", "pages_vacuumed"), 0)
+    for pool in get_pools():
+        report["postings_deleted"] += purge_stale_postings(batch_size, pool.shard)
+        report["extracted_text_deleted"] += purge_stale_extracted_text(batch_size, pool.shard)
+        report["fts_merge_steps"] += merge_fts(shard=pool.shard)
+        report["pages_vacuumed"] += incremental_vacuum(shard=pool.shard)
+        # Move the WAL back into the main file so the freed space shows up on disk
+        pool.checkpoint("TRUNCATE")
+    report["bytes_before"] = size_before
+    report["bytes_after"] = database_bytes()
+    report["bytes_reclaimed"] = max(0, size_before - report["bytes_after"])
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["finished_at"] = time.time()
+    last_report = report
+    print(f"Compaction: {report['postings_deleted']} postings, {report['extracted_text_deleted']} extracted_text rows, "
+          f"{report['bytes_reclaimed']} bytes reclaimed in {report['seconds']}s")
+    return report
+
+
+async def run_periodically(interval=COMPACTION_INTERVAL):
+    if not interval:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(compact)
+        except Exception as e:
+            print(f"Compaction failed: {e}")
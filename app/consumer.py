@@ -1,95 +1,197 @@
 import asyncio
 import json
-import aio_pika
-from .rabbitmq import get_connection, TEXT_EXTRACT_QUEUE, INDEX_QUEUE, publish_to_queue
-from .database import add_document, update_document_status
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .rabbitmq import get_transport, TEXT_EXTRACT_QUEUE, INDEX_QUEUE, publish_batch_to_queue
+from .database import (insert_document, update_documents_status, fetch_documents, transaction, read_connection,
+                       fetch_versions, get_analyzer, document_chunks, write_postings, write_fts, group_by_shard)
+from . import metrics
 
-async def process_text_extract(message: aio_pika.IncomingMessage):
-    async with message.process():
-        data = json.loads(message.body.decode())
-        doc_id = data["id"]
-        # Get file_path from DB
-        from .database import get_document_status
-        doc = get_document_status(doc_id)
-        if not doc or 'file_path' not in doc:
-            print(f"No file path for {doc_id}")
-            return
-        file_path = doc['file_path']
-        try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-        except FileNotFoundError:
-            print(f"File not found: {file_path}")
-            update_document_status(doc_id, 'failed')
-            return
-        update_document_status(doc_id, 'extracting')
-        # Extract plain text: simple lowercase
-        extracted = content.lower()
-        # Store in SQLite
-        from .database import get_db
-        db = get_db()
-        db.execute("INSERT INTO extracted_text (doc_id, text, version) VALUES (?, ?, ?)",
-                   (doc_id, extracted, doc['version']))
-        db.commit()
-        db.close()
-        # Publish to index queue
-        index_data = {"id": doc_id, "extracted": extracted}
-        await publish_to_queue(INDEX_QUEUE, json.dumps(index_data))
-        print(f"Text extracted for document: {doc_id}")
-
-async def process_index(message: aio_pika.IncomingMessage):
-    async with message.process():
-        data = json.loads(message.body.decode())
+# Messages are prefetched and grouped into micro-batches, each written in one
+# transaction on a worker thread so SQLite and file I/O stay off the event loop.
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "256"))
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "100"))
+CONSUMER_BATCH_TIMEOUT = float(os.getenv("CONSUMER_BATCH_TIMEOUT", "0.05"))  # seconds
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_executor = ThreadPoolExecutor(max_workers=CONSUMER_WORKERS, thread_name_prefix="consumer")
+
+
+def process_text_extract(payloads):
+    """Extract text for a batch of documents; returns the index_queue messages to publish.
+
+    Uploaded files stay on disk: the text is streamed from the file again at
+    index time, so neither extracted_text nor the message carries a copy.
+    """
+    messages = []
+    with metrics.STAGE_SECONDS.time("extract"):
+        for shard, group in group_by_shard(payloads, key=lambda data: data["id"]).items():
+            messages.extend(_extract(shard, group))
+    metrics.STAGE_DOCUMENTS.inc(len(messages), "extract")
+    return messages
+
+
+def _extract(shard, payloads):
+    # Queued through POST /documents: the message carries the document itself,
+    # which replaces any stored copy (under a new version) before it is indexed
+    inline = {data["id"]: data for data in payloads if "content" in data}
+    with read_connection(shard) as db:
+        docs = fetch_documents(db, [data["id"] for data in payloads if data["id"] not in inline],
+                               "id, content, version, file_path")
+    extracted = []
+    failed = []
+    for data in payloads:
         doc_id = data["id"]
-        extracted = data["extracted"]
-        # Get document from DB
-        from .database import get_document_status
-        doc = get_document_status(doc_id)
-        if not doc:
+        if doc_id in inline:
+            continue
+        doc = docs.get(doc_id)
+        if doc is None:
             print(f"Document not found: {doc_id}")
-            return
-        update_document_status(doc_id, 'indexing')
-        # Tokenize and normalize: split by space, lowercase already done
-        tokens = extracted.split()
-        term_positions = {}
-        for pos, token in enumerate(tokens):
-            if token not in term_positions:
-                term_positions[token] = []
-            term_positions[token].append(pos)
-        # Store in inverted index with transaction
-        from .database import get_db
-        db = get_db()
+            continue
+        if doc["file_path"]:
+            if not os.path.exists(doc["file_path"]):
+                print(f"File not found: {doc['file_path']}")
+                failed.append(doc_id)
+                continue
+            extracted.append((doc_id, None, doc["version"]))
+        else:
+            # Extract plain text: simple lowercase
+            extracted.append((doc_id, (doc["content"] or "").lower(), doc["version"]))
+    with transaction(shard) as db:
+        for doc_id, data in inline.items():
+            insert_document(doc_id, data.get("title") or doc_id, data["content"], fields=data.get("fields"))
+        versions = fetch_versions(db, inline)
+        extracted.extend((doc_id, data["content"].lower(), versions[doc_id]) for doc_id, data in inline.items())
+        update_documents_status(failed, 'failed')
+        db.executemany("INSERT INTO extracted_text (doc_id, text, version) VALUES (?, ?, ?)", extracted)
+        update_documents_status([doc_id for doc_id, _, _ in extracted], 'indexing')
+    print(f"Text extracted for {len(extracted)} document(s)")
+    return [json.dumps({"id": doc_id}) for doc_id, _, _ in extracted]
+
+
+def process_index(payloads):
+    """Index a batch of extracted documents, one transaction per shard.
+
+    Documents are tokenized before the write transaction starts, so streaming
+    a large file does not hold the writer lock.
+    """
+    for shard, group in group_by_shard(payloads, key=lambda data: data["id"]).items():
+        _index(shard, group)
+    return []
+
+
+def _index(shard, payloads):
+    doc_ids = [data["id"] for data in payloads]
+    try:
+        with read_connection(shard) as db:
+            docs = fetch_documents(db, doc_ids, "id, title, content, version, file_path")
+        analyzer = get_analyzer()
+        postings = []
+        fts = []
+        with metrics.STAGE_SECONDS.time("index"):
+            for data in payloads:
+                doc = docs.get(data["id"])
+                if doc is None:
+                    print(f"Document not found: {data['id']}")
+                    continue
+                postings.append((doc["id"], doc["version"], analyzer.analyze(document_chunks(doc))))
+                fts.append((doc["id"], doc["title"], doc["content"]))
+        with metrics.STAGE_SECONDS.time("commit"), transaction(shard) as db:
+            write_postings(db, postings)
+            write_fts(db, fts)
+            update_documents_status([doc_id for doc_id, _, _ in postings], 'indexed')
+    except Exception as e:
+        update_documents_status(doc_ids, 'failed')
+        print(f"Indexing failed for batch of {len(doc_ids)}: {e}")
+        raise
+    metrics.STAGE_DOCUMENTS.inc(len(postings), "index")
+    metrics.STAGE_DOCUMENTS.inc(len(postings), "commit")
+    print(f"Indexed {len(postings)} document(s)")
+
+
+class BatchConsumer:
+    """Collects deliveries into batches bounded by size and time.
+
+    Each batch is handled on the worker pool and its messages are acked
+    together, or all nacked (dead-lettered) if the batch fails.
+    """
+
+    def __init__(self, handler, publish_to=None, batch_size=CONSUMER_BATCH_SIZE,
+                 batch_timeout=CONSUMER_BATCH_TIMEOUT, workers=CONSUMER_WORKERS):
+        self.handler = handler
+        self.publish_to = publish_to
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks = set()
+
+    async def on_message(self, message):
+        await self._queue.put(message)
+
+    async def next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            await self._slots.acquire()
+            task = asyncio.create_task(self.process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def process(self, batch):
         try:
-            db.execute("BEGIN TRANSACTION")
-            for term, positions in term_positions.items():
-                db.execute("INSERT OR REPLACE INTO inverted_index (term, doc_id, positions, version) VALUES (?, ?, ?, ?)",
-                           (term, doc_id, json.dumps(positions), doc['version']))
-            # Update FTS
-            db.execute("INSERT OR REPLACE INTO fts_documents (id, title, content) VALUES (?, ?, ?)",
-                       (doc_id, doc['title'], doc['content']))
-            db.execute("COMMIT")
-            update_document_status(doc_id, 'indexed')
-            print(f"Indexed document: {doc_id} with {len(term_positions)} terms")
-        except Exception as e:
-            db.execute("ROLLBACK")
-            update_document_status(doc_id, 'failed')
-            print(f"Indexing failed for {doc_id}: {e}")
+            messages = []
+            payloads = []
+            for message in batch:
+                try:
+                    payloads.append(json.loads(message.body.decode()))
+                    messages.append(message)
+                except ValueError:
+                    print("Dropping malformed message")
+                    await message.nack(requeue=False)
+            if not messages:
+                return
+            try:
+                loop = asyncio.get_running_loop()
+                outgoing = await loop.run_in_executor(_executor, self.handler, payloads)
+                if outgoing and self.publish_to:
+                    await publish_batch_to_queue(self.publish_to, outgoing)
+            except Exception as e:
+                print(f"Batch of {len(messages)} failed: {e}")
+                for message in messages:
+                    await message.nack(requeue=False)
+                return
+            for message in messages:
+                await message.ack()
         finally:
-            db.close()
+            self._slots.release()
+
 
 async def start_consumers():
     try:
-        connection = await get_connection()
-        async with connection:
-            channel = await connection.channel()
-            await channel.set_qos(prefetch_count=1)
-            # Consumer for text_extract_queue
-            text_queue = await channel.get_queue(TEXT_EXTRACT_QUEUE)
-            await text_queue.consume(process_text_extract)
-            # Consumer for index_queue
-            index_queue = await channel.get_queue(INDEX_QUEUE)
-            await index_queue.consume(process_index)
-            print("Consumers started. Waiting for messages...")
-            await asyncio.Future()  # Keep running
+        transport = get_transport()
+        extract_consumer = BatchConsumer(process_text_extract, publish_to=INDEX_QUEUE)
+        index_consumer = BatchConsumer(process_index)
+        # Consumer for text_extract_queue
+        await transport.consume(TEXT_EXTRACT_QUEUE, extract_consumer.on_message, CONSUMER_PREFETCH)
+        # Consumer for index_queue
+        await transport.consume(INDEX_QUEUE, index_consumer.on_message, CONSUMER_PREFETCH)
+        print(f"Consumers started (prefetch {CONSUMER_PREFETCH}, batch {CONSUMER_BATCH_SIZE}, "
+              f"{CONSUMER_WORKERS} workers). Waiting for messages...")
     except Exception as e:
-        print(f"Failed to start consumers: {e}. Processing will not happen.")
\ No newline at end of file
+        print(f"Failed to start consumers: {e}. Processing will not happen.")
+        return
+    await asyncio.gather(extract_consumer.run(), index_consumer.run())
@@ -1,203 +1,1329 @@
 import sqlite3
 import os
 import json
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from collections import Counter
+from heapq import merge
+from itertools import islice
+from .postings import encode_positions, decode_positions
+from .scoring import TopK, bm25_idf, bm25_term, bm25_upper_bound, blend_dfs, index_terms
+from .query import parse_query
+from . import analysis
+from . import metrics
+from . import segments
+from . import cache
+from . import shards
+from . import doc_values
+from . import dictionary
+from . import projection
 
-DATABASE_PATH = "elasticsearch.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "elasticsearch.db")
 UPLOAD_DIR = "app/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+READ_CHUNK = 1024 * 1024  # characters per chunk when streaming an uploaded file
+PREVIEW_CHARS = 1000  # an uploaded file keeps only this much text in documents.content
 
-def get_db():
-    db = sqlite3.connect(DATABASE_PATH)
-    db.execute("PRAGMA foreign_keys = ON")
+# Connection pool settings: one writer plus a bounded set of readers
+READER_POOL_SIZE = int(os.getenv("DB_READERS", "4"))
+READER_TIMEOUT = 30  # seconds to wait for a free reader connection
+STATEMENT_CACHE_SIZE = 256  # prepared statements cached per connection
+SCHEMA_VERSION = 4  # PRAGMA user_version; 2 = binary postings, 3 = BM25 statistics, 4 = term ids
+SEARCH_CHUNK = 256  # candidates scored per round of top-k pruning
+INDEX_ENGINE = os.getenv("INDEX_ENGINE", "sqlite")  # "sqlite" or "segment" (see segments.py)
+SHARDS = int(os.getenv("SHARDS", "1"))  # database files documents are hash-partitioned across
+
+# Applied to every pooled connection. WAL lets readers run alongside the
+# writer; synchronous=NORMAL is durable across application crashes in WAL mode.
+PRAGMAS = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",  # 256 MB
+    "PRAGMA cache_size = -16384",  # 16 MB
+]
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Reports time spent in execute/fetch calls to metrics, by statement class.
+
+    Each statement is recorded once, with its fetch time added to its execute
+    time: when its rows run out, when the cursor runs another statement or is
+    closed, or when it is dropped. Rows pulled by iterating the cursor
+    directly are not timed; that would cost a Python call per row.
+    """
+
+    _pending = None  # [sql, params, seconds] of the statement not recorded yet
+
+    def _record(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            metrics.record_statement(self.connection, *pending)
+
+    def execute(self, sql, params=()):
+        self._record()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._pending = [sql, params, time.perf_counter() - start]
+            if self.description is None:
+                self._record()  # no rows to fetch
+
+    def executemany(self, sql, seq_of_params):
+        self._record()
+        seq_of_params = seq_of_params if isinstance(seq_of_params, list) else list(seq_of_params)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._pending = [sql, seq_of_params[0] if seq_of_params else None, time.perf_counter() - start]
+            self._record()
+
+    def _timed_fetch(self, fetch, exhausted, *args):
+        start = time.perf_counter()
+        try:
+            rows = fetch(*args)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - start
+        if exhausted(rows):
+            self._record()
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone, lambda row: row is None)
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        return self._timed_fetch(super().fetchmany, lambda rows: len(rows) < size, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall, lambda rows: True)
+
+    def close(self):
+        self._record()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._record()
+        except Exception:
+            pass  # the connection may be closed already
+
+
+class Connection(sqlite3.Connection):
+    shard = 0  # the shard database this connection belongs to
+
+
+class TimedConnection(Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+def connect(path, shard=0):
+    # isolation_level=None: transactions are managed explicitly by ConnectionPool.writer()
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                         cached_statements=STATEMENT_CACHE_SIZE,
+                         factory=TimedConnection if metrics.SQL_TIMING else Connection)
     db.row_factory = sqlite3.Row  # For dict-like access
+    db.shard = shard
+    for pragma in PRAGMAS:
+        db.execute(pragma)
     return db
 
-def init_db():
-    db = get_db()
-    # Create documents table
+
+# Pools with a write transaction open on the current thread, innermost last (for on_commit)
+_writing = threading.local()
+
+
+class ConnectionPool:
+    """One serialized writer connection and a bounded queue of readers."""
+
+    def __init__(self, path, readers=READER_POOL_SIZE, shard=0):
+        self.path = path
+        self.shard = shard
+        self._writer = self._connect()
+        # Lets compaction hand free pages back to the OS; has no effect on a
+        # database that already has tables (that would need a full VACUUM)
+        self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._after_commit = []
+        self._readers = queue.LifoQueue(maxsize=readers)
+        self._active = {}  # thread id -> reader connection it holds
+        for _ in range(readers):
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON")
+            self._readers.put(conn)
+
+    def _connect(self):
+        return connect(self.path, self.shard)
+
+    @contextmanager
+    def reader(self):
+        try:
+            db = self._readers.get(timeout=READER_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a database reader connection")
+        thread_id = threading.get_ident()
+        self._active[thread_id] = db
+        try:
+            yield db
+        finally:
+            self._active.pop(thread_id, None)
+            self._readers.put(db)
+
+    def interrupt(self, thread_id):
+        # Abort the statement a thread is running on its reader connection
+        db = self._active.get(thread_id)
+        if db is not None:
+            db.interrupt()
+
+    @contextmanager
+    def writer(self):
+        # Re-entrant: nested writer() calls join the outermost transaction
+        with self._write_lock:
+            db = self._writer
+            outermost = self._write_depth == 0
+            if outermost:
+                db.execute("BEGIN IMMEDIATE")
+                _writing.__dict__.setdefault("pools", []).append(self)
+            self._write_depth += 1
+            try:
+                try:
+                    yield db
+                except BaseException:
+                    self._write_depth -= 1
+                    if outermost:
+                        self._after_commit.clear()
+                        db.execute("ROLLBACK")
+                    raise
+                self._write_depth -= 1
+                if outermost:
+                    db.execute("COMMIT")
+                    callbacks, self._after_commit = self._after_commit, []
+                    for callback in callbacks:
+                        callback()
+            finally:
+                if outermost:
+                    _writing.pools.pop()
+
+    def checkpoint(self, mode="PASSIVE"):
+        # Copy WAL frames into the main database file; must not be inside writer()
+        with self._write_lock:
+            return tuple(self._writer.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+    def after_commit(self, callback):
+        # Run `callback` once the current write transaction commits (dropped on rollback)
+        if self._write_depth == 0:
+            raise RuntimeError("after_commit() called outside a write transaction")
+        self._after_commit.append(callback)
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = None
+_pool_lock = threading.Lock()
+_caught_up = None  # the segment engine instance already caught up with SQLite
+_catch_up_lock = threading.Lock()
+_shard_writer = None
+
+
+def shard_path(shard):
+    # One shard keeps DATABASE_PATH itself; N shards live next to it as name.shard<i>.db
+    if SHARDS == 1:
+        return DATABASE_PATH
+    root, ext = os.path.splitext(DATABASE_PATH)
+    return f"{root}.shard{shard}{ext}"
+
+
+def shard_for(doc_id):
+    # crc32 rather than hash(): it must not change between runs
+    return zlib.crc32(doc_id.encode()) % SHARDS if SHARDS > 1 else 0
+
+
+def group_by_shard(items, key=lambda item: item):
+    """{shard: [items]} keeping the input order within each shard."""
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_for(key(item)), []).append(item)
+    return groups
+
+
+def get_pool(shard=0):
+    return get_pools()[shard]
+
+
+def get_pools():
+    # Created (and the schema initialized) on first use rather than at import
+    global _pools
+    if _pools is None:
+        with _pool_lock:
+            if _pools is None:
+                cache.term_ids.clear()
+                pools = []
+                for shard in range(SHARDS):
+                    pool = ConnectionPool(shard_path(shard), READER_POOL_SIZE, shard=shard)
+                    init_db(pool)
+                    pools.append(pool)
+                _pools = pools
+    return _pools
+
+
+def close_pool():
+    global _pools, _shard_writer
+    with _pool_lock:
+        writers, _shard_writer = _shard_writer, None
+    if writers is not None:
+        writers.shutdown(wait=True)
+    shards.close()
+    with _pool_lock:
+        if _pools is not None:
+            for pool in _pools:
+                pool.close()
+            _pools = None
+            cache.term_ids.clear()
+    doc_values.reset()
+    dictionary.get().clear()
+
+
+def get_analyzer():
+    # The analyzer the open index was built with (see init_db)
+    return get_pool().analyzer
+
+
+@contextmanager
+def read_connection(shard=0):
+    with get_pool(shard).reader() as db:
+        yield db
+
+
+@contextmanager
+def transaction(shard=0):
+    with get_pool(shard).writer() as db:
+        yield db
+
+
+def on_commit(callback):
+    # Joins the innermost write transaction open on this thread, whichever shard it is on
+    pools = getattr(_writing, "pools", None)
+    (pools[-1] if pools else get_pool()).after_commit(callback)
+
+
+def init_db(pool=None):
+    pool = pool or get_pool()
+    with pool.writer() as db:
+        schema_version = db.execute("PRAGMA user_version").fetchone()[0]
+        # Create documents table
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                content TEXT,
+                version INTEGER DEFAULT 1,
+                status TEXT DEFAULT 'uploaded',
+                file_path TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+        """)
+        # Add columns if not exist (for migration)
+        columns = {row["name"] for row in db.execute("PRAGMA table_info(documents)")}
+        if "status" not in columns:
+            db.execute("ALTER TABLE documents ADD COLUMN status TEXT DEFAULT 'uploaded'")
+        if "file_path" not in columns:
+            db.execute("ALTER TABLE documents ADD COLUMN file_path TEXT")
+        # Create extracted_text table
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS extracted_text (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_id TEXT,
+                text TEXT,
+                version INTEGER,
+                FOREIGN KEY (doc_id) REFERENCES documents(id)
+            );
+        """)
+        # Deletes and compaction look rows up per document
+        db.execute("CREATE INDEX IF NOT EXISTS idx_extracted_text_doc ON extracted_text (doc_id, id)")
+        # /metrics counts documents per status on every scrape
+        db.execute("CREATE INDEX IF NOT EXISTS idx_documents_status ON documents (status)")
+        # Index settings fixed at creation time
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # Term dictionary: postings key on the integer id. Ids are never reused
+        # (AUTOINCREMENT), so a cached term -> id mapping can't go stale.
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS terms (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                term TEXT UNIQUE NOT NULL,
+                df INTEGER DEFAULT 0  -- number of live documents containing the term
+            );
+        """)
+        # Create inverted_index table
+        index_columns = {row["name"] for row in db.execute("PRAGMA table_info(inverted_index)")}
+        if index_columns and "tf" not in index_columns:
+            migrate_json_postings(db)
+            index_columns = {"term"}
+        if "term" in index_columns:
+            migrate_term_ids(db)
+        # Postings only match queries analyzed the same way, so the analyzer is
+        # recorded with the index. Indexes from before schema 4 were built by
+        # lower().split(), which is the "whitespace" analyzer.
+        default_analyzer = "whitespace" if index_columns else analysis.DEFAULT_ANALYZER
+        db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('analyzer', ?)", (default_analyzer,))
+        analyzer = db.execute("SELECT value FROM settings WHERE key = 'analyzer'").fetchone()[0]
+        if analyzer != analysis.DEFAULT_ANALYZER:
+            print(f"Index was built with the '{analyzer}' analyzer; ANALYZER={analysis.DEFAULT_ANALYZER} "
+                  f"applies to new databases only")
+        pool.analyzer = analysis.get_analyzer(analyzer)
+        # Documents are routed by hash modulo the shard count, so it can't change without a re-index
+        db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('shards', ?)", (str(SHARDS),))
+        shard_count = int(db.execute("SELECT value FROM settings WHERE key = 'shards'").fetchone()[0])
+        if shard_count != SHARDS:
+            raise RuntimeError(f"{pool.path} belongs to an index of {shard_count} shard(s), not SHARDS={SHARDS}; "
+                               f"re-index to change the shard count")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS inverted_index (
+                term_id INTEGER,  -- terms.id
+                doc_id TEXT,
+                version INTEGER,
+                tf INTEGER,  -- term frequency, so scoring never decodes positions
+                positions BLOB,  -- delta + varint encoded, see postings.py
+                PRIMARY KEY (term_id, doc_id, version),
+                FOREIGN KEY (doc_id) REFERENCES documents(id)
+            );
+        """)
+        # Per-document lookups (stats maintenance, deletes, terms_count) would otherwise scan
+        db.execute("CREATE INDEX IF NOT EXISTS idx_inverted_index_doc ON inverted_index (doc_id, version, term_id)")
+        # Create FTS virtual table for search
+        db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS fts_documents USING fts5(
+                id UNINDEXED,
+                title,
+                content,
+                tokenize = 'porter unicode61'
+            );
+        """)
+        # BM25 statistics, maintained by write_postings() and _delete_batch()
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS doc_stats (
+                doc_id TEXT PRIMARY KEY,
+                version INTEGER,  -- version whose postings are live
+                length INTEGER  -- number of tokens
+            );
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS corpus_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                doc_count INTEGER,
+                total_length INTEGER
+            );
+        """)
+        db.execute("INSERT OR IGNORE INTO corpus_stats (id, doc_count, total_length) VALUES (1, 0, 0)")
+        # Corpus totals follow doc_stats automatically
+        db.execute("""
+            CREATE TRIGGER IF NOT EXISTS doc_stats_insert AFTER INSERT ON doc_stats BEGIN
+                UPDATE corpus_stats SET doc_count = doc_count + 1, total_length = total_length + NEW.length WHERE id = 1;
+            END;
+        """)
+        db.execute("""
+            CREATE TRIGGER IF NOT EXISTS doc_stats_update AFTER UPDATE ON doc_stats BEGIN
+                UPDATE corpus_stats SET total_length = total_length - OLD.length + NEW.length WHERE id = 1;
+            END;
+        """)
+        db.execute("""
+            CREATE TRIGGER IF NOT EXISTS doc_stats_delete AFTER DELETE ON doc_stats BEGIN
+                UPDATE corpus_stats SET doc_count = doc_count - 1, total_length = total_length - OLD.length WHERE id = 1;
+            END;
+        """)
+        # Structured fields (see doc_values.py); doc is documents.rowid
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS fields (
+                name TEXT PRIMARY KEY,
+                type TEXT  -- number, date (epoch ms) or keyword
+            );
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS doc_values (
+                field TEXT,
+                doc INTEGER,
+                value,
+                PRIMARY KEY (field, doc)
+            ) WITHOUT ROWID;
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_doc_values_doc ON doc_values (doc)")
+        if schema_version < 4:
+            db.execute("DROP TABLE IF EXISTS term_stats")  # df moved into terms
+            rebuild_index_stats(db)
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def rebuild_index_stats(db):
+    # Recompute BM25 statistics from the live (current version) postings
+    db.execute("DELETE FROM doc_stats")
+    db.execute("UPDATE corpus_stats SET doc_count = 0, total_length = 0 WHERE id = 1")
     db.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            content TEXT,
-            version INTEGER DEFAULT 1,
-            status TEXT DEFAULT 'uploaded',
-            file_path TEXT,
-            created_at TEXT,
-            updated_at TEXT
-        );
+        INSERT INTO doc_stats (doc_id, version, length)
+        SELECT d.id, d.version, SUM(i.tf) FROM documents d
+        JOIN inverted_index i ON i.doc_id = d.id AND i.version = d.version
+        GROUP BY d.id
     """)
-    # Add columns if not exist (for migration)
-    try:
-        db.execute("ALTER TABLE documents ADD COLUMN status TEXT DEFAULT 'uploaded'")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        db.execute("ALTER TABLE documents ADD COLUMN file_path TEXT")
-    except sqlite3.OperationalError:
-        pass
-    # Create extracted_text table
     db.execute("""
-        CREATE TABLE IF NOT EXISTS extracted_text (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        UPDATE terms SET df = (
+            SELECT COUNT(*) FROM inverted_index i
+            JOIN doc_stats s ON s.doc_id = i.doc_id AND s.version = i.version
+            WHERE i.term_id = terms.id
+        )
+    """)
+
+
+def migrate_json_postings(db, batch_size=10000):
+    # Schema 1 -> 2: rewrite JSON position arrays as binary postings with tf
+    print("Migrating inverted_index to binary postings...")
+    db.execute("ALTER TABLE inverted_index RENAME TO inverted_index_json")
+    db.execute("""
+        CREATE TABLE inverted_index (
+            term TEXT,
             doc_id TEXT,
-            text TEXT,
             version INTEGER,
+            tf INTEGER,
+            positions BLOB,
+            PRIMARY KEY (term, doc_id, version),
             FOREIGN KEY (doc_id) REFERENCES documents(id)
         );
     """)
-    # Create inverted_index table
+    # Orphaned postings (document since removed) would fail the foreign key; drop them
+    cursor = db.execute("""
+        SELECT term, doc_id, version, positions FROM inverted_index_json
+        WHERE doc_id IN (SELECT id FROM documents) ORDER BY term, doc_id
+    """)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        converted = []
+        for term, doc_id, version, positions in rows:
+            positions = sorted(json.loads(positions))
+            converted.append((term, doc_id, version, len(positions), encode_positions(positions)))
+        db.executemany("INSERT OR REPLACE INTO inverted_index (term, doc_id, version, tf, positions) VALUES (?, ?, ?, ?, ?)",
+                       converted)
+    db.execute("DROP TABLE inverted_index_json")
+
+
+def migrate_term_ids(db):
+    # Schema 3 -> 4: replace the term text in every posting with its terms.id
+    print("Migrating inverted_index to term ids...")
+    db.execute("ALTER TABLE inverted_index RENAME TO inverted_index_text")
+    db.execute("DROP INDEX IF EXISTS idx_inverted_index_doc")
+    db.execute("INSERT OR IGNORE INTO terms (term) SELECT DISTINCT term FROM inverted_index_text ORDER BY term")
     db.execute("""
-        CREATE TABLE IF NOT EXISTS inverted_index (
-            term TEXT,
+        CREATE TABLE inverted_index (
+            term_id INTEGER,
             doc_id TEXT,
-            positions TEXT,  -- JSON array of positions
             version INTEGER,
-            PRIMARY KEY (term, doc_id, version),
+            tf INTEGER,
+            positions BLOB,
+            PRIMARY KEY (term_id, doc_id, version),
             FOREIGN KEY (doc_id) REFERENCES documents(id)
         );
     """)
-    # Create FTS virtual table for search
     db.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS fts_documents USING fts5(
-            id UNINDEXED,
-            title,
-            content,
-            tokenize = 'porter unicode61'
-        );
+        INSERT INTO inverted_index (term_id, doc_id, version, tf, positions)
+        SELECT t.id, i.doc_id, i.version, i.tf, i.positions FROM inverted_index_text i
+        JOIN terms t ON t.term = i.term ORDER BY t.id, i.doc_id
     """)
-    db.commit()
-    db.close()
+    db.execute("DROP TABLE inverted_index_text")
 
-# Call init_db on import
-init_db()
 
-def insert_document(doc_id, title, content, file_path=None):
-    db = get_db()
+def insert_document(doc_id, title, content, file_path=None, fields=None):
     now = datetime.now().isoformat()
-    db.execute("""
-        INSERT OR REPLACE INTO documents (id, title, content, status, file_path, created_at, updated_at)
-        VALUES (?, ?, ?, 'uploaded', ?, ?, ?)
-    """, (doc_id, title, content, file_path, now, now))
-    db.commit()
-    db.close()
+    with transaction(shard_for(doc_id)) as db:
+        # Upsert rather than REPLACE so the row keeps its rowid (shared with fts_documents).
+        # Versions only go up, so postings of an older version can never become live again.
+        db.execute("""
+            INSERT INTO documents (id, title, content, status, file_path, created_at, updated_at)
+            VALUES (?, ?, ?, 'uploaded', ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET title = excluded.title, content = excluded.content,
+                version = documents.version + 1,
+                status = 'uploaded', file_path = excluded.file_path, created_at = excluded.created_at,
+                updated_at = excluded.updated_at
+        """, (doc_id, title, content, file_path, now, now))
+        doc_values.write(db, [(doc_id, fields)])
+        # Cached search results carry title/content
+        on_commit(lambda: cache.invalidate_terms(()))
+
 
 def update_document_status(doc_id, status):
-    db = get_db()
+    update_documents_status([doc_id], status)
+
+
+def update_documents_status(doc_ids, status):
     now = datetime.now().isoformat()
-    db.execute("""
-        UPDATE documents SET status = ?, updated_at = ? WHERE id = ?
-    """, (status, now, doc_id))
-    db.commit()
-    db.close()
+    for shard, ids in group_by_shard(doc_ids).items():
+        with transaction(shard) as db:
+            db.executemany("""
+                UPDATE documents SET status = ?, updated_at = ? WHERE id = ?
+            """, [(status, now, doc_id) for doc_id in ids])
 
-def add_document(doc_id, title, content):
-    db = get_db()
+
+def read_chunks(file_path, size=None):
+    # Text of an uploaded file, decoded incrementally
+    size = size or READ_CHUNK
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def document_chunks(doc):
+    # Uploaded files are read back in chunks; inline documents are already in the row
+    if doc["file_path"]:
+        return read_chunks(doc["file_path"])
+    return [doc["content"] or ""]
+
+
+def term_ids(db, terms, create=False):
+    """{term: terms.id} for the given terms; unknown ones are added if `create`.
+
+    Ids are cached once committed. Inside a write transaction new ids are
+    cached only after commit, since a rollback would hand them out again.
+    """
+    ids = {}
+    missing = []
+    for term in terms:
+        term_id = cache.term_ids.get((db.shard, term))
+        if term_id is None:
+            missing.append(term)
+        else:
+            ids[term] = term_id
+    if not missing:
+        return ids
+    if create:
+        db.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(term,) for term in missing])
+    found = {}
+    for chunk in batches(missing):
+        placeholders = ",".join("?" * len(chunk))
+        for term, term_id in db.execute(f"SELECT term, id FROM terms WHERE term IN ({placeholders})", chunk):
+            found[term] = term_id
+    ids.update(found)
+    if db.in_transaction:
+        on_commit(lambda: _remember_term_ids(found, db.shard))
+    else:
+        _remember_term_ids(found, db.shard)
+    return ids
+
+
+def _remember_term_ids(ids, shard=0):
+    # Each shard has its own terms table, so ids are cached per shard
+    for term, term_id in ids.items():
+        cache.term_ids.put((shard, term), term_id, len(term) + 64)
+
+
+def _live_term_ids(db, doc_ids):
+    # Counter of term_id -> live postings among doc_ids, plus id -> term text
+    old_df = Counter()
+    names = {}
+    for doc_id, version in fetch_stats_versions(db, doc_ids).items():
+        for term_id, term in db.execute("""
+            SELECT i.term_id, t.term FROM inverted_index i JOIN terms t ON t.id = i.term_id
+            WHERE i.doc_id = ? AND i.version = ?
+        """, (doc_id, version)):
+            old_df[term_id] += 1
+            names[term_id] = term
+    return old_df, names
+
+
+def update_index_stats(db, postings, ids):
+    # postings: list of (doc_id, version, term_positions) about to become live;
+    # ids: term -> id for all their terms. Must run before the postings are
+    # written so the previous version is still there.
+    # Returns every term whose postings change.
+    previous = fetch_stats_versions(db, [doc_id for doc_id, _, _ in postings])
+    old_df, names = _live_term_ids(db, list(previous))
+    db.executemany("UPDATE terms SET df = df - ? WHERE id = ?", [(n, term_id) for term_id, n in old_df.items()])
+    # Retire rows at or above the incoming version (a re-index at the same version,
+    # or orphans of a newer one) so only its own postings are live; older versions
+    # are never live again and are left to compaction
+    db.executemany("DELETE FROM inverted_index WHERE doc_id = ? AND version >= ?",
+                   [(doc_id, version) for doc_id, version, _ in postings])
+    df = Counter(term for _, _, term_positions in postings for term in term_positions)
+    db.executemany("UPDATE terms SET df = df + ? WHERE id = ?", [(n, ids[term]) for term, n in df.items()])
+    deltas = Counter(df)
+    deltas.subtract({names[term_id]: n for term_id, n in old_df.items()})
+    on_commit(lambda: dictionary.get().update(deltas))
+    db.executemany("""
+        INSERT INTO doc_stats (doc_id, version, length) VALUES (?, ?, ?)
+        ON CONFLICT(doc_id) DO UPDATE SET version = excluded.version, length = excluded.length
+    """, [(doc_id, version, sum(len(p) for p in term_positions.values()))
+          for doc_id, version, term_positions in postings])
+    return set(names.values()) | df.keys()
+
+
+def write_postings(db, postings):
+    # postings: iterable of (doc_id, version, term_positions). Rows are sorted into
+    # primary-key order so a large batch appends to B-tree pages instead of scattering.
+    postings = list(postings)
+    if INDEX_ENGINE == "segment":
+        # The engine's buffer is not part of the SQLite transaction: it only takes
+        # the postings once they commit, so a rollback leaves nothing behind. It is
+        # opened (and caught up) first so the catch-up cannot replay this batch too.
+        engine = segment_engine()
+        entries = _segment_entries(postings)
+        on_commit(lambda: engine.add_many(entries))
+        df = Counter(term for _, _, term_positions in postings for term in term_positions)
+        on_commit(lambda: cache.invalidate_terms(df.keys(), db.shard))
+        on_commit(lambda: dictionary.get().update(df))  # segment dfs count deleted copies too
+        return
+    ids = term_ids(db, {term for _, _, term_positions in postings for term in term_positions}, create=True)
+    changed = update_index_stats(db, postings, ids)
+    on_commit(lambda: cache.invalidate_terms(changed, db.shard))
+    rows = [(ids[term], doc_id, version, len(positions), encode_positions(positions))
+            for doc_id, version, term_positions in postings
+            for term, positions in term_positions.items()]
+    rows.sort(key=lambda row: (row[0], row[1]))
+    db.executemany("INSERT OR REPLACE INTO inverted_index (term_id, doc_id, version, tf, positions) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def _segment_entries(postings):
+    return [(doc_id, version, {term: (len(p), encode_positions(p)) for term, p in term_positions.items()},
+             sum(len(p) for p in term_positions.values()))
+            for doc_id, version, term_positions in postings]
+
+
+def segment_engine():
+    """The segment engine, caught up with the documents table when it opens.
+
+    Buffered documents reach disk only when the engine flushes, so after a
+    crash the segments can be behind SQLite: indexed documents they lack (or
+    hold at an older version) are re-analyzed, and deleted ones dropped.
+    """
+    global _caught_up
+    engine = segments.get_engine()
+    if _caught_up is not engine:
+        with _catch_up_lock:
+            if _caught_up is not engine:
+                _catch_up(engine)
+                _caught_up = engine
+    return engine
+
+
+def _catch_up(engine):
+    live = engine.versions()
+    known = set()
+    analyzer = get_analyzer()
+    for shard in range(SHARDS):
+        with read_connection(shard) as db:
+            stale = []
+            for doc_id, version, status in db.execute("SELECT id, version, status FROM documents"):
+                known.add(doc_id)
+                if status == "indexed" and live.get(doc_id, 0) < version:
+                    stale.append(doc_id)
+            docs = fetch_documents(db, stale, "id, version, content, file_path")
+        engine.add_many(_segment_entries(
+            [(doc["id"], doc["version"], analyzer.analyze(document_chunks(doc))) for doc in docs.values()]))
+    engine.delete_many([doc_id for doc_id in live if doc_id not in known])
+    engine.flush()
+
+
+def write_fts(db, docs):
+    # docs: list of (doc_id, title, content). FTS rows share the documents rowid so
+    # replacing one is a rowid lookup instead of a scan over the UNINDEXED id column.
+    db.executemany("DELETE FROM fts_documents WHERE rowid = (SELECT rowid FROM documents WHERE id = ?)",
+                   [(doc_id,) for doc_id, _, _ in docs])
+    db.executemany("""
+        INSERT INTO fts_documents (rowid, id, title, content)
+        SELECT rowid, id, ?, ? FROM documents WHERE id = ?
+    """, [(title, content, doc_id) for doc_id, title, content in docs])
+
+
+def batches(items, size=500):
+    # Slices of `items` small enough for one IN (...) list
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def fetch_versions(db, doc_ids):
+    versions = {}
+    for chunk in batches(list(doc_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for row in db.execute(f"SELECT id, version FROM documents WHERE id IN ({placeholders})", chunk):
+            versions[row[0]] = row[1]
+    return versions
+
+
+def fetch_stats_versions(db, doc_ids):
+    # Live postings version per document, from doc_stats
+    versions = {}
+    for chunk in batches(list(doc_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for row in db.execute(f"SELECT doc_id, version FROM doc_stats WHERE doc_id IN ({placeholders})", chunk):
+            versions[row[0]] = row[1]
+    return versions
+
+
+def _index_batch(db, docs):
+    # docs: list of (doc_id, title, content[, fields]); later duplicates win
+    docs = list({doc[0]: doc for doc in docs}.values())
+    fields = [(doc[0], doc[3] if len(doc) > 3 else None) for doc in docs]
+    docs = [doc[:3] for doc in docs]
     now = datetime.now().isoformat()
-    # Update status to indexing
-    update_document_status(doc_id, 'indexing')
-    # Insert or update document
-    db.execute("""
-        UPDATE documents SET title = ?, content = ?, version = version + 1, updated_at = ?, status = 'indexed'
-        WHERE id = ?
-    """, (title, content, now, doc_id))
-    # Get current version
-    cursor = db.execute("SELECT version FROM documents WHERE id = ?", (doc_id,))
-    version = cursor.fetchone()[0]
+    db.executemany("""
+        INSERT INTO documents (id, title, content, version, status, created_at, updated_at)
+        VALUES (?, ?, ?, 1, 'indexed', ?, ?)
+        ON CONFLICT(id) DO UPDATE SET title = excluded.title, content = excluded.content,
+            version = version + 1, status = 'indexed', updated_at = excluded.updated_at
+    """, [(doc_id, title, content, now, now) for doc_id, title, content in docs])
+    versions = fetch_versions(db, [doc[0] for doc in docs])
+    doc_values.write(db, fields)
     # Extract text (simple: just content lowercased)
-    extracted = content.lower()
-    db.execute("INSERT INTO extracted_text (doc_id, text, version) VALUES (?, ?, ?)", (doc_id, extracted, version))
-    # Build inverted index (simple tokenization)
-    tokens = extracted.split()
-    term_positions = {}
-    for pos, token in enumerate(tokens):
-        if token not in term_positions:
-            term_positions[token] = []
-        term_positions[token].append(pos)
-    for term, positions in term_positions.items():
-        db.execute("INSERT OR REPLACE INTO inverted_index (term, doc_id, positions, version) VALUES (?, ?, ?, ?)",
-                   (term, doc_id, json.dumps(positions), version))
-    # Update FTS
-    db.execute("INSERT OR REPLACE INTO fts_documents (id, title, content) VALUES (?, ?, ?)", (doc_id, title, content))
-    db.commit()
-    db.close()
+    db.executemany("INSERT INTO extracted_text (doc_id, text, version) VALUES (?, ?, ?)",
+                   [(doc_id, content.lower(), versions[doc_id]) for doc_id, _, content in docs])
+    analyzer = get_analyzer()
+    write_postings(db, [(doc_id, versions[doc_id], analyzer.analyze([content])) for doc_id, _, content in docs])
+    write_fts(db, docs)
+    return versions
+
+
+def _delete_batch(db, doc_ids):
+    existing = fetch_versions(db, doc_ids)
+    params = [(doc_id,) for doc_id in existing]
+    if INDEX_ENGINE == "segment":
+        engine = segment_engine()
+        on_commit(lambda: engine.delete_many(list(existing)))
+    old_df, names = _live_term_ids(db, list(existing))
+    db.executemany("UPDATE terms SET df = df - ? WHERE id = ?", [(n, term_id) for term_id, n in old_df.items()])
+    on_commit(lambda: cache.invalidate_terms(names.values(), db.shard))
+    on_commit(lambda: dictionary.get().update({names[term_id]: -n for term_id, n in old_df.items()}))
+    db.executemany("DELETE FROM doc_stats WHERE doc_id = ?", params)
+    doc_values.delete(db, list(existing))
+    db.executemany("DELETE FROM fts_documents WHERE rowid = (SELECT rowid FROM documents WHERE id = ?)", params)
+    db.executemany("DELETE FROM inverted_index WHERE doc_id = ?", params)
+    db.executemany("DELETE FROM extracted_text WHERE doc_id = ?", params)
+    db.executemany("DELETE FROM documents WHERE id = ?", params)
+    return existing
+
+
+def bulk_write(ops):
+    """Apply ("index", id, title, content[, fields]) / ("delete", id) ops.
+
+    Ops are split by shard; each shard's share is written in one transaction,
+    and different shards are written in parallel. Consecutive ops of the same
+    kind are written together with executemany. Returns one (action, id,
+    status, result) tuple per op, in order.
+    """
+    groups = group_by_shard(range(len(ops)), key=lambda i: ops[i][1])
+    if len(groups) <= 1:
+        return _bulk_write_shard(next(iter(groups), 0), ops)
+    futures = {shard: _shard_writers().submit(_bulk_write_shard, shard, [ops[i] for i in indexes])
+               for shard, indexes in groups.items()}
+    results = [None] * len(ops)
+    for shard, indexes in groups.items():
+        for i, result in zip(indexes, futures[shard].result()):
+            results[i] = result
+    return results
+
+
+def _shard_writers():
+    global _shard_writer
+    with _pool_lock:
+        if _shard_writer is None:
+            _shard_writer = ThreadPoolExecutor(max_workers=SHARDS, thread_name_prefix="shard-write")
+    return _shard_writer
+
+
+def _bulk_write_shard(shard, ops):
+    results = []
+    with metrics.STAGE_SECONDS.time("commit"), transaction(shard) as db:
+        i = 0
+        while i < len(ops):
+            action = ops[i][0]
+            j = i
+            while j < len(ops) and ops[j][0] == action:
+                j += 1
+            run = ops[i:j]
+            if action == "index":
+                versions = _index_batch(db, [op[1:] for op in run])
+                for op in run:
+                    created = versions[op[1]] == 1
+                    results.append((action, op[1], 201 if created else 200, "created" if created else "updated"))
+            else:
+                existing = _delete_batch(db, [op[1] for op in run])
+                for op in run:
+                    found = op[1] in existing
+                    existing.pop(op[1], None)
+                    results.append((action, op[1], 200 if found else 404, "deleted" if found else "not_found"))
+            i = j
+    metrics.STAGE_DOCUMENTS.inc(len(ops), "commit")
+    return results
+
+
+def add_documents(docs):
+    versions = {}
+    for shard, group in group_by_shard(docs, key=lambda doc: doc[0]).items():
+        with transaction(shard) as db:
+            versions.update(_index_batch(db, group))
+    return versions
+
+
+def add_document(doc_id, title, content):
+    add_documents([(doc_id, title, content)])
+
+
+def get_document(doc_id):
+    # Full row (including content and file_path) for the processing pipeline
+    with read_connection(shard_for(doc_id)) as db:
+        row = db.execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
+    return dict(row) if row else None
+
 
 def get_document_status(doc_id):
-    db = get_db()
-    cursor = db.execute("SELECT id, title, status, version, created_at, updated_at FROM documents WHERE id = ?", (doc_id,))
-    row = cursor.fetchone()
-    db.close()
-    if row:
-        status = dict(row)
-        # Add terms count
-        db = get_db()
-        cursor = db.execute("SELECT COUNT(*) FROM inverted_index WHERE doc_id = ?", (doc_id,))
-        status['terms_count'] = cursor.fetchone()[0]
-        db.close()
-        return status
-    return None
-
-def search_documents(query, limit=10):
-    terms = query.lower().split()
-    if not terms:
-        return []
-    db = get_db()
-    # Get docs for each term
-    term_docs = {}
+    with read_connection(shard_for(doc_id)) as db:
+        row = db.execute("""
+            SELECT id, title, status, version, created_at, updated_at,
+                   (SELECT COUNT(*) FROM inverted_index WHERE doc_id = documents.id) AS terms_count
+            FROM documents WHERE id = ?
+        """, (doc_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def document_status_counts():
+    counts = Counter()
+    for shard in range(SHARDS):
+        with read_connection(shard) as db:
+            counts.update(dict(db.execute("SELECT status, COUNT(*) FROM documents GROUP BY status").fetchall()))
+    return dict(counts)
+
+
+def corpus_totals(db, terms):
+    """(doc_count, total_length, {term: df}) of one database; shards sum these."""
+    doc_count, total_length = db.execute("SELECT doc_count, total_length FROM corpus_stats WHERE id = 1").fetchone()
+    dfs = {}
     for term in terms:
-        cursor = db.execute("SELECT doc_id, positions FROM inverted_index WHERE term = ?", (term,))
-        docs = cursor.fetchall()
-        term_docs[term] = {doc[0]: len(json.loads(doc[1])) for doc in docs}  # doc_id: term_freq
-    # Find docs that have all terms (AND)
-    if not term_docs:
-        db.close()
+        row = db.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+        dfs[term] = row[0] if row else 0
+    return doc_count, total_length, dfs
+
+
+def term_dfs():
+    """{term: df} of every live term in the index, for the term dictionary."""
+    if INDEX_ENGINE == "segment":
+        return segment_engine().term_dfs()
+    dfs = Counter()
+    for shard in range(SHARDS):
+        with read_connection(shard) as db:
+            for term, df in db.execute("SELECT term, df FROM terms WHERE df > 0"):
+                dfs[term] += df
+    return dict(dfs)
+
+
+def collect_stats(db, terms):
+    """(doc_count, avg_length, {term: df}) for BM25."""
+    doc_count, total_length, dfs = corpus_totals(db, terms)
+    return doc_count, (total_length / doc_count if doc_count else 0.0), dfs
+
+
+def _probe_postings(db, term_id, doc_ids):
+    # tf of a term in each of `doc_ids` (live versions only), via the primary key
+    found = {}
+    for chunk in batches(doc_ids):
+        placeholders = ",".join("?" * len(chunk))
+        for doc_id, tf in db.execute(f"""
+            SELECT i.doc_id, i.tf FROM inverted_index i
+            JOIN doc_stats s ON s.doc_id = i.doc_id AND s.version = i.version
+            WHERE i.term_id = ? AND i.doc_id IN ({placeholders})
+        """, (term_id, *chunk)):
+            found[doc_id] = tf
+    return found
+
+
+def _probe_positions(db, term_id, doc_ids):
+    # Encoded positions of a term in each of `doc_ids` (live versions only)
+    found = {}
+    for chunk in batches(doc_ids):
+        placeholders = ",".join("?" * len(chunk))
+        for doc_id, positions in db.execute(f"""
+            SELECT i.doc_id, i.positions FROM inverted_index i
+            JOIN doc_stats s ON s.doc_id = i.doc_id AND s.version = i.version
+            WHERE i.term_id = ? AND i.doc_id IN ({placeholders})
+        """, (term_id, *chunk)):
+            found[doc_id] = positions
+    return found
+
+
+def term_positions(db, doc_ids, terms):
+    """{doc_id: {term: encoded positions}} of index `terms` in the live versions
+    of `doc_ids` (documents of `db`'s shard), from the engine in use."""
+    if INDEX_ENGINE == "segment":
+        return segment_engine().positions(terms, doc_ids)
+    found = {}
+    for term, term_id in term_ids(db, terms).items():
+        for doc_id, blob in _probe_positions(db, term_id, list(doc_ids)).items():
+            found.setdefault(doc_id, {})[term] = blob
+    return found
+
+
+def _filter_positional(db, doc_ids, constraints, ids):
+    # Keep documents satisfying every phrase/proximity clause
+    for constraint in constraints:
+        if not doc_ids:
+            break
+        blobs = {term: _probe_positions(db, ids[term], doc_ids) for term in set(constraint.terms)}
+        doc_ids = [doc_id for doc_id in doc_ids
+                   if constraint.matches({term: found[doc_id] for term, found in blobs.items()})]
+    return doc_ids
+
+
+def _term_postings(db, term, term_id):
+    # Live (doc_id, tf, length) rows for a term, through the postings cache
+    rows = cache.postings.get((db.shard, term))
+    if rows is None:
+        generation = cache.generation()
+        rows = db.execute("""
+            SELECT i.doc_id, i.tf, s.length FROM inverted_index i
+            JOIN doc_stats s ON s.doc_id = i.doc_id AND s.version = i.version
+            WHERE i.term_id = ?
+        """, (term_id,)).fetchall()
+        rows = [tuple(row) for row in rows]
+        cache.put_postings((db.shard, term), rows, generation)
+    return rows
+
+
+def _clause_postings(db, terms, ids):
+    # Live (doc_id, tf, length) rows of one query term, summed over its expansions
+    if len(terms) == 1:
+        return _term_postings(db, terms[0], ids[terms[0]])
+    merged = {}
+    for term in terms:
+        for doc_id, tf, length in _term_postings(db, term, ids[term]):
+            row = merged.get(doc_id)
+            merged[doc_id] = (doc_id, row[1] + tf if row else tf, length)
+    return list(merged.values())
+
+
+def _clause_probe(db, terms, ids, doc_ids):
+    # {doc_id: tf} of one query term among `doc_ids`, summed over its expansions
+    if len(terms) == 1:
+        return _probe_postings(db, ids[terms[0]], doc_ids)
+    found = Counter()
+    for term in terms:
+        found.update(_probe_postings(db, ids[term], doc_ids))
+    return found
+
+
+def _clauses(db, terms, expansions):
+    # (ids, {query term: its index terms present in this database}), or None if one has none
+    ids = term_ids(db, index_terms(terms, expansions))
+    clauses = {term: [t for t in expansions.get(term, [term]) if t in ids] for term in terms}
+    if not terms or not all(clauses.values()):
+        return None  # with corpus-wide `stats`, this shard may lack a term
+    return ids, clauses
+
+
+def search_index(db, terms, limit, stats=None, constraints=(), after=None, allowed=None, expansions=None):
+    """BM25 top-k (score, doc_id) over documents containing every term.
+
+    `after` is a (score, doc_id) search_after cursor: only hits ranked below
+    it are returned, so pages are computed without an offset.
+
+    Candidates come from the rarest term's postings and are visited in order
+    of their partial score; the other terms are probed only for candidates
+    whose partial score plus the remaining terms' upper bounds can still beat
+    the current k-th best (MaxScore-style pruning). Phrase and proximity
+    constraints are checked against stored positions only for survivors.
+
+    `stats` overrides the database's own BM25 statistics; sharded search
+    passes corpus-wide ones so scores are comparable across shards.
+    `allowed`, a set of doc_ids, restricts the hits to those documents.
+    `expansions` maps prefix and fuzzy query terms to the index terms they
+    stand for (see dictionary.expand).
+    """
+    expansions = expansions or {}
+    doc_count, avg_length, dfs = stats or collect_stats(db, index_terms(terms, expansions))
+    dfs = blend_dfs(dfs, expansions)
+    if not terms or any(dfs.get(term, 0) == 0 for term in terms):
+        return []
+    found = _clauses(db, terms, expansions)
+    if found is None:
         return []
-    common_docs = set(term_docs[terms[0]].keys())
-    for term in terms[1:]:
-        common_docs &= set(term_docs[term].keys())
-    # Calculate scores: sum of term frequencies
-    scores = {}
-    for doc_id in common_docs:
-        score = sum(term_docs[term][doc_id] for term in terms if doc_id in term_docs[term])
-        scores[doc_id] = score
-    # Sort by score desc
-    sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
-    # Get document details
+    ids, clauses = found
+    idfs = {term: bm25_idf(doc_count, dfs[term]) for term in terms}
+    rarest, *rest = sorted(terms, key=lambda term: dfs[term])
+    candidates = [(bm25_term(idfs[rarest], tf, length, avg_length), doc_id, length)
+                  for doc_id, tf, length in _clause_postings(db, clauses[rarest], ids)
+                  if allowed is None or doc_id in allowed]
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    rest_bound = sum(bm25_upper_bound(idfs[term]) for term in rest)
+    top = TopK(limit, after)
+    scanned = len(candidates)
+    for chunk in batches(candidates, SEARCH_CHUNK):
+        if chunk[0][0] + rest_bound < top.threshold:
+            break  # candidates are sorted, so no later one can enter the top k either
+        scores = {doc_id: score for score, doc_id, _ in chunk if score + rest_bound >= top.threshold}
+        lengths = {doc_id: length for _, doc_id, length in chunk}
+        bound = rest_bound
+        for term in rest:
+            bound -= bm25_upper_bound(idfs[term])
+            tfs = _clause_probe(db, clauses[term], ids, list(scores))
+            scanned += len(tfs)
+            threshold = top.threshold
+            next_scores = {}
+            for doc_id, score in scores.items():
+                tf = tfs.get(doc_id)
+                if tf is None:
+                    continue  # AND semantics
+                score += bm25_term(idfs[term], tf, lengths[doc_id], avg_length)
+                if score + bound >= threshold:
+                    next_scores[doc_id] = score
+            scores = next_scores
+            if not scores:
+                break
+        if constraints and scores:
+            scores = {doc_id: scores[doc_id] for doc_id in _filter_positional(db, list(scores), constraints, ids)}
+        for doc_id, score in scores.items():
+            top.push(score, doc_id)
+    metrics.POSTINGS_SCANNED.observe(scanned, "sqlite")
+    return top.results()
+
+
+def render_hits(hits, terms, source, highlight=None):
+    """Response hits for (score, doc_id) pairs: the parts of each document `source`
+    includes, plus fragments around `terms` (index terms) if `highlight` is set."""
+    columns = ", ".join(["id", *source.columns()])
+    rows, fields, fragments = {}, {}, {}
+    types = doc_values.mapping() if source.wants_fields() else None
+    for shard, ids in group_by_shard([doc_id for _, doc_id in hits]).items():
+        with read_connection(shard) as db:
+            rows.update(fetch_documents(db, ids, columns))
+            if source.wants_fields():
+                fields.update(doc_values.stored_fields(db, ids, types))
+            if highlight is not None:
+                fragments.update(projection.highlight(db, ids, terms, **highlight))
     results = []
-    for doc_id, score in sorted_docs:
-        cursor = db.execute("SELECT title, content FROM documents WHERE id = ?", (doc_id,))
-        row = cursor.fetchone()
-        if row:
-            results.append({"id": doc_id, "title": row[0], "content": row[1], "score": score})
-    db.close()
+    for score, doc_id in hits:
+        if doc_id not in rows:
+            continue
+        hit = {"id": doc_id, **source.render(rows[doc_id], fields.get(doc_id)), "score": round(score, 4),
+               "sort": [score, doc_id]}
+        if highlight is not None:
+            hit["highlight"] = {"content": fragments.get(doc_id, [])}
+        results.append(hit)
+    return results
+
+
+def fetch_documents(db, doc_ids, columns="id, title, content"):
+    # One query per chunk instead of one per hit
+    rows = {}
+    for chunk in batches(list(doc_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for row in db.execute(f"SELECT {columns} FROM documents WHERE id IN ({placeholders})", chunk):
+            rows[row["id"]] = row
+    return rows
+
+
+def search_documents(query, limit=10, search_after=None, source=None, highlight=None):
+    """Ranked hits; each carries its exact `sort` values [score, id] for search_after.
+
+    `source` (a projection.SourceFilter) picks the parts of each document
+    returned, the title alone by default; `highlight` (options from
+    projection.parse_highlight) adds fragments around the matches.
+    """
+    terms, constraints = parse_query(query, get_analyzer())
+    if not terms:
+        return []
+    source = source or projection.DEFAULT_SOURCE
+    after = tuple(search_after) if search_after else None
+    generation = cache.generation()
+    key = (generation, INDEX_ENGINE, query, limit, after, source.key(), json.dumps(highlight, sort_keys=True))
+    results = cache.results.get(key)
+    if results is not None:
+        return results
+    with metrics.STAGE_SECONDS.time("search"):
+        expansions = dictionary.expand(terms)
+        if INDEX_ENGINE == "segment":
+            hits = segment_engine().search(terms, limit, constraints, after=after, expansions=expansions)
+        elif SHARDS > 1:
+            hits = shards.search(terms, limit, constraints, after, expansions)
+        else:
+            with read_connection() as db:
+                hits = search_index(db, terms, limit, constraints=constraints, after=after, expansions=expansions)
+        results = render_hits(hits, index_terms(terms, expansions), source, highlight)
+    if generation == cache.generation():
+        cache.results.put(key, results, len(json.dumps(results)))
     return results
 
-def get_all_documents(limit=100):
-    db = get_db()
-    cursor = db.execute("SELECT id, title, content, status, version, created_at, updated_at FROM documents LIMIT ?", (limit,))
-    results = cursor.fetchall()
-    db.close()
-    return [{"id": r["id"], "title": r["title"], "content": r["content"], "status": r["status"], "version": r["version"], "created_at": r["created_at"], "updated_at": r["updated_at"]} for r in results]
 
-def get_raw_documents(limit=100):
+def match_ids(db, terms, constraints=(), expansions=None):
+    """Every live doc_id containing all `terms` and meeting the constraints, unranked."""
+    expansions = expansions or {}
+    found = _clauses(db, terms, expansions)
+    if found is None:
+        return []
+    ids, clauses = found
+    dfs = blend_dfs(corpus_totals(db, index_terms(terms, expansions))[2], expansions)
+    rarest, *rest = sorted(terms, key=lambda term: dfs[term])
+    doc_ids = [doc_id for doc_id, _, _ in _clause_postings(db, clauses[rarest], ids)]
+    for term in rest:
+        if not doc_ids:
+            break
+        found = _clause_probe(db, clauses[term], ids, doc_ids)
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id in found]
+    metrics.POSTINGS_SCANNED.observe(len(doc_ids), "sqlite")
+    return _filter_positional(db, doc_ids, constraints, ids) if constraints else doc_ids
+
+
+def filtered_search(query="", limit=10, search_after=None, filters=None, aggs=None, source=None, highlight=None):
+    """{"results", "total", "aggregations"} for a query narrowed by doc-value filters.
+
+    The total and the aggregations need every match, not just the top k, so
+    each shard collects all matching documents, turns them into document
+    numbers and runs the filters and aggregations over its columns (see
+    doc_values.py). Hits are then ranked with BM25 among the filtered
+    documents. Without a query every document matches with score 1.0.
+    `source` and `highlight` shape the hits as in search_documents().
+    """
+    filters = filters or []
+    source = source or projection.DEFAULT_SOURCE
+    aggs = aggs or {}
+    terms, constraints = parse_query(query, get_analyzer()) if query else ([], [])
+    if terms and INDEX_ENGINE == "segment":
+        raise ValueError("Filters and aggregations need INDEX_ENGINE=sqlite")
+    after = tuple(search_after) if search_after else None
+    generation = cache.generation()
+    key = (generation, "filtered", query, limit, after, json.dumps(filters, sort_keys=True),
+           json.dumps(aggs, sort_keys=True), source.key(), json.dumps(highlight, sort_keys=True))
+    response = cache.results.get(key)
+    if response is not None:
+        return response
+    with metrics.STAGE_SECONDS.time("search"):
+        expansions = dictionary.expand(terms)
+        stats = shards.global_stats(index_terms(terms, expansions)) if terms and SHARDS > 1 else None
+        top = TopK(limit, after)
+        total = 0
+        partials = []
+        doc_values.mapping()  # loaded up front: it is read on a reader of the first shard
+        for shard in range(SHARDS):
+            store = doc_values.get(shard)
+            with read_connection(shard) as db:
+                # Columns and ids load on the reader held here, not on a second one
+                ids, numbers = store.load_ids(db)
+                if terms:
+                    docs = sorted(numbers[doc_id] for doc_id in match_ids(db, terms, constraints, expansions)
+                                  if doc_id in numbers)
+                elif query:
+                    docs = []  # nothing but stopwords
+                else:
+                    docs = store.live_numbers(db)
+                docs = doc_values.apply_filters(store, docs, filters, db)
+                total += len(docs)
+                partials.append(doc_values.aggregate(store, docs, aggs, db))
+                if limit > 0 and docs:
+                    allowed = {ids[number] for number in docs} - {None}
+                    if terms:
+                        hits = search_index(db, terms, limit, stats, constraints, after, allowed, expansions)
+                    else:
+                        hits = [(1.0, doc_id) for doc_id in allowed]
+                    for score, doc_id in hits:
+                        top.push(score, doc_id)
+        hits = top.results()
+        results = render_hits(hits, index_terms(terms, expansions), source, highlight)
+    response = {"results": results, "total": total, "aggregations": doc_values.merge_partials(aggs, partials)}
+    if generation == cache.generation():
+        cache.results.put(key, response, len(json.dumps(response)))
+    return response
+
+
+# Listings page by primary key (keyset pagination): `search_after` is the
+# sort values of the last row already seen, so every page is an index seek
+# however deep it is. The *_CURSOR functions give a row's sort values.
+# Documents are listed across all shards; the other raw tables have
+# per-shard keys, so they are listed one shard at a time.
+
+def _documents_page(sql, after, limit):
+    # `sql` pages one shard's documents by id; the shards' pages are merged.
+    # A negative limit means no limit, as SQLite's LIMIT -1 does.
+    pages = []
+    for shard in range(SHARDS):
+        with read_connection(shard) as db:
+            pages.append([dict(r) for r in db.execute(sql, (after, limit))])
+    return list(islice(merge(*pages, key=lambda row: row["id"]), limit if limit >= 0 else None))
+
+
+def get_all_documents(limit=100, search_after=None, source=None):
+    # Listing metadata plus the parts of each document `source` includes (the title by default)
+    source = source or projection.DEFAULT_SOURCE
+    after = search_after[0] if search_after else ""
+    columns = ", ".join(["id", *source.columns(), "status", "version", "created_at", "updated_at"])
+    rows = _documents_page(f"SELECT {columns} FROM documents WHERE id > ? ORDER BY id LIMIT ?", after, limit)
+    if source.wants_fields():
+        types = doc_values.mapping()
+        for shard, ids in group_by_shard([row["id"] for row in rows]).items():
+            with read_connection(shard) as db:
+                fields = doc_values.stored_fields(db, ids, types)
+            for row in rows:
+                if row["id"] in fields:
+                    row.update(source.render(row, fields[row["id"]]))
+    return rows
+
+
+def get_raw_documents(limit=100, search_after=None):
     # For debugging: raw rows from documents table
-    db = get_db()
-    cursor = db.execute("SELECT * FROM documents LIMIT ?", (limit,))
-    results = cursor.fetchall()
-    db.close()
-    return [dict(r) for r in results]
+    after = search_after[0] if search_after else ""
+    return _documents_page("SELECT * FROM documents WHERE id > ? ORDER BY id LIMIT ?", after, limit)
+
 
-def get_raw_extracted_text(limit=100):
-    db = get_db()
-    cursor = db.execute("SELECT * FROM extracted_text LIMIT ?", (limit,))
-    results = cursor.fetchall()
-    db.close()
+def get_raw_extracted_text(limit=100, search_after=None, shard=0):
+    after = search_after[0] if search_after else 0
+    with read_connection(shard) as db:
+        results = db.execute("SELECT * FROM extracted_text WHERE id > ? ORDER BY id LIMIT ?", (after, limit)).fetchall()
     return [dict(r) for r in results]
 
-def get_raw_inverted_index(limit=100):
-    db = get_db()
-    cursor = db.execute("SELECT * FROM inverted_index LIMIT ?", (limit,))
-    results = cursor.fetchall()
-    db.close()
-    return [dict(r) for r in results]
\ No newline at end of file
+
+def get_raw_inverted_index(limit=100, search_after=None, shard=0):
+    after = tuple(search_after) if search_after else (0, "", 0)
+    with read_connection(shard) as db:
+        results = db.execute("""
+            SELECT i.term_id, t.term, i.doc_id, i.version, i.tf, i.positions FROM inverted_index i
+            JOIN terms t ON t.id = i.term_id
+            WHERE (i.term_id, i.doc_id, i.version) > (?, ?, ?)
+            ORDER BY i.term_id, i.doc_id, i.version LIMIT ?
+        """, (*after, limit)).fetchall()
+    return [dict(r, positions=decode_positions(r["positions"])) for r in results]
+
+
+def id_cursor(row):
+    return [row["id"]]
+
+
+def inverted_index_cursor(row):
+    return [row["term_id"], row["doc_id"], row["version"]]
+
+
+def search_cursor(row):
+    return row["sort"]
@@ -0,0 +1,197 @@
+"""In-memory term dictionary for prefix (hel*) and fuzzy (helo~1) queries.
+
+Every term of the index with its document frequency (summed over shards),
+plus the terms in one sorted list. A prefix is a bisect range of that list.
+Fuzzy matching walks the sorted list as an implicit trie, where a node is
+the bisect range of the terms sharing a prefix. A Levenshtein automaton
+steps along the walk: a subtree is skipped as soon as the automaton rejects
+its prefix, and once only the query word's own characters can continue, the
+walk seeks straight to those children. Loaded on first use, then kept current by the commits that change
+document frequencies.
+"""
+import os
+import threading
+from bisect import bisect_left
+from heapq import nlargest
+from .query import multi_term
+from . import database
+
+MAX_EXPANSIONS = int(os.getenv("MAX_EXPANSIONS", "50"))  # terms a prefix or fuzzy term expands to, at most
+LAST_CHAR = "\U0010ffff"  # sorts after any character a term can continue with
+
+
+class TermDictionary:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0  # bumped by every update, so a load racing a commit isn't kept
+        self.terms = None  # sorted; may still hold terms whose df dropped to 0
+        self.dfs = None  # term -> df, live terms only
+        self.dead = 0  # entries of `terms` missing from `dfs`
+
+    def load(self):
+        # -> (terms, dfs). The list is replaced, never changed in place, so callers can keep walking it.
+        if self.terms is not None:
+            return self.terms, self.dfs
+        with self.lock:
+            version = self.version
+        dfs = database.term_dfs()
+        terms = sorted(dfs)
+        with self.lock:
+            if self.version == version:
+                self.terms, self.dfs, self.dead = terms, dfs, 0
+        return terms, dfs
+
+    def update(self, deltas):
+        """Apply committed {term: df change}; new terms are merged into the sorted list."""
+        with self.lock:
+            self.version += 1
+            if self.terms is None:
+                return
+            added = []
+            for term, change in deltas.items():
+                if not change:
+                    continue
+                df = self.dfs.get(term, 0) + change
+                if df > 0:
+                    if term not in self.dfs:
+                        added.append(term)
+                    self.dfs[term] = df
+                elif self.dfs.pop(term, None) is not None:
+                    self.dead += 1
+            if added:
+                added.sort()
+                # A term that died and came back is already in the list
+                fresh = [term for term in added if not _contains(self.terms, term)]
+                self.dead -= len(added) - len(fresh)
+                self.terms = sorted(self.terms + fresh)  # timsort merges the two runs in linear time
+            if self.dead > len(self.terms) // 4:
+                self.terms, self.dead = sorted(self.dfs), 0
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.terms = self.dfs = None
+            self.dead = 0
+
+    def prefix(self, prefix, limit=MAX_EXPANSIONS):
+        """The `limit` most frequent terms starting with `prefix`."""
+        terms, dfs = self.load()
+        start = bisect_left(terms, prefix)
+        end = bisect_left(terms, prefix + LAST_CHAR, start)
+        return nlargest(limit, (term for term in terms[start:end] if term in dfs), key=dfs.get)
+
+    def fuzzy(self, word, edits, limit=MAX_EXPANSIONS):
+        """Terms within `edits` edits of `word` (insert, delete, substitute, transpose);
+        the `limit` closest, most frequent first."""
+        terms, dfs = self.load()
+        automaton = LevenshteinAutomaton(word, edits)
+        chars = sorted(set(word))
+        matches = []
+
+        def walk(path, state, lo, hi):
+            # terms[lo:hi] are exactly the terms starting with `path`
+            if terms[lo] == path:
+                distance = automaton.distance(state)
+                if distance <= edits and path in dfs:
+                    matches.append((distance, -dfs[path], path))
+                lo += 1
+            depth = len(path)
+            if automaton.step(state, "") is None:
+                # Only characters of `word` can continue: seek straight to those subtrees
+                for char in chars:
+                    next_state = automaton.step(state, char)
+                    if next_state is not None:
+                        start = bisect_left(terms, path + char, lo, hi)
+                        end = bisect_left(terms, path + char + LAST_CHAR, start, hi)
+                        if start < end:
+                            walk(path + char, next_state, start, end)
+                return
+            while lo < hi:
+                char = terms[lo][depth]
+                end = bisect_left(terms, path + char + LAST_CHAR, lo + 1, hi)
+                next_state = automaton.step(state, char)
+                if next_state is not None:
+                    walk(path + char, next_state, lo, end)
+                lo = end
+
+        if terms:
+            walk("", 0, 0, len(terms))
+        matches.sort()
+        return [term for _, _, term in matches[:limit]]
+
+
+class LevenshteinAutomaton:
+    """DFA accepting words within `edits` edits of `word` (insert, delete,
+    substitute, transpose neighbours), built lazily as terms are read.
+
+    A state is the edit-distance DP row, capped at edits + 1, plus what a
+    transposition at the next character needs (the previous row and the last
+    character). Characters that don't occur in `word` behave alike, so
+    transitions are memoized per state and character class and nearly every
+    step is a dict lookup.
+    """
+
+    def __init__(self, word, edits):
+        self.word = word
+        self.edits = edits
+        start = (tuple(min(j, edits + 1) for j in range(len(word) + 1)), None, "")
+        self.states = [start]
+        self.ids = {start: 0}
+        self.transitions = {}
+
+    def step(self, state, char):
+        """The state after `char`, or None once no continuation can match."""
+        if char not in self.word:
+            char = ""
+        key = (state, char)
+        try:
+            return self.transitions[key]
+        except KeyError:
+            pass
+        word, cap = self.word, self.edits + 1
+        row, previous, last = self.states[state]
+        next_row = [min(row[0] + 1, cap)]
+        for j in range(1, len(word) + 1):
+            value = min(row[j] + 1, next_row[j - 1] + 1, row[j - 1] + (word[j - 1] != char))
+            if j > 1 and previous is not None and char == word[j - 2] and last == word[j - 1]:
+                value = min(value, previous[j - 2] + 1)
+            next_row.append(min(value, cap))
+        next_state = None
+        if min(next_row) < cap:
+            next_row = tuple(next_row)
+            target = (next_row, row, char)
+            next_state = self.ids.get(target)
+            if next_state is None:
+                next_state = self.ids[target] = len(self.states)
+                self.states.append(target)
+        self.transitions[key] = next_state
+        return next_state
+
+    def distance(self, state):
+        return self.states[state][0][-1]
+
+
+def _contains(terms, term):
+    i = bisect_left(terms, term)
+    return i < len(terms) and terms[i] == term
+
+
+_dictionary = TermDictionary()
+
+
+def get():
+    return _dictionary
+
+
+def expand(terms):
+    """{query term: [index terms]} for the prefix and fuzzy terms among `terms`."""
+    expansions = {}
+    for term in terms:
+        parsed = multi_term(term)
+        if parsed is None:
+            continue
+        if parsed[0] == "prefix":
+            expansions[term] = _dictionary.prefix(parsed[1])
+        else:
+            expansions[term] = _dictionary.fuzzy(parsed[1], parsed[2])
+    return expansions
@@ -0,0 +1,536 @@
+"""Columnar doc values: structured fields for filters and aggregations.
+
+Structured fields are stored in SQLite (doc_values, one row per field and
+document) and loaded on first use into one in-memory column per field and
+shard. A column is an array indexed by the document's number
+(documents.rowid, which an upsert keeps): array('d') for numbers and dates
+(epoch milliseconds, NaN when missing), array('l') of ordinals into the
+field's terms for keywords (-1 when missing). Commits patch loaded columns
+in place.
+
+Filters and aggregations run over a list of document numbers with map /
+compress / Counter passes, so the per-document loop stays in C.
+"""
+import math
+import re
+import threading
+from array import array
+from contextlib import nullcontext
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import compress
+from . import database
+
+NEG_INF = float("-inf")
+MISSING_ORD = -1
+DAY_MS = 86400000
+WEEK_OFFSET_MS = 3 * DAY_MS  # 1970-01-01 was a Thursday; weeks start on Monday
+INTERVAL_PATTERN = re.compile(r"^(\d+)(ms|s|m|h|d)$")
+UNIT_MS = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": DAY_MS}
+CALENDAR_INTERVALS = {
+    "minute": "1m", "1m": "1m", "hour": "1h", "1h": "1h", "day": "1d", "1d": "1d",
+    "week": "1w", "1w": "1w", "month": "1M", "1M": "1M", "quarter": "1q", "1q": "1q", "year": "1y", "1y": "1y",
+}
+DEFAULT_TERMS_SIZE = 10
+RANGE_PASSES = 4  # up to this many distinct range ends are counted with one pass each, more by sorting
+
+
+# Field types ("mapping"), decided by the first value seen for a field
+
+def parse_date(value):
+    # ISO 8601 date or datetime -> epoch milliseconds; naive times are UTC
+    if not isinstance(value, str) or len(value) < 10 or value[4:5] != "-":
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp() * 1000
+
+
+def detect_type(value):
+    if isinstance(value, bool):
+        return "keyword"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "date" if parse_date(value) is not None else "keyword"
+    return None  # objects and arrays are not indexed as doc values
+
+
+def normalize(field_type, value):
+    """The stored form of `value` for a field of `field_type`, or None if it doesn't fit."""
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if field_type == "keyword":
+        return ("true" if value else "false") if isinstance(value, bool) else str(value)
+    if isinstance(value, bool):
+        return None
+    if field_type == "date" and isinstance(value, str):
+        return parse_date(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+_mapping = None
+_mapping_lock = threading.Lock()
+
+
+def mapping():
+    """{field: type} for the whole index; kept in the first shard."""
+    global _mapping
+    if _mapping is None:
+        with database.read_connection(0) as db:
+            loaded = dict(db.execute("SELECT name, type FROM fields").fetchall())
+        with _mapping_lock:
+            if _mapping is None:
+                _mapping = loaded
+    return _mapping
+
+
+def resolve_types(fields):
+    """{field: type} for the given {field: value}, adding new fields to the mapping."""
+    known = mapping()
+    new = {}
+    for name, value in fields.items():
+        if name not in known and name not in new:
+            field_type = detect_type(value)
+            if field_type:
+                new[name] = field_type
+    if new:
+        with database.transaction(0) as db:
+            db.executemany("INSERT OR IGNORE INTO fields (name, type) VALUES (?, ?)", list(new.items()))
+            placeholders = ",".join("?" * len(new))
+            stored = dict(db.execute(f"SELECT name, type FROM fields WHERE name IN ({placeholders})", list(new)))
+            database.on_commit(lambda: _remember_types(stored))
+        return {**known, **stored}
+    return known
+
+
+def _remember_types(types):
+    with _mapping_lock:
+        if _mapping is not None:
+            _mapping.update(types)
+
+
+def reset():
+    # Drop everything loaded; called when the pools are closed
+    global _mapping
+    with _mapping_lock:
+        _mapping = None
+    with _stores_lock:
+        _stores.clear()
+
+
+# Writing
+
+def write(db, docs):
+    """Replace the doc values of `docs`, a list of (doc_id, {field: value} or None), in the open transaction."""
+    numbers = doc_numbers(db, [doc_id for doc_id, _ in docs])
+    db.executemany("DELETE FROM doc_values WHERE doc = ?", [(number,) for number in numbers.values()])
+    rows = []
+    fields = {}
+    for _, values in docs:
+        for name, value in (values or {}).items():
+            fields.setdefault(name, value)  # the first value decides a new field's type
+    types = resolve_types(fields) if fields else {}
+    for doc_id, values in docs:
+        for name, value in (values or {}).items():
+            value = normalize(types.get(name), value)
+            if value is not None:
+                rows.append((name, numbers[doc_id], value))
+    db.executemany("INSERT INTO doc_values (field, doc, value) VALUES (?, ?, ?)", rows)
+    store = get(db.shard)
+    database.on_commit(lambda: store.apply({numbers[doc_id]: doc_id for doc_id, _ in docs}, rows, types))
+
+
+def delete(db, doc_ids):
+    numbers = doc_numbers(db, doc_ids)
+    db.executemany("DELETE FROM doc_values WHERE doc = ?", [(number,) for number in numbers.values()])
+    store = get(db.shard)
+    database.on_commit(lambda: store.remove(numbers))
+
+
+def stored_fields(db, doc_ids, types):
+    """{doc_id: {field: value}} as stored, dates back in ISO 8601, for _source.
+
+    `types` is the mapping(), loaded before `db` was checked out: loading it
+    takes a reader of its own."""
+    fields = {}
+    for chunk in database.batches(list(doc_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        for doc_id, field, value in db.execute(f"""
+            SELECT d.id, v.field, v.value FROM documents d JOIN doc_values v ON v.doc = d.rowid
+            WHERE d.id IN ({placeholders})
+        """, chunk):
+            if types.get(field) == "date":
+                value = datetime.fromtimestamp(value / 1000, timezone.utc).isoformat()
+            fields.setdefault(doc_id, {})[field] = _key(value)
+    return fields
+
+
+def doc_numbers(db, doc_ids):
+    numbers = {}
+    for chunk in database.batches(list(doc_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        numbers.update(db.execute(f"SELECT id, rowid FROM documents WHERE id IN ({placeholders})", chunk).fetchall())
+    return numbers
+
+
+# In-memory columns
+
+class Column:
+    def __init__(self, field_type):
+        self.type = field_type
+        if field_type == "keyword":
+            self.values = array("l")
+            self.terms = []  # ordinal -> term
+            self.ords = {}  # term -> ordinal
+        else:
+            self.values = array("d")
+
+    @property
+    def missing(self):
+        return MISSING_ORD if self.type == "keyword" else math.nan
+
+    def ensure(self, size):
+        # Columns grow lazily; every document number below `size` must be addressable
+        if len(self.values) < size:
+            self.values.extend(array(self.values.typecode, [self.missing]) * (size - len(self.values)))
+
+    def set(self, number, value):
+        if number >= len(self.values):
+            self.ensure(max(number + 1, len(self.values) + len(self.values) // 4))
+        if value is None:
+            self.values[number] = self.missing
+        elif self.type == "keyword":
+            ord_ = self.ords.get(value)
+            if ord_ is None:
+                ord_ = self.ords[value] = len(self.terms)
+                self.terms.append(value)
+            self.values[number] = ord_
+        else:
+            self.values[number] = value
+
+    def gather(self, docs):
+        # Values of `docs` that are present: ordinals for keywords, floats otherwise
+        values = map(self.values.__getitem__, docs)
+        if self.type == "keyword":
+            return list(filter(MISSING_ORD.__lt__, values))
+        return list(filter(NEG_INF.__le__, values))  # NaN compares false
+
+
+class DocValues:
+    """Document numbers and loaded columns of one shard."""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.lock = threading.Lock()
+        self.version = 0  # bumped by every commit, so a load racing one isn't kept
+        self.ids = None  # document number -> doc id (None for gaps)
+        self.numbers = None  # doc id -> document number
+        self.columns = {}
+
+    def live_numbers(self, db=None):
+        ids, _ = self.load_ids(db)
+        return [number for number, doc_id in enumerate(ids) if doc_id is not None]
+
+    def _reader(self, db):
+        # The caller's connection if it holds one: checking out a second reader
+        # would wait on the caller itself once the pool is exhausted
+        return nullcontext(db) if db is not None else database.read_connection(self.shard)
+
+    def load_ids(self, db=None):
+        # -> (ids, numbers), read from the documents table on first use
+        if self.ids is not None:
+            return self.ids, self.numbers
+        with self.lock:
+            version = self.version
+        with self._reader(db) as db:
+            rows = db.execute("SELECT rowid, id FROM documents").fetchall()
+        ids = [None] * (max((row[0] for row in rows), default=0) + 1)
+        numbers = {}
+        for number, doc_id in rows:
+            ids[number] = doc_id
+            numbers[doc_id] = number
+        with self.lock:
+            if self.version == version:
+                self.ids, self.numbers = ids, numbers
+        return ids, numbers
+
+    def column(self, field, db=None):
+        # The mapping comes from the first shard: callers holding `db` load it first
+        column = self.columns.get(field)
+        if column is not None:
+            return column
+        field_type = mapping().get(field)
+        if field_type is None:
+            return None
+        with self.lock:
+            version = self.version
+        column = Column(field_type)
+        with self._reader(db) as db:
+            for number, value in db.execute("SELECT doc, value FROM doc_values WHERE field = ?", (field,)):
+                column.set(number, value)
+            column.ensure(len(self.load_ids(db)[0]))
+        with self.lock:
+            if self.version == version:
+                self.columns[field] = column
+        return column
+
+    def apply(self, documents, rows, types):
+        # After commit: `documents` {number: doc_id} were (re)indexed with `rows` (field, number, value)
+        with self.lock:
+            self.version += 1
+            if self.ids is not None:
+                for number, doc_id in documents.items():
+                    if number >= len(self.ids):
+                        self.ids.extend([None] * (number + 1 - len(self.ids)))
+                    self.ids[number] = doc_id
+                    self.numbers[doc_id] = number
+            for column in self.columns.values():
+                for number in documents:
+                    column.set(number, None)
+            for field, number, value in rows:
+                column = self.columns.get(field)
+                if column is not None and column.type == types.get(field):
+                    column.set(number, value)
+
+    def remove(self, numbers):
+        with self.lock:
+            self.version += 1
+            if self.ids is not None:
+                for doc_id, number in numbers.items():
+                    self.ids[number] = None
+                    self.numbers.pop(doc_id, None)
+            for column in self.columns.values():
+                for number in numbers.values():
+                    column.set(number, None)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get(shard):
+    store = _stores.get(shard)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(shard, DocValues(shard))
+    return store
+
+
+# Filters: [{"term": {field: value}}, {"terms": {field: [values]}},
+#           {"range": {field: {"gte"|"gt"|"lte"|"lt": bound}}}, {"exists": {"field": field}}]
+
+def check_filters(filters):
+    if not isinstance(filters, list):
+        raise ValueError("filter must be a list of clauses")
+    for clause in filters:
+        if not isinstance(clause, dict) or len(clause) != 1:
+            raise ValueError(f"Invalid filter clause: {clause!r}")
+        kind, spec = next(iter(clause.items()))
+        if kind == "exists":
+            if not isinstance(spec, dict) or not isinstance(spec.get("field"), str):
+                raise ValueError("exists filter needs a field")
+            continue
+        if kind not in ("term", "terms", "range") or not isinstance(spec, dict) or len(spec) != 1:
+            raise ValueError(f"Invalid filter clause: {clause!r}")
+        value = next(iter(spec.values()))
+        if kind == "terms" and not isinstance(value, list):
+            raise ValueError("terms filter needs a list of values")
+        if kind == "range" and (not isinstance(value, dict) or not value
+                                or set(value) - {"gt", "gte", "lt", "lte"}):
+            raise ValueError("range filter takes gt, gte, lt and lte bounds")
+
+
+def apply_filters(store, docs, filters, db=None):
+    """The document numbers in `docs` matching every filter clause; columns
+    not loaded yet are read on `db` if given (a reader of the store's shard)."""
+    for clause in filters:
+        if not docs:
+            break
+        kind, spec = next(iter(clause.items()))
+        field = spec["field"] if kind == "exists" else next(iter(spec))
+        column = store.column(field, db)
+        if column is None:
+            return []
+        column.ensure(max(docs) + 1)
+        values = column.values
+        if kind == "exists":
+            present = MISSING_ORD.__lt__ if column.type == "keyword" else NEG_INF.__le__
+            docs = list(compress(docs, map(present, map(values.__getitem__, docs))))
+        elif kind in ("term", "terms"):
+            wanted = spec[field] if kind == "terms" else [spec[field]]
+            keys = {_filter_key(column, value) for value in wanted} - {None}
+            docs = list(compress(docs, map(keys.__contains__, map(values.__getitem__, docs))))
+        else:
+            if column.type == "keyword":
+                raise ValueError(f"range filter on '{field}' needs a number or date field")
+            for op, bound in spec[field].items():
+                bound = normalize(column.type, bound)
+                if bound is None:
+                    raise ValueError(f"Invalid range bound for '{field}'")
+                # bound.__le__(v) is bound <= v, i.e. v >= bound
+                test = {"gte": bound.__le__, "gt": bound.__lt__, "lte": bound.__ge__, "lt": bound.__gt__}[op]
+                docs = list(compress(docs, map(test, map(values.__getitem__, docs))))
+    return docs
+
+
+def _filter_key(column, value):
+    value = normalize(column.type, value)
+    if column.type == "keyword":
+        return column.ords.get(value)
+    return value
+
+
+# Aggregations: {name: {"terms": {"field", "size"}} | {"range": {"field", "ranges"}} |
+#                      {"date_histogram": {"field", "calendar_interval" | "fixed_interval"}}}
+# Each shard returns a partial result that merge_partials() adds up.
+
+def check_aggs(aggs):
+    if not isinstance(aggs, dict):
+        raise ValueError("aggs must be an object")
+    for name, agg in aggs.items():
+        if not isinstance(agg, dict) or len(agg) != 1:
+            raise ValueError(f"Aggregation '{name}' must have exactly one type")
+        kind, spec = next(iter(agg.items()))
+        if kind not in ("terms", "range", "date_histogram"):
+            raise ValueError(f"Unknown aggregation type '{kind}'")
+        if not isinstance(spec, dict) or not isinstance(spec.get("field"), str):
+            raise ValueError(f"Aggregation '{name}' needs a field")
+        if kind == "range":
+            ranges = spec.get("ranges")
+            if not isinstance(ranges, list) or not ranges or not all(isinstance(r, dict) for r in ranges):
+                raise ValueError(f"Aggregation '{name}' needs a list of ranges")
+        if kind == "date_histogram":
+            parse_interval(spec)
+
+
+def parse_interval(spec):
+    # -> ("fixed", milliseconds) or ("calendar", "1M" | "1q" | "1y" | ...)
+    if "fixed_interval" in spec:
+        match = INTERVAL_PATTERN.match(str(spec["fixed_interval"]))
+        if not match or int(match.group(1)) == 0:
+            raise ValueError(f"Invalid fixed_interval: {spec['fixed_interval']!r}")
+        return "fixed", int(match.group(1)) * UNIT_MS[match.group(2)]
+    interval = CALENDAR_INTERVALS.get(spec.get("calendar_interval"))
+    if interval is None:
+        raise ValueError("date_histogram needs a calendar_interval (minute..year) or a fixed_interval such as 30m")
+    return "calendar", interval
+
+
+def aggregate(store, docs, aggs, db=None):
+    """{name: partial result} over the document numbers in `docs`; `db` as in apply_filters()."""
+    partials = {}
+    for name, agg in aggs.items():
+        kind, spec = next(iter(agg.items()))
+        column = store.column(spec["field"], db)
+        values = []
+        if column is not None and docs:
+            column.ensure(max(docs) + 1)
+            values = column.gather(docs)
+        if kind == "terms":
+            counts = Counter(values)
+            if column is not None and column.type == "keyword":
+                counts = Counter({column.terms[ord_]: n for ord_, n in counts.items()})
+            partials[name] = counts
+        elif kind == "range":
+            if column is not None and column.type == "keyword":
+                raise ValueError(f"range aggregation on '{spec['field']}' needs a number or date field")
+            bounds = [(_bound(column, r.get("from"), NEG_INF), _bound(column, r.get("to"), math.inf))
+                      for r in spec["ranges"]]
+            partials[name] = _range_counts(values, bounds)
+        else:
+            if column is not None and column.type == "keyword":
+                raise ValueError(f"date_histogram on '{spec['field']}' needs a date field")
+            partials[name] = _histogram(values, parse_interval(spec))
+    return partials
+
+
+def _bound(column, value, default):
+    if value is None:
+        return default
+    bound = normalize(column.type if column else "number", value)
+    if bound is None:
+        raise ValueError(f"Invalid range bound: {value!r}")
+    return bound
+
+
+def _range_counts(values, bounds):
+    # Documents with from <= value < to, for each (from, to)
+    below = {NEG_INF: 0, math.inf: len(values)}
+    ends = {bound for pair in bounds for bound in pair} - set(below)
+    if len(ends) <= RANGE_PASSES:
+        below.update((bound, sum(map(bound.__gt__, values))) for bound in ends)
+    else:
+        values = sorted(values)
+        below.update((bound, bisect_left(values, bound)) for bound in ends)
+    return [max(0, below[high] - below[low]) for low, high in bounds]
+
+
+def _histogram(values, interval):
+    # Counter of bucket start (epoch ms) -> doc count
+    kind, size = interval
+    if kind == "fixed":
+        return Counter({key * size: n for key, n in Counter(map(float(size).__rfloordiv__, values)).items()})
+    if size in ("1m", "1h", "1d"):
+        return _histogram(values, ("fixed", {"1m": 60000, "1h": 3600000, "1d": DAY_MS}[size]))
+    if size == "1w":
+        shifted = map(float(WEEK_OFFSET_MS).__add__, values)
+        weeks = Counter(map(float(7 * DAY_MS).__rfloordiv__, shifted))
+        return Counter({key * 7 * DAY_MS - WEEK_OFFSET_MS: n for key, n in weeks.items()})
+    # Months, quarters and years: bucket by day first, then fold the (few) days
+    buckets = Counter()
+    for day, n in _histogram(values, ("fixed", DAY_MS)).items():
+        date = datetime.fromtimestamp(day / 1000, timezone.utc)
+        month = 1 if size == "1y" else (date.month - (date.month - 1) % 3 if size == "1q" else date.month)
+        buckets[datetime(date.year, month, 1, tzinfo=timezone.utc).timestamp() * 1000] += n
+    return buckets
+
+
+def merge_partials(aggs, partials):
+    """Add up per-shard partial results and render them ES-style."""
+    results = {}
+    for name, agg in aggs.items():
+        kind, spec = next(iter(agg.items()))
+        shard_parts = [partial[name] for partial in partials]
+        if kind == "terms":
+            counts = sum(shard_parts, Counter())
+            size = int(spec.get("size", DEFAULT_TERMS_SIZE))
+            top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:size]
+            results[name] = {
+                "buckets": [{"key": _key(key), "doc_count": n} for key, n in top],
+                "sum_other_doc_count": sum(counts.values()) - sum(n for _, n in top),
+            }
+        elif kind == "range":
+            totals = [sum(counts) for counts in zip(*shard_parts)]
+            buckets = []
+            for r, n in zip(spec["ranges"], totals):
+                bucket = {"key": r.get("key") or f"{_range_end(r.get('from'))}-{_range_end(r.get('to'))}",
+                          "doc_count": n}
+                bucket.update((end, r[end]) for end in ("from", "to") if r.get(end) is not None)
+                buckets.append(bucket)
+            results[name] = {"buckets": buckets}
+        else:
+            counts = sum(shard_parts, Counter())
+            results[name] = {"buckets": [
+                {"key": int(key), "key_as_string": datetime.fromtimestamp(key / 1000, timezone.utc).isoformat(),
+                 "doc_count": n}
+                for key, n in sorted(counts.items())
+            ]}
+    return results
+
+
+def _key(key):
+    return int(key) if isinstance(key, float) and key.is_integer() else key
+
+
+def _range_end(value):
+    return "*" if value is None else value
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .transport import (Transport, DEAD_LETTER_QUEUES, TEXT_EXTRACT_QUEUE, INDEX_QUEUE,
+                        MESSAGE_TTL_MS, MAX_RETRIES)
+
+# Durable single-node queue in its own SQLite file, so queue traffic never
+# waits on the index writer. A message is delivered at least once: it is
+# marked delivered while a consumer holds it, deleted on ack, and made ready
+# again on nack or after a restart.
+QUEUE_PATH = os.getenv("QUEUE_PATH", "queue.db")
+POLL_INTERVAL = 0.5  # seconds; picks up retries coming due and other processes' publishes
+
+
+class QueueStore:
+    """Synchronous storage layer; every call runs on the transport's single store thread."""
+
+    def __init__(self, path=QUEUE_PATH):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA busy_timeout = 5000")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                body BLOB NOT NULL,
+                retries INTEGER DEFAULT 0,  -- times dead-lettered back for a retry
+                visible_at REAL DEFAULT 0,  -- not delivered before this time (retry delay)
+                delivered INTEGER DEFAULT 0,  -- 1 while a consumer holds it unacked
+                created_at REAL
+            );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_messages_ready ON messages (queue, delivered, visible_at, id)")
+        # Nothing can still hold a delivery from a previous run
+        self.db.execute("UPDATE messages SET delivered = 0 WHERE delivered = 1")
+
+    def publish(self, queue, bodies):
+        now = time.time()
+        self.db.execute("BEGIN")
+        self.db.executemany("INSERT INTO messages (queue, body, created_at) VALUES (?, ?, ?)",
+                            [(queue, body, now) for body in bodies])
+        self.db.execute("COMMIT")
+
+    def fetch(self, queue, limit):
+        # Claim up to `limit` ready messages, oldest first
+        return self.db.execute("""
+            UPDATE messages SET delivered = 1 WHERE id IN (
+                SELECT id FROM messages WHERE queue = ? AND delivered = 0 AND visible_at <= ?
+                ORDER BY id LIMIT ?
+            ) RETURNING id, body, retries
+        """, (queue, time.time(), limit)).fetchall()
+
+    def ack(self, ids):
+        self.db.execute("BEGIN")
+        self.db.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in ids])
+        self.db.execute("COMMIT")
+
+    def nack(self, queue, ids, requeue):
+        self.db.execute("BEGIN")
+        if requeue:
+            self.db.executemany("UPDATE messages SET delivered = 0 WHERE id = ?", [(i,) for i in ids])
+        else:
+            # Retry after the TTL until MAX_RETRIES is used up, then dead-letter
+            retry_at = time.time() + MESSAGE_TTL_MS / 1000
+            self.db.executemany("""
+                UPDATE messages SET delivered = 0, retries = retries + 1, visible_at = ? WHERE id = ?
+            """, [(retry_at, i) for i in ids])
+            if queue in DEAD_LETTER_QUEUES:
+                self.db.executemany(f"""
+                    UPDATE messages SET queue = ?, visible_at = 0 WHERE id = ? AND retries > {MAX_RETRIES}
+                """, [(DEAD_LETTER_QUEUES[queue], i) for i in ids])
+        self.db.execute("COMMIT")
+
+    def next_visible(self, queue):
+        row = self.db.execute("SELECT MIN(visible_at) FROM messages WHERE queue = ? AND delivered = 0",
+                              (queue,)).fetchone()
+        return row[0]
+
+    def counts(self):
+        # {queue: (ready, unacked)}
+        counts = {}
+        for queue, delivered, n in self.db.execute(
+                "SELECT queue, delivered, COUNT(*) FROM messages GROUP BY queue, delivered"):
+            ready, unacked = counts.get(queue, (0, 0))
+            counts[queue] = (ready, unacked + n) if delivered else (ready + n, unacked)
+        return counts
+
+    def close(self):
+        self.db.close()
+
+
+class EmbeddedMessage:
+    def __init__(self, transport, queue, message_id, body, retries):
+        self._transport = transport
+        self.queue = queue
+        self.id = message_id
+        self.body = body
+        self.retries = retries
+        self._settled = False
+
+    async def ack(self):
+        if not self._settled:
+            self._settled = True
+            self._transport._ack(self)
+
+    async def nack(self, requeue=True):
+        if not self._settled:
+            self._settled = True
+            await self._transport._nack(self, requeue)
+
+
+class EmbeddedTransport(Transport):
+    def __init__(self, path=None):
+        self.path = path or QUEUE_PATH
+        self._reset()
+
+    def _reset(self):
+        self._store = None
+        self._executor = None
+        self._loop = None
+        self._wakeups = {}
+        self._inflight = {}
+        self._consumers = {}
+        self._pending_acks = []
+        self._tasks = set()
+
+    async def _call(self, fn, *args):
+        return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    def _wakeup(self, queue):
+        if queue not in self._wakeups:
+            self._wakeups[queue] = asyncio.Event()
+        return self._wakeups[queue]
+
+    async def start(self):
+        if self._loop is not None and self._loop is not asyncio.get_running_loop():
+            await self.close()  # opened under an event loop that has since gone away
+        if self._store is None:
+            self._loop = asyncio.get_running_loop()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="queue-store")
+            self._store = await self._call(QueueStore, self.path)
+        return self
+
+    async def setup(self):
+        await self.start()
+        print(f"Embedded queue ready at {self.path}.")
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._store is not None:
+            store, executor = self._store, self._executor
+            if self._pending_acks:
+                executor.submit(store.ack, self._pending_acks)
+            executor.submit(store.close)
+            executor.shutdown(wait=True)
+        self._reset()
+
+    async def publish(self, routing_key, message):
+        await self.publish_batch(routing_key, [message])
+
+    async def publish_batch(self, routing_key, messages):
+        await self.start()
+        await self._call(self._store.publish, routing_key, [m.encode() for m in messages])
+        self._wakeup(routing_key).set()
+
+    async def consume(self, queue_name, callback, prefetch):
+        await self.start()
+        self._consumers[queue_name] = self._consumers.get(queue_name, 0) + 1
+        task = asyncio.create_task(self._deliver(queue_name, callback, prefetch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, queue, callback, prefetch):
+        wakeup = self._wakeup(queue)
+        while True:
+            # Cleared before looking, so a publish or ack that lands meanwhile isn't missed
+            wakeup.clear()
+            free = prefetch - self._inflight.get(queue, 0)
+            rows = await self._call(self._store.fetch, queue, free) if free > 0 else []
+            for message_id, body, retries in rows:
+                self._inflight[queue] = self._inflight.get(queue, 0) + 1
+                await callback(EmbeddedMessage(self, queue, message_id, body, retries))
+            if rows:
+                continue
+            timeout = POLL_INTERVAL
+            if free > 0:
+                due = await self._call(self._store.next_visible, queue)
+                if due:
+                    timeout = min(timeout, max(0.0, due - time.time()))
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _settle(self, message):
+        self._inflight[message.queue] -= 1
+        self._wakeup(message.queue).set()
+
+    def _ack(self, message):
+        # Acks are coalesced and deleted in one transaction per loop iteration;
+        # losing them in a crash only means a redelivery
+        self._settle(message)
+        if not self._pending_acks:
+            self._loop.call_soon(self._flush_acks)
+        self._pending_acks.append(message.id)
+
+    def _flush_acks(self):
+        ids, self._pending_acks = self._pending_acks, []
+        if ids and self._store is not None:
+            self._executor.submit(self._store.ack, ids)
+
+    async def _nack(self, message, requeue):
+        await self._call(self._store.nack, message.queue, [message.id], requeue)
+        self._settle(message)
+
+    async def queue_stats(self):
+        await self.start()
+        counts = await self._call(self._store.counts)
+        stats = {}
+        for queue in (TEXT_EXTRACT_QUEUE, INDEX_QUEUE, *DEAD_LETTER_QUEUES.values()):
+            ready, unacked = counts.get(queue, (0, 0))
+            stats[queue] = {"message_count": ready, "unacked_count": unacked,
+                            "consumer_count": self._consumers.get(queue, 0)}
+        return stats
@@ -2,10 +2,14 @@ import asyncio
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from . import routes
 from . import consumer
 from . import rabbitmq
+from . import database
+from . import segments
+from . import async_db
+from . import compaction
 
 app = FastAPI(title="Local Elasticsearch", description="A simple Elasticsearch-style backend with FastAPI, RabbitMQ, and SQLite")
 
@@ -24,11 +28,24 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Include routes
 app.include_router(routes.router)
 
+@app.exception_handler(async_db.QueryTimeout)
+async def query_timeout_handler(request, exc):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
 # On startup, setup RabbitMQ and start consumers
 @app.on_event("startup")
 async def startup_event():
+    database.init_db()
     await rabbitmq.setup_rabbitmq()
+    await rabbitmq.start_publisher()
     asyncio.create_task(consumer.start_consumers())
+    asyncio.create_task(compaction.run_periodically())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await rabbitmq.close_publisher()
+    segments.close_engine()
+    database.close_pool()
 
 @app.get("/")
 async def root():
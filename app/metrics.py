@@ -0,0 +1,187 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# Minimal Prometheus instrumentation: counters and histograms kept in
+# process, rendered in the text exposition format by render(). Gauges that
+# are cheap to read on demand (queue depths, status counts) are computed at
+# scrape time by the /metrics route instead of being tracked here.
+PREFIX = "local_es_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = tuple(4 ** i for i in range(12))  # 1 .. ~4M
+SQL_TIMING = os.getenv("SQL_TIMING", "1") != "0"  # per-statement timing costs ~10% on small queries
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 disables the slow-query log
+SLOW_QUERY_LOG_SIZE = 100
+
+_registry = []
+_captured = threading.local()  # observations collected by capture() on this thread
+
+
+def _format_labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        captured = getattr(_captured, "observations", None)
+        if captured is not None:
+            captured.append((self.name, value, label_values))
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+@contextmanager
+def capture():
+    """Collect the histogram observations made on this thread instead of
+    recording them, as (name, value, label values) for replay(): a shard
+    search runs in a worker process whose registry is never scraped."""
+    observations = _captured.observations = []
+    try:
+        yield observations
+    finally:
+        _captured.observations = None
+
+
+def replay(observations):
+    histograms = {metric.name: metric for metric in _registry if isinstance(metric, Histogram)}
+    for name, value, label_values in observations:
+        histograms[name].observe(value, *label_values)
+
+
+def gauge(name, help, samples, labels=()):
+    """Render a scrape-time gauge from (label values, value) pairs."""
+    name = PREFIX + name
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for values, value in samples:
+        lines.append(f"{name}{_format_labels(labels, values)} {value}")
+    return lines
+
+
+def render(extra=()):
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for block in extra:
+        lines.extend(block)
+    return "\n".join(lines) + "\n"
+
+
+# Pipeline stages: upload, extract, index (tokenizing), commit (write
+# transaction) and search
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent per pipeline stage call", ("stage",))
+STAGE_DOCUMENTS = Counter("stage_documents_total", "Documents handled per pipeline stage", ("stage",))
+POSTINGS_SCANNED = Histogram("postings_scanned", "Postings read per search query", ("engine",), COUNT_BUCKETS)
+SQL_SECONDS = Histogram("sqlite_statement_seconds", "Time in SQLite execute/fetch calls per statement class",
+                        ("statement",))
+
+# Statement class = verb + the table it targets: "select inverted_index",
+# "insert terms", "pragma user_version", ...
+STATEMENT_VERB = re.compile(r"\s*(\w+)")
+STATEMENT_TABLE = {
+    "select": re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE),
+    "with": re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE),
+    "delete": re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE),
+    "insert": re.compile(r"\bINTO\s+(\w+)", re.IGNORECASE),
+    "update": re.compile(r"UPDATE\s+(?:OR\s+\w+\s+)?(\w+)", re.IGNORECASE),
+    "pragma": re.compile(r"PRAGMA\s+(\w+)", re.IGNORECASE),
+}
+_statement_classes = {}
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def statement_class(sql):
+    """'select inverted_index', 'insert terms', ... memoized per SQL string."""
+    label = _statement_classes.get(sql)
+    if label is None:
+        match = STATEMENT_VERB.match(sql)
+        verb = match.group(1).lower() if match else "other"
+        table = STATEMENT_TABLE[verb].search(sql) if verb in STATEMENT_TABLE else None
+        label = f"{'select' if verb == 'with' else verb} {table.group(1)}" if table else verb
+        if len(_statement_classes) < 4096:
+            _statement_classes[sql] = label
+    return label
+
+
+def record_statement(db, sql, params, elapsed):
+    label = statement_class(sql)
+    SQL_SECONDS.observe(elapsed, label)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and label not in ("explain", "begin", "commit"):
+        # The plan runs on the caller's connection, so only reads are explained:
+        # a write's plan would run inside the caller's write transaction
+        plan = []
+        if label.startswith("select"):
+            try:
+                plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())]
+            except Exception as e:
+                plan = [f"(no plan: {e})"]
+        slow_queries.append({"sql": " ".join(sql.split()), "ms": round(elapsed * 1000, 2), "plan": plan,
+                             "at": time.time()})
@@ -0,0 +1,83 @@
+# Compact binary postings: positions are delta-encoded and written as
+# LEB128 varints, so a typical posting needs one byte per position.
+
+
+class PositionBuffer:
+    """Positions of one term, varint-encoded as they are appended.
+
+    Used while tokenizing large documents so a term's positions cost about a
+    byte each instead of a Python int in a list.
+    """
+
+    __slots__ = ("data", "count", "last")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.count = 0
+        self.last = 0
+
+    def append(self, pos):
+        write_varint(self.data, pos - self.last)
+        self.last = pos
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter_positions(self.data)
+
+
+def encode_positions(positions):
+    if isinstance(positions, PositionBuffer):
+        return bytes(positions.data)
+    out = bytearray()
+    prev = 0
+    for pos in positions:
+        delta = pos - prev
+        prev = pos
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def iter_positions(blob):
+    # Streams positions back out without materializing a list
+    pos = 0
+    value = 0
+    shift = 0
+    for byte in blob:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        pos += value
+        yield pos
+        value = 0
+        shift = 0
+
+
+def decode_positions(blob):
+    return list(iter_positions(blob))
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, pos):
+    # Returns (value, next position)
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
@@ -0,0 +1,215 @@
+"""_source projection and highlighting for search hits and listings.
+
+A SourceFilter names the parts of a document a response carries: "title",
+"content" (the full text) and "fields.<name>" (structured fields, see
+doc_values.py). Only those columns are read, so the full text is never
+loaded or serialized unless it is asked for; by default hits and listings
+carry the title alone.
+
+The highlighter reads the positions of the query terms in each hit from the
+postings and chooses the fragments from those positions alone. Only then is
+the document tokenized, and only up to the last token a fragment needs (an
+uploaded file is read from disk chunk by chunk, stored content through
+substr()), to turn positions into character offsets.
+"""
+import html
+import os
+from bisect import bisect_left
+from collections import deque
+from fnmatch import fnmatchcase
+from .postings import iter_positions
+from . import database
+
+SOURCE_COLUMNS = ("title", "content")
+FRAGMENT_TOKENS = 16  # tokens per highlighted fragment
+NUMBER_OF_FRAGMENTS = 3
+MAX_FRAGMENTS = 10
+PRE_TAG = "<em>"
+POST_TAG = "</em>"
+CONTENT_CHUNK = 64 * 1024  # characters read per substr() while highlighting stored content
+
+
+def _matches(name, patterns):
+    # A pattern also matches everything under it: "fields" covers "fields.brand"
+    return any(fnmatchcase(name, pattern) or name.startswith(pattern + ".") for pattern in patterns)
+
+
+def _patterns(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(pattern, str) for pattern in value):
+        raise ValueError("_source patterns must be a string or a list of strings")
+    return tuple(pattern.strip() for pattern in value if pattern.strip())
+
+
+class SourceFilter:
+    def __init__(self, includes=("*",), excludes=()):
+        self.includes = tuple(includes)
+        self.excludes = tuple(excludes)
+
+    @classmethod
+    def parse(cls, value=None, includes=None, excludes=None, default=None):
+        """From Elasticsearch-style _source (true, false, patterns or {"includes", "excludes"})
+        plus _source_includes / _source_excludes."""
+        default = default or DEFAULT_SOURCE
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+        if isinstance(value, dict):
+            includes = value.get("includes", includes)
+            excludes = value.get("excludes", excludes)
+            value = None
+        includes, excludes = _patterns(includes), _patterns(excludes)
+        if value is False:
+            return cls(())
+        if value is not None and value is not True:
+            includes = (includes or ()) + _patterns(value)
+        if value is None and includes is None and excludes is None:
+            return default
+        return cls(includes if includes is not None else ("*",), excludes or ())
+
+    def wants(self, name):
+        return _matches(name, self.includes) and not _matches(name, self.excludes)
+
+    def columns(self):
+        return [column for column in SOURCE_COLUMNS if self.wants(column)]
+
+    def wants_fields(self):
+        # Whether any include can match a "fields.<name>"; names are checked once loaded
+        return any(fnmatchcase("fields", pattern.split(".")[0]) for pattern in self.includes)
+
+    def key(self):
+        return self.includes, self.excludes
+
+    def render(self, row, fields=None):
+        # The included parts of one document, from a row holding self.columns()
+        doc = {column: row[column] for column in self.columns()}
+        if fields:
+            fields = {name: value for name, value in fields.items() if self.wants(f"fields.{name}")}
+            if fields:
+                doc["fields"] = fields
+        return doc
+
+
+DEFAULT_SOURCE = SourceFilter(["title"])
+FULL_SOURCE = SourceFilter()
+
+
+def parse_highlight(value):
+    """Highlight options from a request: None (off), true or {"number_of_fragments", "fragment_tokens"}."""
+    if value is None or value is False:
+        return None
+    options = {} if value is True else value
+    if not isinstance(options, dict) or set(options) - {"number_of_fragments", "fragment_tokens"}:
+        raise ValueError("highlight takes number_of_fragments and fragment_tokens")
+    count = options.get("number_of_fragments", NUMBER_OF_FRAGMENTS)
+    size = options.get("fragment_tokens", FRAGMENT_TOKENS)
+    if not isinstance(count, int) or not isinstance(size, int) or not 0 < count <= MAX_FRAGMENTS or size < 1:
+        raise ValueError(f"number_of_fragments must be 1-{MAX_FRAGMENTS} and fragment_tokens positive")
+    return {"number_of_fragments": count, "fragment_tokens": size}
+
+
+def highlight(db, doc_ids, terms, number_of_fragments=NUMBER_OF_FRAGMENTS, fragment_tokens=FRAGMENT_TOKENS):
+    """{doc_id: [fragment]} for documents of this database, with matches of `terms` (index terms) in <em>."""
+    matches = {}  # doc_id -> {position: term}
+    for doc_id, blobs in database.term_positions(db, doc_ids, terms).items():
+        positions = matches[doc_id] = {}
+        for term, blob in blobs.items():
+            for pos in iter_positions(blob):
+                positions[pos] = term
+    rows = database.fetch_documents(db, list(matches), "id, file_path")
+    analyzer = database.get_analyzer()
+    fragments = {}
+    for doc_id, positions in matches.items():
+        file_path = rows[doc_id]["file_path"] if doc_id in rows else None
+        if file_path:
+            if not os.path.exists(file_path):
+                continue
+            chunks = database.read_chunks(file_path)
+        else:
+            chunks = _content_chunks(db, doc_id)
+        windows = _windows(positions, number_of_fragments, fragment_tokens)
+        fragments[doc_id] = _fragments(analyzer, chunks, windows, positions)
+    return fragments
+
+
+def _content_chunks(db, doc_id):
+    # Stored content in pieces, so highlighting stops reading after the last fragment
+    offset = 1
+    while True:
+        row = db.execute("SELECT substr(content, ?, ?) FROM documents WHERE id = ?",
+                         (offset, CONTENT_CHUNK, doc_id)).fetchone()
+        if not row or not row[0]:
+            return
+        yield row[0]
+        if len(row[0]) < CONTENT_CHUNK:
+            return
+        offset += CONTENT_CHUNK
+
+
+def _windows(positions, count, size):
+    # Up to `count` non-overlapping [start, end) token ranges, in document order,
+    # preferring those with the most distinct terms and then the most matches
+    ordered = sorted(positions)
+    candidates = []
+    for pos in ordered:
+        start = max(0, pos - size // 4)
+        inside = ordered[bisect_left(ordered, start):bisect_left(ordered, start + size)]
+        candidates.append((-len({positions[p] for p in inside}), -len(inside), start))
+    candidates.sort()
+    chosen = []
+    for _, _, start in candidates:
+        if all(start + size <= other or start >= other + size for other in chosen):
+            chosen.append(start)
+            if len(chosen) == count:
+                break
+    return [(start, start + size) for start in sorted(chosen)]
+
+
+def _fragments(analyzer, chunks, windows, positions):
+    # Each fragment is built as soon as the tokenizer passes its window, and
+    # only the chunks from the start of the pending window on are kept
+    read = deque()
+    base = 0  # offset of read[0] in the document
+
+    def recorded():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    fragments = []
+    spans = {}  # position -> (start, end) of the tokens in the pending window
+    window = 0
+    for pos, span in enumerate(analyzer.iter_spans(recorded())):
+        while window < len(windows) and pos >= windows[window][1]:
+            if spans:
+                fragments.append(_fragment("".join(read), base, spans, positions))
+                spans = {}
+            window += 1
+        if window == len(windows):
+            break  # past the last fragment: the rest of the document is never read
+        if pos >= windows[window][0]:
+            spans[pos] = span
+        keep = next(iter(spans.values()))[0] if spans else span[1]
+        while len(read) > 1 and base + len(read[0]) <= keep:
+            base += len(read.popleft())
+    else:
+        if spans:
+            fragments.append(_fragment("".join(read), base, spans, positions))
+    return fragments
+
+
+def _fragment(text, base, spans, positions):
+    # `text` starts at document offset `base`; `spans` are the window's tokens in order
+    inside = list(spans)
+    pieces = []
+    cursor = spans[inside[0]][0]
+    for pos in inside:
+        if pos in positions:
+            left, right = spans[pos]
+            pieces.append(html.escape(text[cursor - base:left - base]))
+            pieces.append(PRE_TAG + html.escape(text[left - base:right - base]) + POST_TAG)
+            cursor = right
+    pieces.append(html.escape(text[cursor - base:spans[inside[-1]][1] - base]))
+    return "".join(pieces)
@@ -0,0 +1,140 @@
+import re
+from .postings import iter_positions
+from .analysis import get_analyzer
+
+# Query syntax on top of bag-of-words AND:
+#   "hello world"       phrase: terms at consecutive positions
+#   hello NEAR/3 world  proximity: both terms within 3 positions, either order
+#   hel*                prefix: any term starting with "hel"
+#   helo~1, helo~       fuzzy: any term within 1 edit (AUTO by length without a number)
+QUERY_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+NEAR_OPERATOR = re.compile(r"NEAR(?:/(\d+))?$")
+PREFIX_TERM = re.compile(r"^(\w+)\*$")
+FUZZY_TERM = re.compile(r"^(\w+)~(\d)?$")
+DEFAULT_NEAR_SLOP = 10
+MAX_EDITS = 2
+
+
+def intersects(iterators):
+    """True if all sorted iterators share a value; advances them lazily."""
+    iterators = list(iterators)
+    try:
+        values = [next(it) for it in iterators]
+        while True:
+            high = max(values)
+            if all(value == high for value in values):
+                return True
+            for i, it in enumerate(iterators):
+                while values[i] < high:
+                    values[i] = next(it)
+    except StopIteration:
+        return False
+
+
+def within(left, right, slop):
+    """True if some pair from two sorted iterators is at most `slop` apart."""
+    try:
+        a = next(left)
+        b = next(right)
+        while True:
+            if abs(a - b) <= slop:
+                return True
+            if a < b:
+                a = next(left)
+            else:
+                b = next(right)
+    except StopIteration:
+        return False
+
+
+def _shifted(blob, offset):
+    for pos in iter_positions(blob):
+        yield pos - offset
+
+
+class Phrase:
+    def __init__(self, terms, offsets=None):
+        self.terms = terms
+        # Offsets skip over removed stopwords: "state of the art" -> 0, 3
+        self.offsets = offsets if offsets is not None else list(range(len(terms)))
+
+    def matches(self, blobs):
+        # Shift each term's positions by its offset in the phrase; a phrase
+        # match is a value common to all shifted streams.
+        return intersects(_shifted(blobs[term], offset) for offset, term in zip(self.offsets, self.terms))
+
+    def __repr__(self):
+        return f"Phrase({self.terms!r})"
+
+
+class Near:
+    def __init__(self, left, right, slop):
+        self.left = left
+        self.right = right
+        self.slop = slop
+        self.terms = [left, right]
+
+    def matches(self, blobs):
+        return within(iter_positions(blobs[self.left]), iter_positions(blobs[self.right]), self.slop)
+
+    def __repr__(self):
+        return f"Near({self.left!r}, {self.right!r}, {self.slop})"
+
+
+def auto_edits(word):
+    # Elasticsearch's fuzziness AUTO: exact up to 2 characters, 1 edit up to 5, then 2
+    return 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+
+
+def multi_term(term):
+    """("prefix", text) or ("fuzzy", text, edits) for a prefix or fuzzy query term, else None."""
+    match = PREFIX_TERM.match(term)
+    if match:
+        return "prefix", match.group(1)
+    match = FUZZY_TERM.match(term)
+    if match:
+        word = match.group(1)
+        return "fuzzy", word, min(int(match.group(2)) if match.group(2) else auto_edits(word), MAX_EDITS)
+    return None
+
+
+def parse_query(query, analyzer=None):
+    """Return (terms, constraints): every term to AND together, plus positional clauses.
+
+    Words go through the same analyzer as the indexed text. NEAR binds the
+    nearest term on each side (the last/first word of a phrase). Prefix and
+    fuzzy terms are only lowercased, kept in their query form ("hel*",
+    "helo~1") for dictionary.expand, and can't take part in NEAR.
+    """
+    analyzer = analyzer or get_analyzer()
+    terms = []
+    constraints = []
+    near_slop = None
+    previous = None
+    for match in QUERY_TOKEN.finditer(query):
+        phrase, word = match.groups()
+        if word is not None:
+            operator = NEAR_OPERATOR.match(word)
+            if operator and previous is not None:
+                near_slop = int(operator.group(1)) if operator.group(1) else DEFAULT_NEAR_SLOP
+                continue
+            parsed = multi_term(word.lower())
+            if parsed is not None:
+                near_slop = previous = None
+                terms.append(parsed[1] + "*" if parsed[0] == "prefix" else f"{parsed[1]}~{parsed[2]}")
+                continue
+            words = analyzer.terms(word)
+        else:
+            analyzed = list(analyzer.iter_terms([phrase]))
+            words = [term for _, term in analyzed]
+            if len(words) > 1:
+                start = analyzed[0][0]
+                constraints.append(Phrase(words, [pos - start for pos, _ in analyzed]))
+        if not words:
+            continue
+        if near_slop is not None:
+            constraints.append(Near(previous, words[0], near_slop))
+            near_slop = None
+        terms.extend(words)
+        previous = words[-1]
+    return list(dict.fromkeys(terms)), constraints
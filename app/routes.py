@@ -1,69 +1,272 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from pydantic import BaseModel
-from .database import search_documents, get_all_documents, get_raw_documents, get_raw_extracted_text, get_raw_inverted_index, insert_document, get_document_status
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from . import async_db
+from . import database
+from .database import UPLOAD_DIR, PREVIEW_CHARS
 from .rabbitmq import publish_to_queue, get_queue_stats, TEXT_EXTRACT_QUEUE
+from .bulk import run_bulk
+from . import cache
+from . import compaction
+from . import metrics
+from . import doc_values
+from . import projection
+import asyncio
+import functools
 import json
 import os
 
 router = APIRouter()
+UPLOAD_CHUNK = 1024 * 1024  # bytes read from the request per write
+EXPORT_PAGE_SIZE = 1000  # rows fetched per query while streaming an export
+
+# Types of the sort values in each kind of search_after cursor
+SEARCH_AFTER = ((int, float), str)  # [score, id] of a hit
+ID_AFTER = (str,)  # [id] of a document
+ROW_AFTER = (int,)  # [id] of an extracted_text row
+INVERTED_INDEX_AFTER = (int, str, int)  # [term_id, doc_id, version]
+
+# Listing -> (fetch(limit, search_after), cursor(row), cursor shape) for
+# /_export. All but documents are per-shard tables and also take the shard to list.
+EXPORT_SOURCES = {
+    "documents": (database.get_all_documents, database.id_cursor, ID_AFTER),
+    "extracted_text": (database.get_raw_extracted_text, database.id_cursor, ROW_AFTER),
+    "inverted_index": (database.get_raw_inverted_index, database.inverted_index_cursor, INVERTED_INDEX_AFTER),
+}
+
+
+def valid_cursor(cursor, shape):
+    return (isinstance(cursor, list) and len(cursor) == len(shape)
+            and all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(cursor, shape)))
+
+
+def parse_search_after(value, shape):
+    # search_after is the JSON array of sort values returned with the previous page
+    if value is None:
+        return None
+    try:
+        cursor = json.loads(value)
+    except ValueError:
+        cursor = None
+    if not valid_cursor(cursor, shape):
+        raise HTTPException(status_code=400, detail="search_after must be the JSON array returned with the previous page")
+    return cursor
+
+
+def parse_source(value=None, includes=None, excludes=None, default=None):
+    # _source, _source_includes and _source_excludes query parameters
+    try:
+        return projection.SourceFilter.parse(value, includes, excludes, default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def check_shard(shard):
+    if not 0 <= shard < database.SHARDS:
+        raise HTTPException(status_code=400, detail=f"shard must be between 0 and {database.SHARDS - 1}")
+    return shard
+
+
+def next_cursor(rows, limit, cursor):
+    # A short page is the last one, and so is an unlimited one
+    return cursor(rows[-1]) if rows and 0 < limit <= len(rows) else None
+
+
+async def save_upload(file, file_path):
+    """Stream an upload to file_path; returns the first PREVIEW_CHARS of its text."""
+    head = b""
+    with open(file_path, "wb") as out:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            if len(head) < PREVIEW_CHARS * 4:
+                head += chunk[:PREVIEW_CHARS * 4 - len(head)]
+            await asyncio.to_thread(out.write, chunk)
+    return head.decode("utf-8", errors="ignore")[:PREVIEW_CHARS]
 
 class Document(BaseModel):
     id: str
     title: str
     content: str
+    fields: Dict[str, Any] = {}  # structured values for filters and aggregations
+
+class SearchRequest(BaseModel):
+    query: str = ""
+    filter: List[Dict[str, Any]] = []
+    aggs: Dict[str, Any] = {}
+    size: int = 10
+    search_after: Optional[List[Any]] = None
+    timeout: Optional[float] = None
+    source: Any = Field(None, alias="_source")  # true, false, patterns or {"includes", "excludes"}
+    highlight: Any = None  # true or {"number_of_fragments", "fragment_tokens"}
 
 @router.post("/documents")
 async def add_document(doc: Document):
-    message = json.dumps({"id": doc.id, "title": doc.title, "content": doc.content})
+    message = json.dumps({"id": doc.id, "title": doc.title, "content": doc.content, "fields": doc.fields})
     await publish_to_queue(TEXT_EXTRACT_QUEUE, message)
     return {"message": "Document queued for processing"}
 
 @router.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
-    content = await file.read()
-    text_content = content.decode("utf-8")
+    # Copied to disk chunk by chunk; only a short preview goes into the database
     doc_id = file.filename
     title = file.filename
-    file_path = f"app/uploads/{doc_id}"
-    with open(file_path, "w") as f:
-        f.write(text_content)
-    insert_document(doc_id, title, text_content, file_path)
-    message = json.dumps({"id": doc_id})
-    await publish_to_queue(TEXT_EXTRACT_QUEUE, message)
+    file_path = os.path.join(UPLOAD_DIR, os.path.basename(doc_id))
+    with metrics.STAGE_SECONDS.time("upload"):
+        preview = await save_upload(file, file_path)
+        await async_db.insert_document(doc_id, title, preview, file_path)
+        message = json.dumps({"id": doc_id})
+        await publish_to_queue(TEXT_EXTRACT_QUEUE, message)
+    metrics.STAGE_DOCUMENTS.inc(1, "upload")
     return {"message": f"Document '{file.filename}' uploaded and indexed", "doc_id": doc_id}
 
+@router.post("/_bulk")
+async def bulk(request: Request, id_field: str = "id", content_field: str = "content"):
+    # NDJSON body is parsed as it streams in and written in batched transactions
+    return await run_bulk(request.stream(), id_field, content_field)
+
 @router.get("/documents")
-async def get_documents(q: str = None, limit: int = 10):
+async def get_documents(q: str = None, limit: int = 10, timeout: float = None, search_after: str = None,
+                        source: str = Query(None, alias="_source"),
+                        source_includes: str = Query(None, alias="_source_includes"),
+                        source_excludes: str = Query(None, alias="_source_excludes"),
+                        highlight: bool = False):
     if q:
-        return {"results": search_documents(q, limit)}
-    else:
-        return {"results": get_all_documents(limit)}
+        return await search(q, limit, timeout, search_after, source, source_includes, source_excludes, highlight)
+    results = await async_db.get_all_documents(limit, timeout, parse_search_after(search_after, ID_AFTER),
+                                               parse_source(source, source_includes, source_excludes))
+    return {"results": results, "search_after": next_cursor(results, limit, database.id_cursor)}
 
 @router.get("/search")
-async def search(q: str, limit: int = 10):
+async def search(q: str, limit: int = 10, timeout: float = None, search_after: str = None,
+                 source: str = Query(None, alias="_source"),
+                 source_includes: str = Query(None, alias="_source_includes"),
+                 source_excludes: str = Query(None, alias="_source_excludes"),
+                 highlight: bool = False):
+    # Hits carry the title unless _source asks for more; highlight=true adds fragments around the matches
     if not q:
         raise HTTPException(status_code=400, detail="Query parameter 'q' is required")
-    return {"results": search_documents(q, limit)}
+    results = await async_db.search_documents(q, limit, timeout, parse_search_after(search_after, SEARCH_AFTER),
+                                              parse_source(source, source_includes, source_excludes),
+                                              projection.parse_highlight(highlight))
+    return {"results": results, "search_after": next_cursor(results, limit, database.search_cursor)}
+
+@router.post("/_search")
+async def structured_search(body: SearchRequest):
+    # Full-text query plus doc-value filters and aggregations (see doc_values.py)
+    if body.search_after is not None and not valid_cursor(body.search_after, SEARCH_AFTER):
+        raise HTTPException(status_code=400, detail="search_after must be the sort values of the last hit")
+    try:
+        doc_values.check_filters(body.filter)
+        doc_values.check_aggs(body.aggs)
+        source = projection.SourceFilter.parse(body.source)
+        highlight = projection.parse_highlight(body.highlight)
+        response = await async_db.filtered_search(body.query, body.size, body.timeout, body.search_after,
+                                                  body.filter, body.aggs, source, highlight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**response, "search_after": next_cursor(response["results"], body.size, database.search_cursor)}
+
+@router.get("/_export")
+async def export(q: str = None, source: str = "documents", search_after: str = None, shard: int = 0,
+                 source_filter: str = Query(None, alias="_source"),
+                 source_includes: str = Query(None, alias="_source_includes"),
+                 source_excludes: str = Query(None, alias="_source_excludes")):
+    """Stream a whole listing (or every hit for `q`) as NDJSON, one page in memory at a time.
+
+    Unlike search, an export is a dump: documents carry their full source unless _source says otherwise.
+    """
+    projected = parse_source(source_filter, source_includes, source_excludes, projection.FULL_SOURCE)
+    if q:
+        fetch = lambda limit, after: database.search_documents(q, limit, after, projected)
+        cursor = database.search_cursor
+        search_after = parse_search_after(search_after, SEARCH_AFTER)
+    elif source in EXPORT_SOURCES:
+        fetch, cursor, shape = EXPORT_SOURCES[source]
+        if source == "documents":
+            fetch = functools.partial(fetch, source=projected)
+        else:
+            fetch = functools.partial(fetch, shard=check_shard(shard))
+        search_after = parse_search_after(search_after, shape)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown source '{source}'")
+
+    async def lines():
+        async for rows in async_db.iter_pages(fetch, cursor, EXPORT_PAGE_SIZE, search_after):
+            yield "".join(json.dumps(row) + "\n" for row in rows)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @router.get("/raw/documents")
-async def raw_documents(limit: int = 100):
-    return {"data": get_raw_documents(limit)}
+async def raw_documents(limit: int = 100, search_after: str = None):
+    data = await async_db.get_raw_documents(limit, search_after=parse_search_after(search_after, ID_AFTER))
+    return {"data": data, "search_after": next_cursor(data, limit, database.id_cursor)}
 
 @router.get("/raw/extracted_text")
-async def raw_extracted_text(limit: int = 100):
-    return {"data": get_raw_extracted_text(limit)}
+async def raw_extracted_text(limit: int = 100, search_after: str = None, shard: int = 0):
+    data = await async_db.get_raw_extracted_text(limit, search_after=parse_search_after(search_after, ROW_AFTER),
+                                                 shard=check_shard(shard))
+    return {"data": data, "search_after": next_cursor(data, limit, database.id_cursor)}
 
 @router.get("/raw/inverted_index")
-async def raw_inverted_index(limit: int = 100):
-    return {"data": get_raw_inverted_index(limit)}
+async def raw_inverted_index(limit: int = 100, search_after: str = None, shard: int = 0):
+    after = parse_search_after(search_after, INVERTED_INDEX_AFTER)
+    data = await async_db.get_raw_inverted_index(limit, search_after=after, shard=check_shard(shard))
+    return {"data": data, "search_after": next_cursor(data, limit, database.inverted_index_cursor)}
 
 @router.get("/queue/stats")
 async def queue_stats():
     return await get_queue_stats()
 
+@router.post("/_compact")
+async def compact():
+    # Purge superseded document versions now instead of waiting for the background task
+    return await async_db.compact()
+
+@router.get("/_compact")
+async def compaction_report():
+    return {"last_report": compaction.last_report}
+
+@router.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    # Queue depths, status counts and cache sizes are read at scrape time
+    try:
+        queues = await get_queue_stats()
+    except Exception as e:
+        print(f"Queue stats unavailable for /metrics: {e}")
+        queues = {}
+    queues = [(queue, stats) for queue, stats in queues.items() if "message_count" in stats]
+    statuses = await async_db.document_status_counts()
+    caches = [(name, stats) for name, stats in cache.stats().items() if isinstance(stats, dict)]
+    extra = [
+        metrics.gauge("queue_messages", "Messages ready in each queue",
+                      [((queue,), stats["message_count"]) for queue, stats in queues], ("queue",)),
+        metrics.gauge("queue_unacked_messages", "Messages delivered but not yet acked",
+                      [((queue,), stats["unacked_count"]) for queue, stats in queues if "unacked_count" in stats],
+                      ("queue",)),
+        metrics.gauge("queue_consumers", "Consumers attached to each queue",
+                      [((queue,), stats["consumer_count"]) for queue, stats in queues], ("queue",)),
+        metrics.gauge("documents", "Documents by processing status",
+                      [((status,), n) for status, n in sorted(statuses.items(), key=str)], ("status",)),
+        metrics.gauge("cache_bytes", "Bytes held by each cache",
+                      [((name,), stats["bytes"]) for name, stats in caches], ("cache",)),
+    ]
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+@router.get("/_slow_queries")
+async def slow_queries():
+    # Enabled by SLOW_QUERY_MS; newest last
+    return {"threshold_ms": metrics.SLOW_QUERY_MS, "queries": list(metrics.slow_queries)}
+
 @router.get("/documents/{doc_id}/status")
 async def document_status(doc_id: str):
-    status = get_document_status(doc_id)
+    status = await async_db.get_document_status(doc_id)
     if not status:
         raise HTTPException(status_code=404, detail="Document not found")
     return status
\ No newline at end of file
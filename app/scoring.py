@@ -0,0 +1,89 @@
+import heapq
+import math
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def bm25_idf(doc_count, df):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def bm25_term(idf, tf, length, avg_length):
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) if avg_length else BM25_K1
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+def bm25_upper_bound(idf):
+    # Limit of bm25_term as tf grows: no posting for this term can score higher
+    return idf * (BM25_K1 + 1)
+
+
+# A prefix or fuzzy query term is scored as one term over all its expansions
+# (see dictionary.expand), like Lucene's SynonymQuery: tf is summed over the
+# expansions a document contains, and df is the largest of theirs, so a rare
+# misspelling doesn't outscore the common word it was expanded to.
+
+def index_terms(terms, expansions):
+    """The index terms a query reads: each expansion in place of its query term."""
+    return list(dict.fromkeys(term for query_term in terms for term in expansions.get(query_term, [query_term])))
+
+
+def blend_dfs(dfs, expansions):
+    """`dfs` of index terms plus a df for each expanded query term."""
+    blended = dict(dfs)
+    for query_term, terms in expansions.items():
+        blended[query_term] = max((dfs.get(term, 0) for term in terms), default=0)
+    return blended
+
+
+class _Hit:
+    # Heap entry; the smallest is the worst hit: lowest score, then highest doc_id
+    __slots__ = ("score", "doc_id")
+
+    def __init__(self, score, doc_id):
+        self.score = score
+        self.doc_id = doc_id
+
+    def __lt__(self, other):
+        return self.score < other.score or (self.score == other.score and self.doc_id > other.doc_id)
+
+
+class TopK:
+    """Bounded min-heap keeping the k best hits in (-score, doc_id) order.
+
+    Ties on score go to the lower doc_id, so the same k hits are kept
+    whatever order they arrive in; sharded search relies on that when it
+    merges per-shard lists. A hit scoring exactly `threshold` can still get in.
+
+    With `after` (a (score, doc_id) search_after cursor) only hits that sort
+    after it in (-score, doc_id) order are kept, which yields the next page.
+    """
+
+    def __init__(self, k, after=None):
+        self.k = max(k, 0)  # a zero or negative limit keeps nothing
+        self.after = after
+        self._heap = []
+
+    @property
+    def threshold(self):
+        # Score a new hit must beat to enter a full heap
+        if not self.k:
+            return float("inf")
+        return self._heap[0].score if len(self._heap) >= self.k else float("-inf")
+
+    def push(self, score, doc_id):
+        if not self.k:
+            return
+        if self.after and (-score, doc_id) <= (-self.after[0], self.after[1]):
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, _Hit(score, doc_id))
+        else:
+            worst = self._heap[0]
+            if score > worst.score or (score == worst.score and doc_id < worst.doc_id):
+                heapq.heapreplace(self._heap, _Hit(score, doc_id))
+
+    def results(self):
+        return sorted(((hit.score, hit.doc_id) for hit in self._heap), key=lambda hit: (-hit[0], hit[1]))
@@ -0,0 +1,606 @@
+"""Lucene-style segment index engine (INDEX_ENGINE=segment).
+
+New documents are buffered in an in-memory segment and flushed as immutable
+segment files: contiguous postings followed by a sorted term dictionary and
+the segment's document table, read back through mmap. Deletes and
+re-indexed documents are tracked with a per-segment bitset, and a
+background thread merges segments with a tiered policy. SQLite stays the
+document store; only postings live here.
+"""
+import heapq
+import json
+from array import array
+from bisect import bisect_left
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from .postings import write_varint, read_varint
+from .scoring import TopK, bm25_idf, bm25_term, bm25_upper_bound, blend_dfs, index_terms
+from . import metrics
+
+SEGMENT_DIR = os.getenv("SEGMENT_DIR", "segments")
+FLUSH_DOCS = int(os.getenv("SEGMENT_FLUSH_DOCS", "5000"))  # buffered docs per in-memory segment
+FLUSH_INTERVAL = 5.0  # seconds before a non-empty buffer is flushed anyway
+MERGE_FACTOR = 10  # segments per tier before they are merged
+MERGE_INTERVAL = 1.0  # seconds between background flush/merge checks
+EXPUNGE_RATIO = 0.5  # rewrite a segment alone once this fraction is deleted
+
+MAGIC = b"SEG1"
+HEADER = struct.Struct("<4sIIQQ")  # magic, doc_count, term_count, dict_offset, docs_offset
+
+
+class Bitset:
+    def __init__(self, size, data=None):
+        self.bits = bytearray(data) if data is not None else bytearray((size + 7) // 8)
+        self.count = sum(bin(b).count("1") for b in self.bits)
+
+    def __contains__(self, i):
+        return self.bits[i >> 3] & (1 << (i & 7))
+
+    def add(self, i):
+        if i not in self:
+            self.bits[i >> 3] |= 1 << (i & 7)
+            self.count += 1
+
+
+class MemoryPostings:
+    def __init__(self):
+        self.ords = []
+        self.tfs = []
+        self.blobs = []
+
+    def blob(self, i):
+        return self.blobs[i]
+
+
+class DiskPostings:
+    """One term's postings block: ords and tfs as fixed-width arrays, then positions."""
+
+    def __init__(self, data, df):
+        width = 4 * df
+        self.ords = array("I", data[:width])
+        self.tfs = array("I", data[width:2 * width])
+        self.offsets = array("I", data[2 * width:3 * width + 4])
+        self.data = data[3 * width + 4:]
+
+    def blob(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+class MemorySegment:
+    """Write buffer: postings lists grow in doc order as documents arrive."""
+
+    name = None
+
+    def __init__(self):
+        self.doc_ids = []
+        self.versions = []
+        self.lengths = []
+        self.postings = {}  # term -> MemoryPostings
+        self.deletes = Bitset(0)
+        self.created = time.monotonic()
+
+    @property
+    def doc_count(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_id, version, term_blobs, length):
+        ord_ = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.versions.append(version)
+        self.lengths.append(length)
+        if len(self.deletes.bits) * 8 <= ord_:
+            self.deletes.bits.extend(bytes(max(1, len(self.deletes.bits))))
+        for term, (tf, blob) in term_blobs.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = MemoryPostings()
+            postings.blobs.append(blob)
+            postings.tfs.append(tf)
+            postings.ords.append(ord_)  # last: readers size their scans by ords
+        return ord_
+
+    def df(self, term):
+        postings = self.postings.get(term)
+        return len(postings.ords) if postings else 0
+
+    def live_df(self, term):
+        postings = self.postings.get(term)
+        if postings is None:
+            return 0
+        deletes = self.deletes
+        return sum(1 for i in range(len(postings.ords)) if postings.ords[i] not in deletes)
+
+    def get_postings(self, term):
+        return self.postings.get(term)
+
+    def terms(self):
+        return sorted(self.postings)
+
+
+class DiskSegment:
+    """Immutable segment file, memory-mapped; only the delete bitset changes."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name + ".seg")
+        self.del_path = os.path.join(directory, name + ".del")
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, doc_count, term_count, dict_offset, docs_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a segment file: {self.path}")
+        # Term dictionary: sorted entries of (term, df, postings offset, postings length)
+        self._dict = {}
+        self._terms = []
+        buf = self._mm
+        pos = dict_offset
+        for _ in range(term_count):
+            size, pos = read_varint(buf, pos)
+            term = buf[pos:pos + size].decode()
+            pos += size
+            df, pos = read_varint(buf, pos)
+            offset, pos = read_varint(buf, pos)
+            length, pos = read_varint(buf, pos)
+            self._dict[term] = (df, offset, length)
+            self._terms.append(term)
+        docs = json.loads(buf[docs_offset:len(buf)].decode())
+        self.doc_ids = [d[0] for d in docs]
+        self.versions = [d[1] for d in docs]
+        self.lengths = [d[2] for d in docs]
+        data = None
+        if os.path.exists(self.del_path):
+            with open(self.del_path, "rb") as f:
+                data = f.read()
+        self.deletes = Bitset(doc_count, data)
+        self._deletes_dirty = False
+        self._live_dfs = {}  # term -> (deletes.count, live df); deletes only grow
+
+    @property
+    def doc_count(self):
+        return len(self.doc_ids)
+
+    def df(self, term):
+        entry = self._dict.get(term)
+        return entry[0] if entry else 0
+
+    def live_df(self, term):
+        deleted = self.deletes.count
+        if not deleted:
+            return self.df(term)
+        cached = self._live_dfs.get(term)
+        if cached is not None and cached[0] == deleted:
+            return cached[1]
+        postings = self.get_postings(term)
+        df = sum(1 for ord_ in postings.ords if ord_ not in self.deletes) if postings else 0
+        self._live_dfs[term] = (deleted, df)
+        return df
+
+    def get_postings(self, term):
+        entry = self._dict.get(term)
+        if entry is None:
+            return None
+        df, offset, length = entry
+        return DiskPostings(self._mm[offset:offset + length], df)
+
+    def terms(self):
+        return self._terms
+
+    def mark_deleted(self, ord_):
+        self.deletes.add(ord_)
+        self._deletes_dirty = True
+
+    def save_deletes(self):
+        if self._deletes_dirty:
+            tmp = self.del_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.deletes.bits)
+            os.replace(tmp, self.del_path)
+            self._deletes_dirty = False
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def remove(self):
+        # Unlink only: searches that still hold this segment keep reading the
+        # mapping, which is released when the object is garbage collected.
+        for path in (self.path, self.del_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_segment(path, docs, term_postings):
+    """Write a segment file.
+
+    docs: [(doc_id, version, length)] indexed by ord.
+    term_postings: (term, ords, tfs, positions blobs) in term order, ords ascending.
+    """
+    tmp = path + ".tmp"
+    entries = []
+    with open(tmp, "wb") as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for term, ords, tfs, blobs in term_postings:
+            offsets = array("I", [0])
+            for blob in blobs:
+                offsets.append(offsets[-1] + len(blob))
+            block = array("I", ords).tobytes() + array("I", tfs).tobytes() + offsets.tobytes() + b"".join(blobs)
+            f.write(block)
+            entries.append((term, len(ords), offset, len(block)))
+            offset += len(block)
+        dict_offset = offset
+        buf = bytearray()
+        for term, df, postings_offset, length in entries:
+            encoded = term.encode()
+            write_varint(buf, len(encoded))
+            buf += encoded
+            write_varint(buf, df)
+            write_varint(buf, postings_offset)
+            write_varint(buf, length)
+        f.write(buf)
+        docs_offset = dict_offset + len(buf)
+        f.write(json.dumps(docs).encode())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(docs), len(entries), dict_offset, docs_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SegmentIndex:
+    def __init__(self, directory=SEGMENT_DIR, flush_docs=FLUSH_DOCS, background=True):
+        self.directory = directory
+        self.flush_docs = flush_docs
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._manifest = os.path.join(directory, "manifest.json")
+        self._next_id = 1
+        self.segments = []
+        if os.path.exists(self._manifest):
+            with open(self._manifest) as f:
+                manifest = json.load(f)
+            self._next_id = manifest["next_id"]
+            self.segments = [DiskSegment(directory, name) for name in manifest["segments"]]
+        self.buffer = MemorySegment()
+        # doc_id -> (segment, ord) of its live copy; plus live corpus totals for BM25
+        self._live = {}
+        self.doc_count = 0
+        self.total_length = 0
+        for segment in self.segments:
+            for ord_, doc_id in enumerate(segment.doc_ids):
+                if ord_ not in segment.deletes:
+                    self._track(doc_id, segment, ord_)
+        self._stop = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._background, name="segment-merger", daemon=True)
+            self._thread.start()
+
+    def _track(self, doc_id, segment, ord_):
+        self._live[doc_id] = (segment, ord_)
+        self.doc_count += 1
+        self.total_length += segment.lengths[ord_]
+
+    def _untrack(self, doc_id):
+        location = self._live.pop(doc_id, None)
+        if location is None:
+            return
+        segment, ord_ = location
+        if isinstance(segment, DiskSegment):
+            segment.mark_deleted(ord_)
+        else:
+            segment.deletes.add(ord_)
+        self.doc_count -= 1
+        self.total_length -= segment.lengths[ord_]
+
+    # Indexing
+
+    def add_many(self, postings):
+        """postings: [(doc_id, version, {term: (tf, positions blob)}, length)]"""
+        with self._lock:
+            for doc_id, version, term_blobs, length in postings:
+                self._untrack(doc_id)
+                ord_ = self.buffer.add(doc_id, version, term_blobs, length)
+                self._track(doc_id, self.buffer, ord_)
+            if self.buffer.doc_count >= self.flush_docs:
+                self.flush()
+
+    def delete_many(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._untrack(doc_id)
+
+    def positions(self, terms, doc_ids):
+        """{doc_id: {term: positions blob}} of `terms` in the live copies of `doc_ids`."""
+        with self._lock:
+            located = [(doc_id, self._live[doc_id]) for doc_id in doc_ids if doc_id in self._live]
+        lists = {}  # (segment, term) -> postings, read once per segment
+        found = {}
+        for doc_id, (segment, ord_) in located:
+            for term in terms:
+                key = (id(segment), term)
+                if key not in lists:
+                    lists[key] = segment.get_postings(term)
+                postings = lists[key]
+                if postings is None:
+                    continue
+                i = bisect_left(postings.ords, ord_)
+                if i < len(postings.ords) and postings.ords[i] == ord_:
+                    found.setdefault(doc_id, {})[term] = postings.blob(i)
+        return found
+
+    def versions(self):
+        # doc_id -> version of its live copy
+        with self._lock:
+            return {doc_id: segment.versions[ord_] for doc_id, (segment, ord_) in self._live.items()}
+
+    def flush(self):
+        with self._lock:
+            buffer = self.buffer
+            if buffer.doc_count == 0:
+                self._commit()
+                return
+            name = self._new_name()
+            write_segment(os.path.join(self.directory, name + ".seg"),
+                          [[d, v, n] for d, v, n in zip(buffer.doc_ids, buffer.versions, buffer.lengths)],
+                          ((term, p.ords, p.tfs, p.blobs) for term, p in
+                           ((term, buffer.postings[term]) for term in buffer.terms())))
+            segment = DiskSegment(self.directory, name)
+            for ord_ in range(buffer.doc_count):
+                if ord_ in buffer.deletes:
+                    segment.mark_deleted(ord_)
+                else:
+                    self._live[buffer.doc_ids[ord_]] = (segment, ord_)
+            self.segments.append(segment)
+            self.buffer = MemorySegment()
+            self._commit()
+
+    def _new_name(self):
+        name = f"seg_{self._next_id:06d}"
+        self._next_id += 1
+        return name
+
+    def _commit(self):
+        # Persist delete bitsets, then atomically publish the segment list
+        for segment in self.segments:
+            segment.save_deletes()
+        tmp = self._manifest + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"next_id": self._next_id, "segments": [s.name for s in self.segments]}, f)
+        os.replace(tmp, self._manifest)
+
+    # Merging
+
+    def find_merges(self):
+        """Tiered policy: MERGE_FACTOR segments of the same size tier merge together."""
+        tiers = {}
+        merges = []
+        for segment in self.segments:
+            live = segment.doc_count - segment.deletes.count
+            if segment.doc_count and segment.deletes.count / segment.doc_count >= EXPUNGE_RATIO:
+                merges.append([segment])
+                continue
+            tiers.setdefault(int(math.log10(max(live, 1))), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= MERGE_FACTOR:
+                merges.append(tiers[tier][:MERGE_FACTOR])
+        return merges
+
+    def merge(self, sources):
+        with self._merge_lock:
+            with self._lock:
+                if any(s not in self.segments for s in sources):
+                    return
+                name = self._new_name()
+                snapshot = [set(i for i in range(s.doc_count) if i in s.deletes) for s in sources]
+            # Heavy lifting happens without the engine lock; sources are immutable
+            remap = []
+            docs = []
+            origin = []
+            for segment, deleted in zip(sources, snapshot):
+                mapping = {}
+                for ord_ in range(segment.doc_count):
+                    if ord_ not in deleted:
+                        mapping[ord_] = len(docs)
+                        docs.append([segment.doc_ids[ord_], segment.versions[ord_], segment.lengths[ord_]])
+                        origin.append((segment, ord_))
+                remap.append(mapping)
+
+            def merged_postings():
+                for term in _unique(heapq.merge(*[s.terms() for s in sources])):
+                    ords, tfs, blobs = [], [], []
+                    for segment, mapping in zip(sources, remap):
+                        postings = segment.get_postings(term)
+                        if postings is None:
+                            continue
+                        for i, ord_ in enumerate(postings.ords):
+                            if ord_ in mapping:
+                                ords.append(mapping[ord_])
+                                tfs.append(postings.tfs[i])
+                                blobs.append(postings.blob(i))
+                    if ords:
+                        yield term, ords, tfs, blobs
+
+            merged = None
+            if docs:
+                write_segment(os.path.join(self.directory, name + ".seg"), docs, merged_postings())
+                merged = DiskSegment(self.directory, name)
+            with self._lock:
+                # Carry over deletes and re-indexes that happened during the merge
+                for new_ord, (segment, ord_) in enumerate(origin):
+                    doc_id = segment.doc_ids[ord_]
+                    if self._live.get(doc_id) == (segment, ord_):
+                        self._live[doc_id] = (merged, new_ord)
+                    else:
+                        merged.mark_deleted(new_ord)
+                position = self.segments.index(sources[0])
+                self.segments = [s for s in self.segments if s not in sources]
+                if merged is not None:
+                    self.segments.insert(position, merged)
+                self._commit()
+            for segment in sources:
+                segment.remove()
+
+    def maybe_merge(self):
+        for sources in self.find_merges():
+            self.merge(sources)
+
+    def _background(self):
+        while not self._stop.wait(MERGE_INTERVAL):
+            try:
+                if self.buffer.doc_count and time.monotonic() - self.buffer.created >= FLUSH_INTERVAL:
+                    self.flush()
+                self.maybe_merge()
+            except Exception as e:
+                print(f"Segment maintenance failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+
+    # Search
+
+    def stats(self, terms):
+        with self._lock:
+            segments = self.segments + [self.buffer]
+            doc_count, total_length = self.doc_count, self.total_length
+        # Live df, as in the SQLite engine: N counts live documents only, so a df
+        # counting deleted copies could exceed it and turn idf negative
+        dfs = {term: sum(s.live_df(term) for s in segments) for term in terms}
+        return doc_count, (total_length / doc_count if doc_count else 0.0), dfs
+
+    def term_dfs(self):
+        # {term: df} over all segments, for the term dictionary. Deleted copies
+        # count too, as in its updates (see database.write_postings): it only
+        # ranks expansion candidates, idf comes from stats()
+        with self._lock:
+            segments = self.segments + [self.buffer]
+        dfs = {}
+        for segment in segments:
+            for term in segment.terms():
+                dfs[term] = dfs.get(term, 0) + segment.df(term)
+        return dfs
+
+    def search(self, terms, limit, constraints=(), stats=None, after=None, expansions=None):
+        """BM25 top-k (score, doc_id) over documents containing every term, after an optional cursor."""
+        with self._lock:
+            segments = self.segments + [self.buffer]
+        expansions = expansions or {}
+        doc_count, avg_length, dfs = stats or self.stats(index_terms(terms, expansions))
+        dfs = blend_dfs(dfs, expansions)
+        if not terms or any(dfs.get(term, 0) == 0 for term in terms):
+            return []
+        idfs = {term: bm25_idf(doc_count, dfs[term]) for term in terms}
+        top = TopK(limit, after)
+        scanned = 0
+        for segment in segments:
+            scanned += _search_segment(segment, terms, idfs, avg_length, constraints, top, expansions)
+        metrics.POSTINGS_SCANNED.observe(scanned, "segment")
+        return top.results()
+
+
+def _unique(sorted_items):
+    previous = None
+    for item in sorted_items:
+        if item != previous:
+            yield item
+            previous = item
+
+
+def _union_postings(segment, terms):
+    # One postings list for an expanded query term: ords merged, tfs summed (no positions)
+    lists = [postings for postings in map(segment.get_postings, terms) if postings is not None]
+    if len(lists) <= 1:
+        return lists[0] if lists else None
+    tfs = {}
+    for postings in lists:
+        for i in range(len(postings.ords)):
+            ord_ = postings.ords[i]
+            tfs[ord_] = tfs.get(ord_, 0) + postings.tfs[i]
+    union = MemoryPostings()
+    union.ords = sorted(tfs)
+    union.tfs = [tfs[ord_] for ord_ in union.ords]
+    return union
+
+
+def _search_segment(segment, terms, idfs, avg_length, constraints, top, expansions=None):
+    # Returns the number of postings read (leader postings plus probes)
+    expansions = expansions or {}
+    lists = {term: _union_postings(segment, expansions[term]) if term in expansions else segment.get_postings(term)
+             for term in terms}
+    if any(postings is None for postings in lists.values()):
+        return 0
+    # Snapshot sizes: the in-memory buffer may keep growing while we read it
+    sizes = {term: len(postings.ords) for term, postings in lists.items()}
+    lead, *rest = sorted(terms, key=sizes.get)
+    rest_bound = sum(bm25_upper_bound(idfs[term]) for term in rest)
+    leader = lists[lead]
+    others = [lists[term] for term in rest]
+    cursors = [0] * len(others)
+    deletes = segment.deletes
+    probes = 0
+    for i in range(sizes[lead]):
+        ord_ = leader.ords[i]
+        # Leapfrog the other sorted postings lists to this document with binary search
+        hits = []
+        for j, postings in enumerate(others):
+            cursor = bisect_left(postings.ords, ord_, cursors[j], sizes[rest[j]])
+            cursors[j] = cursor
+            probes += 1
+            if cursor == sizes[rest[j]]:
+                return i + 1 + probes  # a required term has no more postings in this segment
+            if postings.ords[cursor] != ord_:
+                break
+            hits.append(cursor)
+        else:
+            if ord_ in deletes:
+                continue
+            length = segment.lengths[ord_]
+            score = bm25_term(idfs[lead], leader.tfs[i], length, avg_length)
+            if score + rest_bound < top.threshold:
+                continue
+            for term, postings, cursor in zip(rest, others, hits):
+                score += bm25_term(idfs[term], postings.tfs[cursor], length, avg_length)
+            if score < top.threshold:
+                continue
+            if constraints:
+                # Constraints only name exact terms; expanded ones have no positions
+                blobs = {} if lead in expansions else {lead: leader.blob(i)}
+                blobs.update((term, postings.blob(cursor)) for term, postings, cursor in zip(rest, others, hits)
+                             if term not in expansions)
+                if not all(c.matches(blobs) for c in constraints):
+                    continue
+            top.push(score, segment.doc_ids[ord_])
+    return sizes[lead] + probes
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SegmentIndex(SEGMENT_DIR)
+    return _engine
+
+
+def close_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
@@ -0,0 +1,135 @@
+"""Scatter-gather search over hash-sharded databases (SHARDS > 1).
+
+Each shard is a complete database holding the documents whose id hashes to
+it (see database.shard_for). A query first sums the BM25 statistics of all
+shards, so every shard scores with the same idf and average length, then
+runs search_index on each shard in a process pool and merges the per-shard
+top-k lists. A document's score is the same as with a single database.
+"""
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from . import cache
+from . import database
+from . import metrics
+from .scoring import TopK, blend_dfs, index_terms
+
+# Processes searching shards in parallel (default: one per shard, up to the CPU count);
+# 0 searches them one after another in the calling thread
+SEARCH_PROCESSES = os.getenv("SEARCH_PROCESSES")
+PROGRESS_STEPS = 10000  # SQLite VM steps between deadline checks in a worker
+
+_request = threading.local()  # deadline of the query running on this thread, see deadline()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@contextmanager
+def deadline(when):
+    """Shard searches started in this block on this thread stop at `when` (a
+    time.time()). Interrupting the caller's connections cannot reach the
+    worker processes, so they enforce it themselves."""
+    previous = getattr(_request, "deadline", None)
+    _request.deadline = when
+    try:
+        yield
+    finally:
+        _request.deadline = previous
+
+
+def global_stats(terms):
+    """(doc_count, avg_length, {term: df}) over all shards."""
+    doc_count = total_length = 0
+    dfs = dict.fromkeys(terms, 0)
+    for shard in range(database.SHARDS):
+        with database.read_connection(shard) as db:
+            count, length, shard_dfs = database.corpus_totals(db, terms)
+        doc_count += count
+        total_length += length
+        for term, df in shard_dfs.items():
+            dfs[term] += df
+    return doc_count, (total_length / doc_count if doc_count else 0.0), dfs
+
+
+def search(terms, limit, constraints=(), after=None, expansions=None):
+    """Corpus-wide top-k (score, doc_id), as search_index returns for one database."""
+    expansions = expansions or {}
+    stats = global_stats(index_terms(terms, expansions))
+    if not terms or any(blend_dfs(stats[2], expansions).get(term, 0) == 0 for term in terms):
+        return []
+    executor = _get_executor()
+    if executor is None:
+        shard_hits = []
+        for shard in range(database.SHARDS):
+            with database.read_connection(shard) as db:
+                shard_hits.append(database.search_index(db, terms, limit, stats, constraints, after,
+                                                        expansions=expansions))
+    else:
+        # Workers hold their own connections; the generation tells them when to drop cached postings
+        until = getattr(_request, "deadline", None)
+        futures = [executor.submit(_search_shard, database.shard_path(shard), shard, cache.generation(), until,
+                                   terms, limit, stats, constraints, after, expansions)
+                   for shard in range(database.SHARDS)]
+        shard_hits = []
+        for future in futures:
+            hits, observations = future.result()
+            metrics.replay(observations)  # postings scanned and SQL timings, recorded here
+            shard_hits.append(hits)
+    top = TopK(limit, after)
+    for hits in shard_hits:
+        for score, doc_id in hits:
+            top.push(score, doc_id)
+    return top.results()
+
+
+def _get_executor():
+    global _executor
+    processes = min(database.SHARDS, os.cpu_count() or 1) if SEARCH_PROCESSES is None else int(SEARCH_PROCESSES)
+    if processes <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the parent holds SQLite connections and threads
+            _executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def close():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+# Worker process state: one read-only connection per shard file
+_connections = {}
+_seen_generation = None
+
+
+def _search_shard(path, shard, generation, until, terms, limit, stats, constraints, after, expansions):
+    global _seen_generation
+    if generation != _seen_generation:
+        cache.postings.clear()  # the parent committed since; cached postings may be stale
+        _seen_generation = generation
+    db = _connections.get(path)
+    if db is None:
+        db = _connections[path] = database.connect(path, shard)
+        db.execute("PRAGMA query_only = ON")
+    if until is not None:
+        if time.time() >= until:
+            raise sqlite3.OperationalError("interrupted")  # timed out while queued
+        # A true return aborts the running statement, as Connection.interrupt() does
+        db.set_progress_handler(lambda: time.time() >= until, PROGRESS_STEPS)
+    try:
+        with metrics.capture() as observations:
+            hits = database.search_index(db, terms, limit, stats, constraints, after, expansions=expansions)
+    finally:
+        if until is not None:
+            db.set_progress_handler(None, 0)
+    return hits, observations
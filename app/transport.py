@@ -0,0 +1,56 @@
+import os
+from abc import ABC, abstractmethod
+
+# Message transport shared by the publisher (rabbitmq.py) and the consumers
+# (consumer.py). QUEUE_BACKEND picks the implementation: "rabbitmq" (aio-pika,
+# needs a broker) or "embedded" (durable SQLite queue in this process, see
+# embedded_queue.py).
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "rabbitmq")
+
+EXCHANGE_NAME = "document_events"
+TEXT_EXTRACT_QUEUE = "text_extract_queue"
+INDEX_QUEUE = "index_queue"
+TEXT_EXTRACT_DLQ = "text_extract_dlq"
+INDEX_DLQ = "index_dlq"
+DEAD_LETTER_QUEUES = {TEXT_EXTRACT_QUEUE: TEXT_EXTRACT_DLQ, INDEX_QUEUE: INDEX_DLQ}
+
+# Dead-letter policy, as declared on the RabbitMQ queues
+MESSAGE_TTL_MS = 60000  # 1 minute retry delay
+MAX_RETRIES = 3  # Max retries before DLQ
+
+
+class Transport(ABC):
+    """Interface every queue backend implements.
+
+    Consumers get message objects with a ``body`` (bytes) and async
+    ``ack()`` / ``nack(requeue=True)``. ``nack(requeue=False)`` applies the
+    dead-letter policy above.
+    """
+
+    @abstractmethod
+    async def setup(self):
+        """Declare queues and dead-letter queues."""
+
+    @abstractmethod
+    async def start(self):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    @abstractmethod
+    async def publish(self, routing_key, message):
+        ...
+
+    @abstractmethod
+    async def publish_batch(self, routing_key, messages):
+        ...
+
+    @abstractmethod
+    async def consume(self, queue_name, callback, prefetch):
+        """Start delivering messages from queue_name to ``await callback(message)``."""
+
+    @abstractmethod
+    async def queue_stats(self):
+        """{queue: {"message_count", "consumer_count"}} for the queues and DLQs."""
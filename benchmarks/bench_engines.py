@@ -0,0 +1,77 @@
+"""Indexing throughput and query latency: SQLite postings vs the segment engine.
+
+    python -m benchmarks.bench_engines --docs 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app import database, segments
+from .common import percentile
+
+
+def run(engine, docs, queries, batch_size):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{engine}-")
+    database.close_pool()
+    segments.close_engine()
+    database.DATABASE_PATH = os.path.join(workdir, "bench.db")
+    database.INDEX_ENGINE = engine
+    segments.SEGMENT_DIR = os.path.join(workdir, "segments")
+    database.get_pool()
+    start = time.perf_counter()
+    for i in range(0, len(docs), batch_size):
+        database.bulk_write([("index", doc_id, doc_id, text) for doc_id, text in docs[i:i + batch_size]])
+    if engine == "segment":
+        segments.get_engine().flush()
+    ingest = len(docs) / (time.perf_counter() - start)
+    # Postings alone (what the engine choice changes): re-index pre-tokenized docs
+    analyzer = database.get_analyzer()
+    tokenized = [(doc_id, 2, analyzer.analyze([text])) for doc_id, text in docs]
+    start = time.perf_counter()
+    for i in range(0, len(tokenized), batch_size):
+        with database.transaction() as db:
+            database.write_postings(db, tokenized[i:i + batch_size])
+    if engine == "segment":
+        segments.get_engine().flush()
+    postings = len(docs) / (time.perf_counter() - start)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        database.search_documents(query, 10)
+        latencies.append(time.perf_counter() - start)
+    database.close_pool()
+    segments.close_engine()
+    return ingest, postings, latencies
+
+
+def main(args):
+    random.seed(args.seed)
+    vocab = [f"t{i}" for i in range(args.vocab)]
+    weights = [1 / (rank + 1) for rank in range(args.vocab)]  # Zipfian
+    docs = [(f"doc{i}", " ".join(random.choices(vocab, weights, k=args.doc_length))) for i in range(args.docs)]
+    queries = []
+    for _ in range(args.queries):
+        kind = random.random()
+        if kind < 0.4:
+            queries.append(random.choice(vocab[:50]))  # one common term
+        elif kind < 0.8:
+            queries.append(" ".join(random.sample(vocab[:500], 2)))  # two mid-frequency terms
+        else:
+            queries.append(f'"{random.choice(vocab[:20])} {random.choice(vocab[:20])}"')  # phrase
+    for engine in ("sqlite", "segment"):
+        ingest, postings, latencies = run(engine, docs, queries, args.batch_size)
+        print(f"{engine:<8} ingest {ingest:7.0f} docs/s   postings only {postings:7.0f} docs/s   query p50 {percentile(latencies, 50) * 1000:7.2f} ms"
+              f"   p99 {percentile(latencies, 99) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--doc-length", type=int, default=200)
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""End-to-end HTTP load against the FastAPI app, in process.
+
+The app starts as it does under uvicorn (startup event, consumers,
+compaction), with the embedded SQLite queue standing in for RabbitMQ, and
+requests go through httpx's ASGI transport, so no network or broker is
+needed. `clients` concurrent clients:
+
+- POST /documents until the corpus is queued; the ingest throughput is
+  measured until every document has gone through the consumers and is
+  indexed, the latencies are those of the POST requests
+- then GET /search over the query mix, with the result cache cleared
+  before each query
+
+    python -m benchmarks.suite --only http
+"""
+import asyncio
+import os
+import time
+
+import httpx
+
+from app import async_db, cache, main, rabbitmq
+from app.embedded_queue import EmbeddedTransport
+from .common import db_size, fresh_index, quiet, summarize
+
+INDEX_TIMEOUT = 600  # seconds to wait for the consumers to index the corpus
+
+
+async def _until_indexed(count):
+    deadline = time.perf_counter() + INDEX_TIMEOUT
+    while True:
+        counts = await async_db.document_status_counts()
+        if counts.get("failed"):
+            raise RuntimeError(f"{counts['failed']} document(s) failed to index")
+        if counts.get("indexed", 0) >= count:
+            return
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"Only {counts.get('indexed', 0)} of {count} documents indexed")
+        await asyncio.sleep(0.02)
+
+
+async def _load(corpus, queries, clients, limit):
+    docs = corpus.documents()
+    mix = iter(corpus.queries(queries))
+    post_latencies = []
+    search_latencies = []
+
+    async def poster(client):
+        for doc_id, title, content in docs:
+            start = time.perf_counter()
+            response = await client.post("/documents", json={"id": doc_id, "title": title, "content": content})
+            post_latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    async def searcher(client):
+        for _, query in mix:
+            cache.results.clear()
+            start = time.perf_counter()
+            response = await client.get("/search", params={"q": query, "limit": limit})
+            search_latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(poster(client) for _ in range(clients)))
+        await _until_indexed(corpus.docs)
+        ingest = summarize(post_latencies, time.perf_counter() - start, corpus.docs)
+        start = time.perf_counter()
+        await asyncio.gather(*(searcher(client) for _ in range(clients)))
+        search = summarize(search_latencies, time.perf_counter() - start)
+    return ingest, search
+
+
+async def _run(corpus, queries, clients, limit, workdir):
+    previous = rabbitmq._transport
+    rabbitmq._transport = EmbeddedTransport(os.path.join(workdir, "queue.db"))
+    before = asyncio.all_tasks()
+    try:
+        await main.startup_event()
+        ingest, search = await _load(corpus, queries, clients, limit)
+    finally:
+        # Stop the consumers and compaction before shutdown closes the pool under them
+        background = asyncio.all_tasks() - before
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await main.shutdown_event()
+        rabbitmq._transport = previous
+    return {"ingest": ingest, "search": search, "db_bytes": db_size()}  # shutdown closed the pool
+
+
+def run(corpus, queries=500, clients=4, limit=10, shard_count=1):
+    workdir = fresh_index("http", shard_count)
+    with quiet():
+        return asyncio.run(_run(corpus, queries, clients, limit, workdir))
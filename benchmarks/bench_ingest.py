@@ -0,0 +1,61 @@
+"""Ingest throughput and latency for each write path, on a fresh index per path.
+
+- add_document: one document per transaction, as a direct caller would
+- pipeline: the queue consumers' work without the broker,
+  process_text_extract then process_index, one consumer batch at a time
+- bulk_write: the _bulk path, BULK_BATCH_SIZE documents per transaction
+
+Latencies are per call (a document for add_document, a batch otherwise).
+
+    python -m benchmarks.suite --only ingest
+"""
+import json
+import time
+from itertools import islice
+
+from app import consumer, database
+from app.bulk import BULK_BATCH_SIZE
+from .common import db_size, fresh_index, quiet, summarize
+
+
+def _add_document(batch):
+    for doc_id, title, content in batch:
+        database.add_document(doc_id, title, content)
+
+
+def _pipeline(batch):
+    messages = consumer.process_text_extract([{"id": doc_id, "title": title, "content": content}
+                                              for doc_id, title, content in batch])
+    consumer.process_index([json.loads(message) for message in messages])
+
+
+def _bulk_write(batch):
+    database.bulk_write([("index", *doc) for doc in batch])
+
+
+# path -> (ingest(batch), documents per call)
+PATHS = {
+    "add_document": (_add_document, 1),
+    "pipeline": (_pipeline, consumer.CONSUMER_BATCH_SIZE),
+    "bulk_write": (_bulk_write, BULK_BATCH_SIZE),
+}
+
+
+def run(corpus, shard_count=1):
+    results = {}
+    for name, (ingest, batch_size) in PATHS.items():
+        fresh_index(f"ingest-{name}", shard_count)
+        docs = corpus.documents()
+        latencies = []
+        with quiet():
+            while True:
+                batch = list(islice(docs, batch_size))
+                if not batch:
+                    break
+                start = time.perf_counter()
+                ingest(batch)
+                latencies.append(time.perf_counter() - start)
+        # Throughput over the time spent writing, not generating the corpus
+        database.close_pool()
+        results[name] = {**summarize(latencies, sum(latencies), corpus.docs), "db_bytes": db_size()}
+    return results
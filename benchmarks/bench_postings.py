@@ -0,0 +1,73 @@
+"""Index size and query latency: JSON position arrays vs binary postings.
+
+    python -m benchmarks.bench_postings --docs 5000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import time
+
+from app.postings import encode_positions
+
+
+def build(db, fmt, docs):
+    db.execute(f"CREATE TABLE inverted_index (term TEXT, doc_id TEXT, version INTEGER, {'tf INTEGER, ' if fmt == 'binary' else ''}"
+               f"positions {'BLOB' if fmt == 'binary' else 'TEXT'}, PRIMARY KEY (term, doc_id, version))")
+    rows = []
+    for doc_id, tokens in docs:
+        term_positions = {}
+        for pos, token in enumerate(tokens):
+            term_positions.setdefault(token, []).append(pos)
+        for term, positions in term_positions.items():
+            if fmt == "binary":
+                rows.append((term, doc_id, 1, len(positions), encode_positions(positions)))
+            else:
+                rows.append((term, doc_id, 1, json.dumps(positions)))
+    rows.sort()
+    start = time.perf_counter()
+    placeholders = ",".join("?" * len(rows[0]))
+    db.executemany(f"INSERT INTO inverted_index VALUES ({placeholders})", rows)
+    db.commit()
+    build_time = time.perf_counter() - start
+    db.execute("VACUUM")
+    size = db.execute("PRAGMA page_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+    return build_time, size
+
+
+def query(db, fmt, terms):
+    latencies = []
+    for term in terms:
+        start = time.perf_counter()
+        if fmt == "binary":
+            freqs = {doc_id: tf for doc_id, tf in db.execute("SELECT doc_id, tf FROM inverted_index WHERE term = ?", (term,))}
+        else:
+            freqs = {doc_id: len(json.loads(p)) for doc_id, p in
+                     db.execute("SELECT doc_id, positions FROM inverted_index WHERE term = ?", (term,))}
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(args):
+    random.seed(args.seed)
+    vocab = [f"term{i}" for i in range(args.vocab)]
+    weights = [1 / (rank + 1) for rank in range(args.vocab)]  # Zipfian
+    docs = [(f"doc{i}", random.choices(vocab, weights, k=args.doc_length)) for i in range(args.docs)]
+    terms = random.choices(vocab[:200], k=args.queries)
+    for fmt in ("json", "binary"):
+        db = sqlite3.connect(":memory:")
+        build_time, size = build(db, fmt, docs)
+        p50, p99 = query(db, fmt, terms)
+        print(f"{fmt:<7} size {size / 1e6:8.2f} MB   insert {build_time:6.2f} s   "
+              f"term query p50 {p50 * 1000:.2f} ms  p99 {p99 * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--doc-length", type=int, default=300)
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+"""Publisher throughput/latency against the in-process stand-in broker.
+
+    python -m benchmarks.bench_publisher --messages 5000
+"""
+import argparse
+import asyncio
+import time
+
+import aio_pika
+
+from app.rabbitmq import Publisher, EXCHANGE_NAME
+from .common import percentile
+from .standin_broker import StandInBroker
+
+
+async def publish_per_connection(broker, messages):
+    # The old publish_to_queue: connect, open channel, declare, publish, close
+    latencies = []
+    for body in messages:
+        start = time.perf_counter()
+        connection = await broker.connect()
+        async with connection:
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT, durable=True)
+            await exchange.publish(aio_pika.Message(body=body.encode()), routing_key="bench")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def publish_pooled(broker, messages, concurrency):
+    publisher = await Publisher(connect=broker.connect).start()
+    latencies = []
+    queue = list(messages)
+
+    async def worker():
+        while queue:
+            body = queue.pop()
+            start = time.perf_counter()
+            await publisher.publish("bench", body)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    await publisher.close()
+    return latencies
+
+
+async def publish_batched(broker, messages, batch_size):
+    publisher = await Publisher(connect=broker.connect).start()
+    latencies = []
+    for i in range(0, len(messages), batch_size):
+        start = time.perf_counter()
+        await publisher.publish_batch("bench", messages[i:i + batch_size])
+        latencies.append(time.perf_counter() - start)
+    await publisher.close()
+    return latencies
+
+
+def report(name, count, elapsed, latencies):
+    print(f"{name:<16} {count / elapsed:>10.0f} msg/s   "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms   p99 {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+async def main(args):
+    messages = [f'{{"id": "doc-{i}"}}' for i in range(args.messages)]
+    naive = messages[:max(1, args.messages // 10)]  # the old path is slow; sample it
+    runs = [
+        ("per-connection", naive, lambda b: publish_per_connection(b, naive)),
+        ("pooled", messages, lambda b: publish_pooled(b, messages, args.concurrency)),
+        ("batched", messages, lambda b: publish_batched(b, messages, args.batch_size)),
+    ]
+    for name, sent, run in runs:
+        broker = StandInBroker()
+        start = time.perf_counter()
+        latencies = await run(broker)
+        report(name, len(sent), time.perf_counter() - start, latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
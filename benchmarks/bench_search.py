@@ -0,0 +1,44 @@
+"""search_documents latency by query kind (see corpus.QUERY_KINDS).
+
+The corpus is loaded with bulk_write, then every query runs once with the
+result cache cleared, so each one goes through the postings. Caches below
+the result cache (term ids, postings) stay warm, as in a running server.
+
+    python -m benchmarks.suite --only search
+"""
+import time
+from collections import defaultdict
+from itertools import islice
+
+from app import cache, database
+from app.bulk import BULK_BATCH_SIZE
+from .common import db_size, fresh_index, summarize
+
+
+def load(corpus):
+    docs = corpus.documents()
+    while True:
+        batch = list(islice(docs, BULK_BATCH_SIZE))
+        if not batch:
+            return
+        database.bulk_write([("index", *doc) for doc in batch])
+
+
+def run(corpus, queries=500, limit=10, shard_count=1):
+    fresh_index("search", shard_count)
+    load(corpus)
+    mix = corpus.queries(queries)
+    database.search_documents(mix[0][1], limit)  # open connections and load the dictionary outside the timing
+    by_kind = defaultdict(list)
+    start = time.perf_counter()
+    for kind, query in mix:
+        cache.results.clear()
+        began = time.perf_counter()
+        database.search_documents(query, limit)
+        by_kind[kind].append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    results = {kind: summarize(latencies, sum(latencies)) for kind, latencies in by_kind.items()}
+    results["all"] = summarize([t for latencies in by_kind.values() for t in latencies], elapsed)
+    database.close_pool()
+    results["db_bytes"] = db_size()
+    return results
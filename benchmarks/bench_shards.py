@@ -0,0 +1,80 @@
+"""Ingest and query throughput by shard count.
+
+Indexes the same Zipfian corpus into 1, 2, 4... shards with bulk_write, then
+runs the query mix from several client threads at once. Shards are written
+in parallel threads and searched in a process pool (SEARCH_PROCESSES), so
+the gain depends on the cores available.
+
+    python -m benchmarks.bench_shards --docs 50000 --shards 1 2 4 --clients 4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import cache, database, shards
+from .common import percentile
+
+
+def timed_search(query):
+    start = time.perf_counter()
+    database.search_documents(query, 10)
+    return time.perf_counter() - start
+
+
+def run(count, docs, queries, batch_size, clients):
+    database.close_pool()
+    database.SHARDS = count
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix=f"bench-shards{count}-"), "bench.db")
+    database.get_pools()
+    start = time.perf_counter()
+    for i in range(0, len(docs), batch_size):
+        database.bulk_write([("index", doc_id, doc_id, text) for doc_id, text in docs[i:i + batch_size]])
+    ingest = len(docs) / (time.perf_counter() - start)
+    database.search_documents(queries[0], 10)  # start the search processes outside the timing
+    cache.results.clear()
+    with ThreadPoolExecutor(clients) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(timed_search, queries))
+        qps = len(queries) / (time.perf_counter() - start)
+    database.close_pool()
+    return ingest, qps, latencies
+
+
+def main(args):
+    random.seed(args.seed)
+    vocab = [f"t{i}" for i in range(args.vocab)]
+    weights = [1 / (rank + 1) for rank in range(args.vocab)]  # Zipfian
+    docs = [(f"doc{i}", " ".join(random.choices(vocab, weights, k=args.doc_length))) for i in range(args.docs)]
+    queries = []
+    for _ in range(args.queries):
+        kind = random.random()
+        if kind < 0.4:
+            queries.append(random.choice(vocab[:50]))  # one common term
+        elif kind < 0.8:
+            queries.append(" ".join(random.sample(vocab[:500], 2)))  # two mid-frequency terms
+        else:
+            queries.append(f'"{random.choice(vocab[:20])} {random.choice(vocab[:20])}"')  # phrase
+    if args.processes is not None:
+        shards.SEARCH_PROCESSES = args.processes
+    print(f"{args.docs} docs, {args.queries} queries from {args.clients} clients, {os.cpu_count()} CPU(s)")
+    for count in args.shards:
+        ingest, qps, latencies = run(count, docs, queries, args.batch_size, args.clients)
+        print(f"{count:>2} shard(s)   ingest {ingest:7.0f} docs/s   search {qps:7.1f} q/s"
+              f"   p50 {percentile(latencies, 50) * 1000:7.2f} ms   p99 {percentile(latencies, 99) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--doc-length", type=int, default=200)
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--processes", type=int, help="SEARCH_PROCESSES (default: one per shard, up to the CPU count)")
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+"""Shared pieces of the benchmark harnesses: a fresh index to run against,
+latency summaries, index size, and comparison with stored baseline results.
+"""
+import contextlib
+import os
+import platform
+import sqlite3
+import tempfile
+
+from app import cache, database
+
+LOWER_IS_BETTER = ("_ms", "_bytes")
+MIN_DELTA_MS = 1.0  # latency changes smaller than this are noise, whatever the ratio
+MIN_TAIL = 10  # samples above a percentile needed to compare it: p99 needs 1000 samples, p95 200
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, elapsed, count=None):
+    """Throughput (`count`, one per latency by default, over `elapsed` seconds)
+    and latency percentiles in milliseconds."""
+    count = len(latencies) if count is None else count
+    return {
+        "count": count,
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def fresh_index(name, shard_count=1):
+    """Point the database module at a new, empty index in a temp directory."""
+    database.close_pool()
+    database.SHARDS = shard_count
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix=f"bench-{name}-"), "bench.db")
+    cache.results.clear()
+    database.get_pools()
+    return os.path.dirname(database.DATABASE_PATH)
+
+
+def db_size():
+    # Bytes on disk of every shard. Measured after close_pool(), which
+    # checkpoints the WAL, so the size is the index's rather than the log's.
+    total = 0
+    for shard in range(database.SHARDS):
+        for suffix in ("", "-wal"):
+            path = database.shard_path(shard) + suffix
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+    return total
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline prints a line per batch; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def machine():
+    return {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(), "platform": platform.platform()}
+
+
+def _metrics(results, prefix=""):
+    # Flatten nested results into ("search.common.p99_ms", value, sample count)
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and key != "count":
+            yield f"{prefix}{key}", value, results.get("count")
+
+
+def _comparable(metric, count):
+    # A percentile is only compared when enough samples lie above it
+    name = metric.rsplit(".", 1)[-1]
+    if not (name.startswith("p") and name.endswith("_ms")):
+        return True
+    return count is not None and count * (100 - int(name[1:-3])) / 100 >= MIN_TAIL
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline` beyond `tolerance` (a ratio):
+    lower throughput, or higher latency and size. Percentiles measured on too
+    few samples to be stable are skipped. Returns (metric, baseline, now) tuples."""
+    before = {metric: value for metric, value, _ in _metrics(baseline)}
+    regressions = []
+    for metric, now, count in _metrics(results):
+        was = before.get(metric)
+        if not was or not _comparable(metric, count):
+            continue
+        if metric.endswith(LOWER_IS_BETTER):
+            worse = now > was * (1 + tolerance) and (not metric.endswith("_ms") or now - was >= MIN_DELTA_MS)
+        else:
+            worse = now < was * (1 - tolerance)
+        if worse:
+            regressions.append((metric, was, now))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    before = {metric: value for metric, value, _ in _metrics(baseline or {})}
+    for metric, now, _ in _metrics(results):
+        was = before.get(metric)
+        change = f"   ({(now - was) / was:+.0%} vs baseline)" if was else ""
+        value = f"{now:,}" if isinstance(now, int) else f"{now:,.3f}"
+        print(f"{metric:<40} {value:>14}{change}")
@@ -0,0 +1,96 @@
+"""Synthetic corpus with a Zipfian term distribution, and a query mix over it.
+
+Words are pronounceable consonant-vowel syllables ending in a vowel, so the
+standard analyzer neither stems nor drops them and every word is its own
+term. The word of rank r is drawn with probability proportional to
+1 / (r + 1) ** exponent. Document lengths are log-normal around
+`doc_length` tokens (`spread` is the sigma; 0 makes every document the same
+length). Every document is generated from its own seed, so a corpus is
+reproducible, can be streamed without holding it in memory, and any document
+can be regenerated on its own.
+"""
+import math
+import random
+from itertools import accumulate
+
+CONSONANTS = "bdfgklmnprtvz"
+VOWELS = "aiou"
+SYLLABLES = [c + v for c in CONSONANTS for v in VOWELS]
+QUERY_KINDS = ("common", "rare", "multi_common", "multi_mixed", "phrase")
+
+
+def word(rank):
+    # Distinct for every rank, at least two syllables
+    syllables = []
+    rank += len(SYLLABLES)
+    while rank:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return "".join(reversed(syllables))
+
+
+class Corpus:
+    def __init__(self, docs=2000, vocab=20000, doc_length=200, spread=0.5, exponent=1.0, seed=42):
+        self.docs = docs
+        self.doc_length = doc_length
+        self.spread = spread
+        self.seed = seed
+        self.words = [word(rank) for rank in range(vocab)]
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(vocab)))
+
+    def config(self):
+        return {"docs": self.docs, "vocab": len(self.words), "doc_length": self.doc_length,
+                "spread": self.spread, "seed": self.seed}
+
+    def _length(self, rng):
+        if not self.spread:
+            return self.doc_length
+        # Log-normal with mean doc_length
+        mu = math.log(self.doc_length) - self.spread ** 2 / 2
+        return max(1, round(rng.lognormvariate(mu, self.spread)))
+
+    def tokens(self, i):
+        rng = random.Random(f"{self.seed}:{i}")
+        return rng.choices(self.words, cum_weights=self.cum_weights, k=self._length(rng))
+
+    def document(self, i):
+        tokens = self.tokens(i)
+        return f"doc{i}", " ".join(tokens[:4]), " ".join(tokens)
+
+    def documents(self):
+        """(doc_id, title, content) for every document, generated as they are read."""
+        for i in range(self.docs):
+            yield self.document(i)
+
+    def _band(self, low, high):
+        # Ranks whose expected number of occurrences in the corpus is in [low, high]
+        scale = self.docs * self.doc_length / self.cum_weights[-1]
+        previous = [0.0] + self.cum_weights[:-1]
+        ranks = [rank for rank, (below, upto) in enumerate(zip(previous, self.cum_weights))
+                 if low <= (upto - below) * scale <= high]
+        return ranks or list(range(len(self.words) // 2, len(self.words)))
+
+    def queries(self, count, seed=None):
+        """`count` (kind, query) pairs, cycling through QUERY_KINDS:
+        one common term, one rare term, two or three common terms,
+        a common term with a rare one, and a phrase taken from a document."""
+        rng = random.Random(self.seed if seed is None else seed)
+        common = self.words[:50]
+        rare = [self.words[rank] for rank in self._band(2, 20)]
+        queries = []
+        for n in range(count):
+            kind = QUERY_KINDS[n % len(QUERY_KINDS)]
+            if kind == "common":
+                query = rng.choice(common)
+            elif kind == "rare":
+                query = rng.choice(rare)
+            elif kind == "multi_common":
+                query = " ".join(rng.sample(common, rng.choice((2, 3))))
+            elif kind == "multi_mixed":
+                query = f"{rng.choice(common)} {rng.choice(rare)}"
+            else:
+                tokens = self.tokens(rng.randrange(self.docs))
+                start = rng.randrange(max(1, len(tokens) - 1))
+                query = '"' + " ".join(tokens[start:start + 2]) + '"'
+            queries.append((kind, query))
+        return queries
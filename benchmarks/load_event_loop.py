@@ -0,0 +1,115 @@
+"""Latency of a cheap endpoint (/health) while heavy searches run.
+
+Compares the routes as shipped (database calls on the query thread pool)
+against the old behaviour of calling database.search_documents inline on the
+event loop. Run from the repo root:
+
+    python -m benchmarks.load_event_loop --docs 20000 --heavy 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app import cache, database, routes
+from .common import percentile
+
+WORDS = [f"w{i}" for i in range(2000)]
+
+
+def build_corpus(docs):
+    rng = random.Random(7)
+    batch = []
+    for i in range(docs):
+        content = " ".join(rng.choice(WORDS[:50] if rng.random() < 0.5 else WORDS) for _ in range(200))
+        batch.append((f"d{i}", f"doc {i}", content))
+        if len(batch) == 1000:
+            database.add_documents(batch)
+            batch = []
+    if batch:
+        database.add_documents(batch)
+
+
+def blocking_app():
+    app = FastAPI()
+
+    @app.get("/search")
+    async def search(q: str, limit: int = 10):
+        return {"results": database.search_documents(q, limit)}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def pooled_app():
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+async def measure(app, heavy, duration):
+    stop = time.perf_counter() + duration
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def searcher(n):
+            rng = random.Random(n)
+            while time.perf_counter() < stop:
+                # Distinct common-term queries so the result cache can't help
+                terms = " ".join(rng.sample(WORDS[:50], 2))
+                cache.results.clear()
+                await client.get("/search", params={"q": terms, "limit": 10})
+
+        async def prober():
+            # Timed from when the probe was due, so a stalled event loop
+            # shows up as latency rather than as missing samples
+            latencies = []
+            due = time.perf_counter()
+            while due < stop:
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/health")
+                latencies.append((time.perf_counter() - due) * 1000)
+                due = max(due + 0.005, time.perf_counter())
+            return latencies
+
+        results = await asyncio.gather(prober(), *(searcher(n) for n in range(heavy)))
+    return results[0]
+
+
+def report(name, latencies):
+    print(f"{name:10s} n={len(latencies):5d}  p50={statistics.median(latencies):7.2f}ms  "
+          f"p99={percentile(latencies, 99):8.2f}ms  max={max(latencies):8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--heavy", type=int, default=8, help="concurrent search clients")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database.DATABASE_PATH = os.path.join(workdir, "bench.db")
+    build_corpus(args.docs)
+
+    report("idle", asyncio.run(measure(pooled_app(), 0, 2.0)))
+    report("blocking", asyncio.run(measure(blocking_app(), args.heavy, args.duration)))
+    report("pooled", asyncio.run(measure(pooled_app(), args.heavy, args.duration)))
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import asyncio
+from collections import defaultdict
+
+# In-process stand-in for RabbitMQ, shaped like the slice of the aio-pika API
+# the publisher uses. Latencies model a broker on localhost.
+CONNECT_LATENCY = 0.005  # AMQP handshake (TCP + connection.open)
+CHANNEL_LATENCY = 0.0005  # channel.open / exchange.declare round trip
+CONFIRM_LATENCY = 0.0005  # publisher confirm round trip
+
+
+class StandInBroker:
+    def __init__(self, connect_latency=CONNECT_LATENCY, channel_latency=CHANNEL_LATENCY,
+                 confirm_latency=CONFIRM_LATENCY):
+        self.connect_latency = connect_latency
+        self.channel_latency = channel_latency
+        self.confirm_latency = confirm_latency
+        self.queues = defaultdict(list)
+        self.connections = 0
+        self.channels = 0
+        self.exchange_declares = 0
+
+    async def connect(self, url=None):
+        await asyncio.sleep(self.connect_latency)
+        self.connections += 1
+        return StandInConnection(self)
+
+
+class StandInConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+
+    async def channel(self, publisher_confirms=True):
+        await asyncio.sleep(self.broker.channel_latency)
+        self.broker.channels += 1
+        return StandInChannel(self.broker)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class StandInChannel:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+
+    async def declare_exchange(self, name, type=None, durable=False):
+        await asyncio.sleep(self.broker.channel_latency)
+        self.broker.exchange_declares += 1
+        return StandInExchange(self, name)
+
+
+class StandInExchange:
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+
+    async def publish(self, message, routing_key):
+        # Confirms are pipelined: concurrent publishes overlap their round trips
+        await asyncio.sleep(self.channel.broker.confirm_latency)
+        self.channel.broker.queues[routing_key].append(message.body)
@@ -0,0 +1,106 @@
+"""Benchmark suite: ingest, search and HTTP harnesses over one synthetic corpus.
+
+Prints throughput, p50/p95/p99 latency and index size for every harness,
+and compares them with the stored baseline for the profile
+(benchmarks/baselines/<profile>.json). It exits with status 1 when a
+metric regressed by more than --tolerance. Baselines are only comparable
+on the same machine and with the same corpus; --save records a new one.
+
+    python -m benchmarks.suite                       # small profile, compare
+    python -m benchmarks.suite --profile medium --only search
+    python -m benchmarks.suite --save                # record the baseline
+"""
+import argparse
+import json
+import os
+import sys
+
+from app import database
+from . import bench_http, bench_ingest, bench_search
+from .common import compare, machine, print_results
+from .corpus import Corpus
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+HARNESSES = ("ingest", "search", "http")
+
+# Corpus and load sizes; the small profile runs in about a minute
+PROFILES = {
+    "small": {"docs": 2000, "vocab": 20000, "doc_length": 200, "queries": 500, "http_docs": 1000, "clients": 4},
+    "medium": {"docs": 20000, "vocab": 50000, "doc_length": 200, "queries": 1000, "http_docs": 5000, "clients": 8},
+    "large": {"docs": 100000, "vocab": 100000, "doc_length": 300, "queries": 2000, "http_docs": 20000, "clients": 16},
+}
+
+
+def run(config, only=HARNESSES):
+    corpus = Corpus(config["docs"], config["vocab"], config["doc_length"], config["spread"], config["exponent"],
+                    config["seed"])
+    results = {}
+    if "ingest" in only:
+        results["ingest"] = bench_ingest.run(corpus, config["shards"])
+    if "search" in only:
+        results["search"] = bench_search.run(corpus, config["queries"], shard_count=config["shards"])
+    if "http" in only:
+        http_corpus = Corpus(config["http_docs"], config["vocab"], config["doc_length"], config["spread"],
+                             config["exponent"], config["seed"])
+        results["http"] = bench_http.run(http_corpus, config["queries"], config["clients"],
+                                         shard_count=config["shards"])
+    database.close_pool()
+    return results
+
+
+def main(args):
+    config = {**PROFILES[args.profile], "spread": args.spread, "exponent": args.exponent, "seed": args.seed,
+              "shards": args.shards}
+    for key in ("docs", "queries", "clients"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{args.profile}.json")
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"Baseline {baseline_path} was recorded with another corpus; not comparing")
+            baseline = None
+    print(f"{args.profile} profile: {json.dumps(config)}\n{json.dumps(machine())}")
+    results = run(config, args.only)
+    print_results(results, baseline and baseline["results"])
+    report = {"machine": machine(), "config": config, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        if baseline and set(args.only) != set(HARNESSES):
+            report["results"] = {**baseline["results"], **results}  # keep the harnesses not rerun
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {baseline_path}")
+        return 0
+    if baseline is None:
+        return 0
+    if baseline["machine"] != report["machine"]:
+        print("Baseline was recorded on another machine; differences may not be regressions")
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for metric, was, now in regressions:
+        print(f"REGRESSION {metric}: {was:,.3f} -> {now:,.3f}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=PROFILES, default="small")
+    parser.add_argument("--only", nargs="+", choices=HARNESSES, default=list(HARNESSES))
+    parser.add_argument("--docs", type=int, help="override the profile's corpus size")
+    parser.add_argument("--queries", type=int)
+    parser.add_argument("--clients", type=int, help="concurrent HTTP clients")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--spread", type=float, default=0.5, help="sigma of the log-normal document length")
+    parser.add_argument("--exponent", type=float, default=1.0, help="Zipf exponent of the term distribution")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a regression, as a ratio")
+    parser.add_argument("--baseline", help="baseline file (default: benchmarks/baselines/<profile>.json)")
+    parser.add_argument("--save", action="store_true", help="record the results as the baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    sys.exit(main(parser.parse_args()))
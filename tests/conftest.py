@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Keep the test run away from the checked-in elasticsearch.db
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
+# Run the pipeline on the embedded queue so no RabbitMQ broker is needed
+os.environ.setdefault("QUEUE_BACKEND", "embedded")
+os.environ.setdefault("QUEUE_PATH", os.path.join(tempfile.mkdtemp(), "queue.db"))
@@ -0,0 +1,35 @@
+from app import database, postings
+from app.analysis import Analyzer, light_stem, get_analyzer
+
+
+def test_standard_analyzer():
+    analyzer = get_analyzer("standard")
+    assert analyzer.terms("The Quick, brown FOXES; it's running!") == ["quick", "brown", "fox", "it's", "run"]
+    # Stopwords keep their position so phrase offsets line up
+    assert list(analyzer.iter_terms(["state of the art"])) == [(0, "state"), (3, "art")]
+    assert [light_stem(w) for w in ("indexes", "queries", "classes", "status", "stemmed", "bus")] == \
+        ["index", "query", "class", "status", "stem", "bus"]
+
+
+def test_tokens_across_chunks(tmp_path):
+    analyzer = Analyzer()
+    text = "Alpha beta,  gamma\nalpha don't DELTA beta. " * 50 + "tail"
+    expected = analyzer.analyze([text])
+    for size in (1, 3, 7, 64):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        streamed = analyzer.analyze(chunks)
+        assert {t: list(p) for t, p in streamed.items()} == {t: list(p) for t, p in expected.items()}
+    assert "don't" in expected
+    path = tmp_path / "big.txt"
+    path.write_text(text, encoding="utf-8")
+    streamed = analyzer.analyze(database.read_chunks(str(path), size=5))
+    assert postings.encode_positions(streamed["beta"]) == postings.encode_positions(expected["beta"])
+
+
+def test_terms_keyed_by_id():
+    database.add_document("an1", "t", "Indexing documents, indexed quickly.")
+    assert [r["id"] for r in database.search_documents("index document")] == ["an1"]
+    with database.read_connection() as db:
+        ids = database.term_ids(db, ["index", "document"])
+        rows = db.execute("SELECT term_id, tf FROM inverted_index WHERE doc_id = 'an1'").fetchall()
+    assert {row["term_id"]: row["tf"] for row in rows}[ids["index"]] == 2
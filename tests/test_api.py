@@ -1,5 +1,7 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
+from app import database
 from app.main import app
 
 client = TestClient(app)
@@ -25,6 +27,13 @@ def test_search_documents():
     assert response.status_code == 200
     assert "results" in response.json()
 
+def test_search_non_positive_limit():
+    database.add_document("limit1", "t", "limitless words")
+    for limit in (0, -1):
+        response = client.get(f"/search?q=limitless&limit={limit}")
+        assert response.status_code == 200
+        assert response.json()["results"] == []
+
 def test_search_empty_query():
     response = client.get("/search?q=")
     assert response.status_code == 400
@@ -68,4 +77,52 @@ def test_queue_stats():
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
-    assert "text/html" in response.headers["content-type"]
\ No newline at end of file
+    assert "text/html" in response.headers["content-type"]
+
+
+def test_bulk():
+    body = "\n".join([
+        '{"index": {"_id": "bulk1"}}',
+        '{"title": "Bulk One", "content": "bulk loaded text"}',
+        '{"id": "bulk2", "title": "Bulk Two", "content": "more bulk text"}',
+        '{"delete": {"_id": "missing"}}',
+        '{"index": {}}',
+        '{"content": "no id"}',
+    ]) + "\n"
+    response = client.post("/_bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["errors"] is True
+    assert [list(item.values())[0]["status"] for item in data["items"]] == [201, 201, 404, 400]
+    results = client.get("/search?q=bulk text").json()["results"]
+    assert {r["id"] for r in results} == {"bulk1", "bulk2"}
+
+def test_pagination_and_export():
+    client.post("/_bulk", content="".join(f'{{"id": "exp{i}", "content": "exported row {i}"}}\n' for i in range(7)),
+                headers={"Content-Type": "application/x-ndjson"})
+    seen = []
+    after = None
+    while True:
+        params = {"q": "exported", "limit": 3}
+        if after:
+            params["search_after"] = json.dumps(after)
+        data = client.get("/search", params=params).json()
+        seen.extend(r["id"] for r in data["results"])
+        after = data["search_after"]
+        if after is None:
+            break
+    assert sorted(seen) == [f"exp{i}" for i in range(7)]
+    assert client.get("/documents", params={"search_after": "not json"}).status_code == 400
+    # Cursors of the wrong shape are rejected, not passed on to the search
+    for bad in (["x", "y"], [None, 1], [1.5, 2], [True, "exp1"]):
+        assert client.get("/search", params={"q": "exported", "search_after": json.dumps(bad)}).status_code == 400
+        assert client.post("/_search", json={"query": "exported", "search_after": bad}).status_code == 400
+    assert client.get("/documents", params={"search_after": "[1]"}).status_code == 400
+    everything = client.get("/documents", params={"limit": -1}).json()
+    assert len(everything["results"]) >= 7 and everything["search_after"] is None
+    assert client.get("/raw/inverted_index", params={"search_after": '[1, 2, 3]'}).status_code == 400
+    lines = client.get("/_export", params={"q": "exported"}).text.splitlines()
+    assert sorted(json.loads(line)["id"] for line in lines) == sorted(seen)
+    exported = [json.loads(line) for line in client.get("/_export").text.splitlines()]
+    assert {f"exp{i}" for i in range(7)} <= {row["id"] for row in exported}
+    assert [row["id"] for row in exported] == sorted(row["id"] for row in exported)
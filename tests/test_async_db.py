@@ -0,0 +1,35 @@
+import asyncio
+import pytest
+from app import async_db, database
+
+SLOW_QUERY = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+
+
+def _slow():
+    with database.read_connection() as db:
+        return db.execute(SLOW_QUERY).fetchone()
+
+
+def test_timeout_interrupts_query():
+    async def scenario():
+        with pytest.raises(async_db.QueryTimeout):
+            await async_db.run(_slow, timeout=0.2)
+        # The interrupted reader went back to the pool and still works
+        database.add_document("async1", "t", "still serving")
+        return await async_db.search_documents("serving")
+
+    results = asyncio.run(scenario())
+    assert [r["id"] for r in results] == ["async1"]
+
+
+def test_event_loop_not_blocked_by_query():
+    async def scenario():
+        slow = asyncio.create_task(async_db.run(_slow, timeout=0.5))
+        started = asyncio.get_running_loop().time()
+        await asyncio.sleep(0.01)
+        elapsed = asyncio.get_running_loop().time() - started
+        with pytest.raises(async_db.QueryTimeout):
+            await slow
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.2
@@ -0,0 +1,44 @@
+from collections import Counter
+from app import database
+from benchmarks import suite
+from benchmarks.common import compare
+from benchmarks.corpus import Corpus, QUERY_KINDS
+
+
+def test_corpus_is_zipfian_and_reproducible():
+    corpus = Corpus(docs=200, vocab=500, doc_length=50, seed=3)
+    assert list(corpus.documents()) == list(Corpus(docs=200, vocab=500, doc_length=50, seed=3).documents())
+    assert corpus.document(7) == list(corpus.documents())[7]
+    counts = Counter(token for i in range(corpus.docs) for token in corpus.tokens(i))
+    assert counts[corpus.words[0]] > 1.5 * counts[corpus.words[1]] > 0  # ~2x for exponent 1
+    assert len({len(corpus.tokens(i)) for i in range(20)}) > 1
+    assert len(Corpus(docs=20, doc_length=30, spread=0).tokens(5)) == 30
+    kinds = Counter(kind for kind, _ in corpus.queries(50))
+    assert set(kinds) == set(QUERY_KINDS) and corpus.queries(50) == corpus.queries(50)
+
+
+def test_compare_flags_regressions():
+    baseline = {"search": {"all": {"count": 2000, "throughput": 100.0, "p99_ms": 10.0}, "db_bytes": 1000}}
+    same = {"search": {"all": {"count": 2000, "throughput": 90.0, "p99_ms": 10.5}, "db_bytes": 1100}}
+    assert compare(same, baseline, 0.25) == []
+    worse = {"search": {"all": {"count": 2000, "throughput": 50.0, "p99_ms": 20.0}, "db_bytes": 2000}}
+    assert {metric for metric, _, _ in compare(worse, baseline, 0.25)} == {
+        "search.all.throughput", "search.all.p99_ms", "search.db_bytes"}
+    worse["search"]["all"]["count"] = 100  # a p99 of 100 samples is a single sample
+    assert "search.all.p99_ms" not in {metric for metric, _, _ in compare(worse, baseline, 0.25)}
+
+
+def test_suite_runs(monkeypatch):
+    # A tiny run of every harness; the database module is pointed back at the test index afterwards
+    monkeypatch.setattr(database, "DATABASE_PATH", database.DATABASE_PATH)
+    monkeypatch.setattr(database, "SHARDS", database.SHARDS)
+    config = {**suite.PROFILES["small"], "docs": 30, "http_docs": 10, "queries": 10, "clients": 2,
+              "spread": 0.5, "exponent": 1.0, "seed": 1, "shards": 1}
+    try:
+        results = suite.run(config)
+    finally:
+        database.close_pool()
+    assert set(results["ingest"]) == {"add_document", "pipeline", "bulk_write"}
+    assert all(path["count"] == 30 and path["db_bytes"] > 0 for path in results["ingest"].values())
+    assert results["search"]["all"]["count"] == 10 and results["search"]["all"]["p99_ms"] > 0
+    assert results["http"]["ingest"]["count"] == 10 and results["http"]["search"]["count"] == 10
@@ -0,0 +1,38 @@
+from app import cache, database
+
+
+def test_lru_evicts_by_bytes():
+    lru = cache.LRUCache(max_bytes=100)
+    lru.put("a", 1, 60)
+    lru.put("b", 2, 30)
+    assert lru.get("a") == 1  # "b" is now least recently used
+    lru.put("c", 3, 30)
+    assert lru.get("b") is None
+    assert lru.get("c") == 3
+    stats = lru.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 1)
+
+
+def test_lru_ttl():
+    lru = cache.LRUCache(max_bytes=100, ttl=-1)
+    lru.put("a", 1, 10)
+    assert lru.get("a") is None
+
+
+def test_search_results_cached_until_reindex():
+    database.add_document("cache1", "t", "cached zebra")
+    first = database.search_documents("zebra")
+    hits = cache.results.hits
+    assert database.search_documents("zebra") is first
+    assert cache.results.hits == hits + 1
+    database.add_document("cache1", "t", "no longer here")
+    assert database.search_documents("zebra") == []
+
+
+def test_postings_read_before_a_commit_are_not_cached():
+    read_at = cache.generation()
+    cache.invalidate_terms(["stalepost"], shard=0)
+    cache.put_postings((0, "stalepost"), [("old", 1, 1)], read_at)
+    assert cache.postings.get((0, "stalepost")) is None
+    cache.put_postings((0, "stalepost"), [("new", 1, 1)], cache.generation())
+    assert cache.postings.get((0, "stalepost")) == [("new", 1, 1)]
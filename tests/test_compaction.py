@@ -0,0 +1,26 @@
+from app import compaction, database
+
+
+def test_compaction_purges_superseded_versions():
+    for content in ("old words here", "newer words", "final words"):
+        database.add_documents([("cmp1", "t", content), ("cmp2", "t", content + " two")])
+    with database.read_connection() as db:
+        stale = db.execute("SELECT COUNT(*) FROM inverted_index WHERE doc_id = 'cmp1' AND version < 3").fetchone()[0]
+        # An orphan above the live version (left by an older version reset) is stale too
+        orphan = db.execute("SELECT term_id, tf, positions FROM inverted_index WHERE doc_id = 'cmp1' LIMIT 1").fetchone()
+    with database.transaction() as db:
+        db.execute("INSERT INTO inverted_index (term_id, doc_id, version, tf, positions) VALUES (?, 'cmp1', 9, ?, ?)",
+                   tuple(orphan))
+    assert stale > 0
+    report = compaction.compact(batch_size=1)
+    assert report["postings_deleted"] >= stale + 1
+    assert report["extracted_text_deleted"] >= 4
+    assert report["bytes_reclaimed"] >= 0 and report["seconds"] >= 0
+    with database.read_connection() as db:
+        versions = {row[0] for row in db.execute("SELECT version FROM inverted_index WHERE doc_id = 'cmp1'")}
+        texts = db.execute("SELECT text FROM extracted_text WHERE doc_id = 'cmp1'").fetchall()
+    assert versions == {3}
+    assert [row[0] for row in texts] == ["final words"]
+    assert {r["id"] for r in database.search_documents("final words")} == {"cmp1", "cmp2"}
+    assert database.search_documents("old") == []
+    assert compaction.compact()["postings_deleted"] == 0
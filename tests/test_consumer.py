@@ -0,0 +1,67 @@
+import asyncio
+import json
+from app import consumer, database
+
+
+class FakeMessage:
+    def __init__(self, payload):
+        self.body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.state = None
+
+    async def ack(self):
+        self.state = "ack"
+
+    async def nack(self, requeue=True):
+        self.state = "nack"
+
+
+def test_extract_and_index_batch(tmp_path):
+    path = tmp_path / "batch.txt"
+    path.write_text("Batched Consumer Text")
+    database.insert_document("batch-file", "batch.txt", "Batched Consumer Text", str(path))
+    database.insert_document("batch-missing", "gone.txt", "", str(tmp_path / "gone.txt"))
+    messages = consumer.process_text_extract([
+        {"id": "batch-file"},
+        {"id": "batch-missing"},
+        {"id": "batch-inline", "title": "Inline", "content": "inline consumer text"},
+    ])
+    assert len(messages) == 2
+    consumer.process_index([json.loads(m) for m in messages])
+    assert database.get_document_status("batch-file")["status"] == "indexed"
+    assert database.get_document_status("batch-inline")["status"] == "indexed"
+    assert database.get_document_status("batch-missing")["status"] == "failed"
+    assert {r["id"] for r in database.search_documents("consumer text")} == {"batch-file", "batch-inline"}
+
+
+def test_inline_message_replaces_stored_document():
+    database.bulk_write([("index", "inline-x", "t", "bristle two")])
+    messages = consumer.process_text_extract([{"id": "inline-x", "title": "t", "content": "gossamer three"}])
+    consumer.process_index([json.loads(m) for m in messages])
+    assert database.get_document_status("inline-x")["version"] == 2
+    assert [r["id"] for r in database.search_documents("gossamer")] == ["inline-x"]
+    assert database.search_documents("bristle") == []
+
+
+def test_batch_consumer_acks_and_nacks_as_group():
+    batches = []
+
+    def handler(payloads):
+        batches.append(payloads)
+        if any(p.get("fail") for p in payloads):
+            raise RuntimeError("boom")
+        return []
+
+    async def run():
+        batcher = consumer.BatchConsumer(handler, batch_size=3, batch_timeout=0.01, workers=1)
+        good = [FakeMessage({"n": i}) for i in range(3)]
+        bad = [FakeMessage({"fail": True}), FakeMessage("not json")]
+        for message in good + bad:
+            await batcher.on_message(message)
+        await batcher.process(await batcher.next_batch())
+        await batcher.process(await batcher.next_batch())
+        return good, bad
+
+    good, bad = asyncio.run(run())
+    assert [len(b) for b in batches] == [3, 1]
+    assert [m.state for m in good] == ["ack"] * 3
+    assert [m.state for m in bad] == ["nack", "nack"]
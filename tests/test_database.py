@@ -0,0 +1,121 @@
+import sqlite3
+import pytest
+from app import database, postings
+
+
+def test_pool_uses_wal():
+    with database.read_connection() as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_transaction_rolls_back_on_error():
+    with pytest.raises(RuntimeError):
+        with database.transaction() as db:
+            db.execute("INSERT INTO documents (id, title, content) VALUES ('rollback', 't', 'c')")
+            raise RuntimeError("boom")
+    assert database.get_document("rollback") is None
+
+
+def test_add_document_indexes_terms():
+    database.insert_document("db1", "Title", "placeholder")
+    database.add_document("db1", "Title", "alpha beta alpha")
+    status = database.get_document_status("db1")
+    assert status["version"] == 2
+    assert status["terms_count"] == 2
+    results = database.search_documents("alpha beta")
+    assert results[0]["id"] == "db1"
+    assert results[0]["score"] > 0
+
+
+def test_bm25_ranking_and_stats():
+    database.add_documents([
+        ("bm1", "t", "rare common common"),
+        ("bm2", "t", "common filler filler filler filler filler"),
+        ("bm3", "t", "rare rare common"),
+    ])
+    results = database.search_documents("rare common")
+    assert [r["id"] for r in results] == ["bm3", "bm1"]
+    # Re-indexing replaces the live postings and keeps df consistent
+    database.add_document("bm3", "t", "common only")
+    assert [r["id"] for r in database.search_documents("rare")] == ["bm1"]
+    with database.read_connection() as db:
+        _, _, dfs = database.collect_stats(db, ["rare", "only"])
+    assert dfs == {"rare": 1, "only": 1}
+
+
+def test_reupload_after_bulk_keeps_versions_monotonic(tmp_path):
+    # upload -> bulk index -> re-upload must not bring back the first upload's postings
+    from app import consumer
+    path = tmp_path / "vx.txt"
+
+    def upload(text):
+        path.write_text(text, encoding="utf-8")
+        database.insert_document("vx", "vx", text, str(path))
+        consumer.process_index([{"id": "vx"}])
+
+    upload("ochre uno")
+    database.bulk_write([("index", "vx", "vx", "brisk dos")])
+    upload("gorse trio")
+    database.add_document("vy", "vy", "ochre zinnia")
+    assert database.get_document_status("vx")["version"] == 3
+    assert [r["id"] for r in database.search_documents("ochre")] == ["vy"]
+    assert [r["id"] for r in database.search_documents("gorse")] == ["vx"]
+    with database.read_connection() as db:
+        _, _, dfs = database.collect_stats(db, ["ochre", "uno", "brisk", "gorse"])
+    assert dfs == {"ochre": 1, "uno": 0, "brisk": 0, "gorse": 1}
+
+
+def test_search_top_k_matches_exhaustive():
+    docs = [(f"topk{i}", "t", " ".join(["needle"] * (i % 7 + 1) + ["hay"] * (i % 5 + 1) + ["pad"] * i))
+            for i in range(40)]
+    database.add_documents(docs)
+    with database.read_connection() as db:
+        full = database.search_index(db, ["needle", "hay"], 1000)
+        top = database.search_index(db, ["needle", "hay"], 5)
+    assert top == full[:5]
+
+
+def test_positions_roundtrip():
+    positions = [0, 1, 5, 127, 128, 300, 100000]
+    blob = postings.encode_positions(positions)
+    assert isinstance(blob, bytes)
+    assert postings.decode_positions(blob) == positions
+
+
+def test_migrates_json_postings(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE inverted_index (term TEXT, doc_id TEXT, positions TEXT, version INTEGER, "
+                   "PRIMARY KEY (term, doc_id, version))")
+    legacy.execute("CREATE TABLE documents (id TEXT PRIMARY KEY, title TEXT, content TEXT, version INTEGER DEFAULT 1)")
+    legacy.execute("INSERT INTO documents (id, title, content) VALUES ('d1', 't', 'c')")
+    legacy.execute("INSERT INTO inverted_index VALUES ('hello', 'd1', '[3, 9]', 1)")
+    legacy.commit()
+    legacy.close()
+    pool = database.ConnectionPool(path, readers=1)
+    database.init_db(pool)
+    with pool.reader() as db:
+        row = db.execute("SELECT tf, positions FROM inverted_index i JOIN terms t ON t.id = i.term_id "
+                         "WHERE t.term = 'hello'").fetchone()
+        analyzer = db.execute("SELECT value FROM settings WHERE key = 'analyzer'").fetchone()[0]
+    pool.close()
+    assert analyzer == "whitespace"  # legacy postings keep the tokenizer they were built with
+    assert row["tf"] == 2
+    assert postings.decode_positions(row["positions"]) == [3, 9]
+
+
+
+def test_search_after_pages_match_full_ranking():
+    database.add_documents([(f"page{i}", "t", " ".join(["pager"] * (i % 4 + 1) + ["x"] * (i % 3))) for i in range(23)])
+    full = database.search_documents("pager", 100)
+    pages = []
+    after = None
+    while True:
+        page = database.search_documents("pager", 5, after)
+        pages.extend(page)
+        if len(page) < 5:
+            break
+        after = page[-1]["sort"]
+    assert [r["id"] for r in pages] == [r["id"] for r in full]
+    listed = database.get_all_documents(3, ["page1"])
+    assert [r["id"] for r in listed] == ["page10", "page11", "page12"]
@@ -0,0 +1,77 @@
+import random
+from app import database, dictionary
+from app.dictionary import TermDictionary
+from app.query import parse_query
+from app.segments import SegmentIndex
+from tests.test_segments import _doc
+
+
+def osa_distance(a, b):
+    # Reference edit distance with adjacent transpositions
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+def loaded(dfs):
+    terms = TermDictionary()
+    terms.terms, terms.dfs = sorted(dfs), dict(dfs)
+    return terms
+
+
+def test_fuzzy_matches_brute_force():
+    rng = random.Random(7)
+    vocab = {"".join(rng.choice("abcde") for _ in range(rng.randint(1, 7))): rng.randint(1, 50) for _ in range(3000)}
+    terms = loaded(vocab)
+    for word in ("abc", "edcba", "aaaa", "b", "deadbe"):
+        for edits in (0, 1, 2):
+            expected = {term for term in vocab if osa_distance(word, term) <= edits}
+            assert set(terms.fuzzy(word, edits, limit=len(vocab))) == expected
+
+
+def test_prefix_and_expansion_cap():
+    terms = loaded({"help": 5, "hello": 9, "helmet": 1, "hex": 3, "world": 2})
+    assert terms.prefix("hel") == ["hello", "help", "helmet"]
+    assert terms.prefix("hel", limit=2) == ["hello", "help"]  # most frequent first
+    assert terms.fuzzy("helo", 1, limit=2) == ["hello", "help"]  # closest, then most frequent
+    terms.update({"helium": 2, "helmet": -1})
+    assert terms.prefix("hel") == ["hello", "help", "helium"]
+    terms.update({"helmet": 4})
+    assert terms.prefix("hel", limit=1) == ["hello"] and "helmet" in terms.prefix("hel")
+
+
+def test_parse_prefix_and_fuzzy_terms():
+    terms, _ = parse_query("Hel* wrold~1 docs~")
+    assert terms == ["hel*", "wrold~1", "docs~1"]  # lowercased, not stemmed; AUTO edits by length
+
+
+def test_search_expands_terms():
+    database.add_documents([
+        ("fz1", "t", "helicopter landing"),
+        ("fz2", "t", "hello landing hello"),
+        ("fz3", "t", "jello landing"),
+    ])
+    dictionary.get().load()
+    ids = lambda query: [r["id"] for r in database.search_documents(query)]
+    assert ids("heli*") == ["fz1"]
+    assert set(ids("hel* landing")) == {"fz1", "fz2"}
+    assert ids("hello~1 landing")[0] == "fz2"  # tf is summed over the expansions
+    assert set(ids("hello~1")) == {"fz2", "fz3"}
+    assert ids("zzz*") == []
+    # The loaded dictionary follows commits
+    database.add_document("fz4", "t", "helium")
+    assert ids("heliu*") == ["fz4"]
+    database.bulk_write([("delete", "fz4")])
+    assert ids("heliu*") == []
+
+
+def test_segment_engine_expands_terms(tmp_path):
+    index = SegmentIndex(str(tmp_path), flush_docs=2, background=False)
+    index.add_many([_doc("a", "red fox"), _doc("b", "reed fox fox"), _doc("c", "blue fox")])
+    expansions = {"red~1": ["red", "reed"]}
+    assert {doc_id for _, doc_id in index.search(["red~1", "fox"], 10, expansions=expansions)} == {"a", "b"}
+    index.close()
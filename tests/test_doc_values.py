@@ -0,0 +1,100 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import database, doc_values, projection, shards
+from app.main import app
+
+client = TestClient(app)
+
+DOCS = [
+    ("p1", "t", "red shoe", {"brand": "acme", "price": 10, "sold": "2024-01-15T10:00:00Z"}),
+    ("p2", "t", "red shirt", {"brand": "acme", "price": 25.5, "sold": "2024-01-20"}),
+    ("p3", "t", "blue shoe", {"brand": "zeta", "price": 40, "sold": "2024-02-03"}),
+    ("p4", "t", "red hat", {"brand": "zeta", "price": "cheap", "sold": "2024-03-01"}),
+    ("p5", "t", "green shoe", {}),
+]
+
+
+@pytest.fixture(params=[1, 3])
+def catalog(request, tmp_path, monkeypatch):
+    # A fresh index holding DOCS, single and sharded
+    database.close_pool()
+    monkeypatch.setattr(database, "SHARDS", request.param)
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 0)
+    database.bulk_write([("index", *doc) for doc in DOCS])
+    yield
+    database.close_pool()
+    monkeypatch.undo()
+
+
+def ids(response):
+    return sorted(hit["id"] for hit in response["results"])
+
+
+def test_filters(catalog):
+    assert doc_values.mapping() == {"brand": "keyword", "price": "number", "sold": "date"}
+    assert ids(database.filtered_search("red", filters=[{"term": {"brand": "acme"}}])) == ["p1", "p2"]
+    assert ids(database.filtered_search(filters=[{"range": {"price": {"gte": 20, "lt": 40}}}])) == ["p2"]
+    assert ids(database.filtered_search(filters=[{"range": {"sold": {"lt": "2024-02-01"}}}])) == ["p1", "p2"]
+    assert ids(database.filtered_search("shoe", filters=[{"exists": {"field": "price"}}])) == ["p1", "p3"]
+    response = database.filtered_search(filters=[{"terms": {"brand": ["zeta", "nope"]}}], limit=1)
+    assert response["total"] == 2 and len(response["results"]) == 1
+    assert database.filtered_search(filters=[{"term": {"missing": "x"}}])["total"] == 0
+
+
+def test_aggregations(catalog):
+    aggs = {
+        "brands": {"terms": {"field": "brand"}},
+        "prices": {"range": {"field": "price", "ranges": [{"to": 20}, {"from": 20}]}},
+        "monthly": {"date_histogram": {"field": "sold", "calendar_interval": "month"}},
+    }
+    result = database.filtered_search(aggs=aggs)["aggregations"]
+    assert result["brands"]["buckets"] == [{"key": "acme", "doc_count": 2}, {"key": "zeta", "doc_count": 2}]
+    assert [b["doc_count"] for b in result["prices"]["buckets"]] == [1, 2]
+    assert result["prices"]["buckets"][0]["key"] == "*-20"
+    assert [(b["key_as_string"][:10], b["doc_count"]) for b in result["monthly"]["buckets"]] == [
+        ("2024-01-01", 2), ("2024-02-01", 1), ("2024-03-01", 1)]
+    # Aggregations cover the filtered matches, not only the returned hits
+    result = database.filtered_search("shoe", limit=0, aggs=aggs)
+    assert result["total"] == 3 and result["results"] == []
+    assert result["aggregations"]["brands"]["buckets"] == [{"key": "acme", "doc_count": 1}, {"key": "zeta", "doc_count": 1}]
+
+
+def test_columns_follow_writes(catalog):
+    doc_values.get(database.shard_for("p1")).column("brand")  # loaded before the writes below
+    database.bulk_write([("index", "p1", "t", "red shoe", {"brand": "zeta"}), ("delete", "p3")])
+    terms = {"brands": {"terms": {"field": "brand"}}}
+    result = database.filtered_search(aggs=terms)
+    assert result["aggregations"]["brands"]["buckets"] == [{"key": "zeta", "doc_count": 2}, {"key": "acme", "doc_count": 1}]
+    assert ids(database.filtered_search(filters=[{"exists": {"field": "price"}}])) == ["p2"]
+
+
+def test_cold_filtered_search_with_one_reader(tmp_path, monkeypatch):
+    # Ids, columns and the mapping load on the reader the search holds, not a second one
+    database.close_pool()
+    monkeypatch.setattr(database, "SHARDS", 1)
+    monkeypatch.setattr(database, "READER_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "READER_TIMEOUT", 1)
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "one-reader.db"))
+    try:
+        database.bulk_write([("index", *doc) for doc in DOCS])
+        doc_values.reset()
+        response = database.filtered_search("red", filters=[{"term": {"brand": "acme"}}],
+                                            aggs={"brands": {"terms": {"field": "brand"}}},
+                                            source=projection.FULL_SOURCE)
+        assert ids(response) == ["p1", "p2"] and response["results"][0]["fields"]["brand"] == "acme"
+        doc_values.reset()
+        assert database.get_all_documents(source=projection.FULL_SOURCE)[0]["fields"]["brand"] == "acme"
+    finally:
+        database.close_pool()
+        monkeypatch.undo()
+
+
+def test_search_endpoint_validates():
+    response = client.post("/_search", json={"aggs": {"x": {"avg": {"field": "price"}}}})
+    assert response.status_code == 400
+    response = client.post("/_search", json={"filter": [{"range": {"price": {"near": 3}}}]})
+    assert response.status_code == 400
+    response = client.post("/_search", json={"query": "nothingmatchesthis", "aggs": {"b": {"terms": {"field": "brand"}}}})
+    assert response.status_code == 200
+    assert response.json()["total"] == 0
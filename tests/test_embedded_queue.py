@@ -0,0 +1,81 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app import embedded_queue
+from app.embedded_queue import EmbeddedTransport
+from app.main import app
+from app.transport import MAX_RETRIES, Transport
+
+
+async def drain(transport, queue, handle, count):
+    received = []
+
+    async def callback(message):
+        received.append(message)
+        await handle(message)
+
+    await transport.consume(queue, callback, prefetch=10)
+    for _ in range(200):
+        if len(received) >= count:
+            break
+        await asyncio.sleep(0.01)
+    return received
+
+
+def test_incomplete_transport_fails_on_creation():
+    class PublishOnly(Transport):
+        async def publish(self, routing_key, message):
+            pass
+
+    with pytest.raises(TypeError, match="abstract"):
+        PublishOnly()
+
+
+def test_ack_and_redelivery_after_restart(tmp_path):
+    path = str(tmp_path / "q.db")
+
+    async def run():
+        transport = EmbeddedTransport(path)
+        await transport.publish_batch("work", ["a", "b"])
+        got = await drain(transport, "work", lambda m: m.ack() if m.body == b"a" else asyncio.sleep(0), 2)
+        assert [m.body for m in got] == [b"a", b"b"]
+        await transport.close()  # "b" was never acked
+        transport = EmbeddedTransport(path)
+        got = await drain(transport, "work", lambda m: m.ack(), 1)
+        assert [m.body for m in got] == [b"b"]
+        await asyncio.sleep(0.05)
+        stats = await transport.queue_stats()
+        await transport.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["text_extract_queue"]["message_count"] == 0
+
+
+def test_retries_then_dead_letters(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedded_queue, "MESSAGE_TTL_MS", 0)
+
+    async def run():
+        transport = EmbeddedTransport(str(tmp_path / "q.db"))
+        await transport.publish("index_queue", "poison")
+        got = await drain(transport, "index_queue", lambda m: m.nack(requeue=False), MAX_RETRIES + 1)
+        await asyncio.sleep(0.05)
+        stats = await transport.queue_stats()
+        await transport.close()
+        return got, stats
+
+    got, stats = asyncio.run(run())
+    assert [m.retries for m in got] == list(range(MAX_RETRIES + 1))
+    assert stats["index_queue"]["message_count"] == 0
+    assert stats["index_dlq"]["message_count"] == 1
+
+
+def test_pipeline_runs_without_broker():
+    with TestClient(app) as client:
+        client.post("/documents", json={"id": "embedded1", "title": "E", "content": "embedded queue text"})
+        for _ in range(100):
+            if client.get("/documents/embedded1/status").json().get("status") == "indexed":
+                break
+            time.sleep(0.05)
+        assert [r["id"] for r in client.get("/search?q=embedded queue").json()["results"]] == ["embedded1"]
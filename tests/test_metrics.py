@@ -0,0 +1,66 @@
+from fastapi.testclient import TestClient
+from app import database, metrics
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_statement_class():
+    assert metrics.statement_class("SELECT tf FROM inverted_index WHERE term_id = ?") == "select inverted_index"
+    assert metrics.statement_class("INSERT OR IGNORE INTO terms (term) VALUES (?)") == "insert terms"
+    assert metrics.statement_class("UPDATE terms SET df = df + ? WHERE id IN (SELECT id FROM x)") == "update terms"
+    assert metrics.statement_class("BEGIN IMMEDIATE") == "begin"
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test", ("stage",), buckets=(0.1, 1.0))
+    metrics._registry.remove(histogram)
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    lines = histogram.render()
+    assert 'local_es_test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'local_es_test_seconds_bucket{stage="a",le="+Inf"} 2' in lines
+    assert 'local_es_test_seconds_count{stage="a"} 2' in lines
+
+
+def statement_count(statement):
+    prefix = f'local_es_sqlite_statement_seconds_count{{statement="{statement}"}}'
+    return next((int(line.split()[-1]) for line in metrics.SQL_SECONDS.render() if line.startswith(prefix)), 0)
+
+
+def test_one_observation_per_statement():
+    before = statement_count("select corpus_stats")
+    with database.read_connection() as db:
+        db.execute("SELECT doc_count FROM corpus_stats").fetchall()
+        assert statement_count("select corpus_stats") == before + 1
+        cursor = db.execute("SELECT doc_count FROM corpus_stats")
+        cursor.fetchone()
+        cursor.fetchone()
+        assert statement_count("select corpus_stats") == before + 2
+        db.execute("SELECT total_length FROM corpus_stats").fetchone()  # dropped before its rows ran out
+        assert statement_count("select corpus_stats") == before + 3
+
+
+def test_metrics_endpoint():
+    database.add_documents([("met1", "t", "metrics about scraping")])
+    assert database.search_documents("scraping")
+    body = client.get("/metrics").text
+    assert 'local_es_stage_duration_seconds_count{stage="search"}' in body
+    assert 'local_es_postings_scanned_count{engine="' in body
+    assert 'local_es_sqlite_statement_seconds_count{statement="select inverted_index"}' in body
+    assert 'local_es_documents{status="indexed"}' in body
+    assert 'local_es_queue_messages{queue="text_extract_queue"}' in body
+
+
+def test_slow_query_log_keeps_plan(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0.000001)
+    metrics.slow_queries.clear()
+    with database.read_connection() as db:
+        db.execute("SELECT id FROM documents WHERE status = ?", ("indexed",)).fetchall()
+    entry = next(e for e in metrics.slow_queries if e["sql"].startswith("SELECT id FROM documents"))
+    assert any("idx_documents_status" in step for step in entry["plan"])
+    with database.transaction() as db:
+        db.execute("UPDATE documents SET status = status WHERE id = ?", ("slowmissing",))
+    entry = next(e for e in metrics.slow_queries if e["sql"].startswith("UPDATE documents"))
+    assert entry["plan"] == []  # writes are not explained inside the caller's transaction
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,117 @@
+import tracemalloc
+import pytest
+from fastapi.testclient import TestClient
+from app import consumer, database, projection, segments, shards
+from app.analysis import Analyzer
+from app.main import app
+
+client = TestClient(app)
+
+FILLER = " ".join(f"filler{i}" for i in range(200))
+
+
+@pytest.fixture(params=[1, 3])
+def library(request, tmp_path, monkeypatch):
+    # A fresh index, single and sharded, with an uploaded file and an inline document
+    database.close_pool()
+    monkeypatch.setattr(database, "SHARDS", request.param)
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "library.db"))
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 0)
+    path = tmp_path / "notes.txt"
+    path.write_text(f"The <quick> brown fox. {FILLER} Another quick fox jumps. {FILLER}", encoding="utf-8")
+    database.insert_document("notes", "Notes", "The <quick> brown", str(path))
+    consumer.process_index([{"id": "notes"}])
+    database.bulk_write([("index", "memo", "Memo", "a slow brown dog", {"brand": "acme", "sold": "2024-01-15"})])
+    yield path
+    database.close_pool()
+    monkeypatch.undo()
+
+
+def test_source_projection(library):
+    hit, = database.search_documents("dog")
+    assert set(hit) == {"id", "title", "score", "sort"}  # no content by default
+    source = projection.SourceFilter.parse(["content", "fields.*"])
+    hit, = database.search_documents("dog", source=source)
+    assert hit["content"] == "a slow brown dog" and "title" not in hit
+    assert hit["fields"] == {"brand": "acme", "sold": "2024-01-15T00:00:00+00:00"}
+    source = projection.SourceFilter.parse(True, excludes="content,fields.sold")
+    assert database.filtered_search("dog", source=source)["results"][0]["fields"] == {"brand": "acme"}
+    hit, = database.search_documents("dog", source=projection.SourceFilter.parse(False))
+    assert set(hit) == {"id", "score", "sort"}
+    rows = database.get_all_documents()
+    assert [row["id"] for row in rows] == ["memo", "notes"] and "content" not in rows[0]
+    rows = database.get_all_documents(source=projection.SourceFilter.parse("fields"))
+    assert rows[0]["fields"]["brand"] == "acme" and "title" not in rows[0]
+
+
+def test_highlight_fragments(library):
+    options = projection.parse_highlight({"number_of_fragments": 2, "fragment_tokens": 6})
+    hit, = database.search_documents("quick fox", highlight=options)
+    assert hit["highlight"]["content"] == ["The &lt;<em>quick</em>&gt; brown <em>fox</em>. filler0 filler1",
+                                           "Another <em>quick</em> <em>fox</em> jumps. filler0 filler1"]
+    hit, = database.filtered_search("dog", highlight=projection.parse_highlight(True))["results"]
+    assert hit["highlight"]["content"] == ["a slow brown <em>dog</em>"]
+    hit, = database.search_documents("bro*", highlight=options, source=projection.SourceFilter.parse(False))[:1]
+    assert "<em>brown</em>" in hit["highlight"]["content"][0]
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "segment"])
+def test_highlight_on_each_engine(engine, tmp_path, monkeypatch):
+    database.close_pool()
+    segments.close_engine()
+    monkeypatch.setattr(database, "INDEX_ENGINE", engine)
+    monkeypatch.setattr(database, "SHARDS", 1)
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "engine.db"))
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path / "segments"))
+    try:
+        database.bulk_write([("index", "lark", "Lark", "a lark sings over the meadow at dawn")])
+        database.bulk_write([("index", "lark", "Lark", "a lark sings over the meadow at dusk")])
+        hit, = database.search_documents("meadow", highlight=projection.parse_highlight({"fragment_tokens": 4}))
+        assert hit["highlight"]["content"] == ["the <em>meadow</em> at dusk"]
+    finally:
+        segments.close_engine()
+        database.close_pool()
+        monkeypatch.undo()
+
+
+def test_highlight_stops_after_last_fragment(library):
+    read = []
+    chunks = database.read_chunks(str(library), size=16)
+    analyzer = Analyzer()
+    fragments = projection._fragments(analyzer, (read.append(c) or c for c in chunks), [(0, 4)], {1: "quick"})
+    assert fragments == ["The &lt;<em>quick</em>&gt; brown fox"]
+    assert sum(map(len, read)) < 64
+
+
+def test_highlight_keeps_only_the_pending_window(tmp_path):
+    path = tmp_path / "long.txt"
+    path.write_text("filler " * 100000 + "needle tail", encoding="utf-8")
+    chunks = database.read_chunks(str(path), size=4096)
+    tracemalloc.start()
+    fragments = projection._fragments(Analyzer(), chunks, [(99999, 100002)], {100000: "needle"})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert fragments == ["filler <em>needle</em> tail"]
+    assert peak < 200_000  # the text read is 700 kB
+
+
+def test_spans_follow_tokens():
+    analyzer = Analyzer()
+    text = "Alpha beta,  gamma\nalpha don't DELTA beta. " * 20 + "tail"
+    tokens = list(analyzer.iter_tokens([text]))
+    for size in (1, 5, 64):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert [text[start:end].lower() for start, end in analyzer.iter_spans(chunks)] == tokens
+
+
+def test_http_source_and_highlight(library):
+    results = client.get("/search", params={"q": "dog", "_source_includes": "content"}).json()["results"]
+    assert results[0]["content"] == "a slow brown dog" and "title" not in results[0]
+    results = client.get("/search", params={"q": "dog", "highlight": "true"}).json()["results"]
+    assert results[0]["highlight"]["content"] == ["a slow brown <em>dog</em>"]
+    body = {"query": "dog", "_source": {"includes": ["title", "fields.brand"]}, "highlight": True}
+    hit, = client.post("/_search", json=body).json()["results"]
+    assert hit["title"] == "Memo" and hit["fields"] == {"brand": "acme"} and hit["highlight"]
+    assert client.post("/_search", json={"query": "dog", "highlight": {"size": 3}}).status_code == 400
+    lines = client.get("/_export").text.splitlines()
+    assert all('"content"' in line for line in lines)  # exports carry the full source
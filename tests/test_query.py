@@ -0,0 +1,30 @@
+from app import database
+from app.postings import encode_positions
+from app.query import parse_query, Phrase, Near
+
+
+def test_parse_query():
+    terms, constraints = parse_query('"Hello World" foo NEAR/3 bar')
+    assert terms == ["hello", "world", "foo", "bar"]
+    assert isinstance(constraints[0], Phrase) and constraints[0].terms == ["hello", "world"]
+    assert isinstance(constraints[1], Near) and (constraints[1].left, constraints[1].right, constraints[1].slop) == ("foo", "bar", 3)
+
+
+def test_positional_matching():
+    blobs = {"a": encode_positions([1, 7, 20]), "b": encode_positions([4, 8]), "c": encode_positions([9])}
+    assert Phrase(["a", "b", "c"]).matches(blobs)
+    assert not Phrase(["b", "a"]).matches(blobs)
+    assert Near("a", "c", 2).matches(blobs)
+    assert not Near("c", "a", 1).matches(blobs)
+    assert not Near("b", "a", 0).matches(blobs)
+
+
+def test_phrase_and_near_search():
+    database.add_documents([
+        ("ph1", "t", "the quick brown fox jumps"),
+        ("ph2", "t", "brown quick the fox"),
+        ("ph3", "t", "quick one two three four five brown"),
+    ])
+    assert [r["id"] for r in database.search_documents('"quick brown"')] == ["ph1"]
+    assert {r["id"] for r in database.search_documents("quick NEAR/1 brown")} == {"ph1", "ph2"}
+    assert {r["id"] for r in database.search_documents("quick NEAR/6 brown")} == {"ph1", "ph2", "ph3"}
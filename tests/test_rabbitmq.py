@@ -0,0 +1,19 @@
+import asyncio
+from app.rabbitmq import Publisher
+from benchmarks.standin_broker import StandInBroker
+
+
+def test_publisher_reuses_connection_and_exchange():
+    broker = StandInBroker(connect_latency=0, channel_latency=0, confirm_latency=0)
+
+    async def run():
+        publisher = Publisher(connect=broker.connect, max_channels=2)
+        for i in range(10):
+            await publisher.publish("q", f"m{i}")
+        await publisher.publish_batch("q", [f"b{i}" for i in range(10)])
+        await publisher.close()
+
+    asyncio.run(run())
+    assert broker.connections == 1
+    assert broker.exchange_declares == 1
+    assert len(broker.queues["q"]) == 20
@@ -0,0 +1,92 @@
+import pytest
+from app import database, segments
+from app.postings import encode_positions
+from app.query import Phrase
+from app.segments import SegmentIndex
+
+
+def _doc(doc_id, text, version=1):
+    term_positions = {}
+    for pos, token in enumerate(text.split()):
+        term_positions.setdefault(token, []).append(pos)
+    blobs = {term: (len(p), encode_positions(p)) for term, p in term_positions.items()}
+    return (doc_id, version, blobs, len(text.split()))
+
+
+def test_flush_reopen_and_search(tmp_path):
+    index = SegmentIndex(str(tmp_path), flush_docs=2, background=False)
+    index.add_many([_doc("a", "red fox"), _doc("b", "red red dog"), _doc("c", "blue fox")])
+    assert len(index.segments) == 1  # third doc still buffered
+    assert [doc_id for _, doc_id in index.search(["red"], 10)] == ["b", "a"]
+    assert [doc_id for _, doc_id in index.search(["red", "fox"], 10)] == ["a"]
+    index.add_many([_doc("a", "green", version=2)])
+    index.delete_many(["c"])
+    index.close()
+
+    reopened = SegmentIndex(str(tmp_path), background=False)
+    assert reopened.search(["fox"], 10) == []
+    assert [doc_id for _, doc_id in reopened.search(["green"], 10)] == ["a"]
+    assert reopened.doc_count == 2
+    reopened.close()
+
+
+def test_tiered_merge_drops_deleted_docs(tmp_path):
+    index = SegmentIndex(str(tmp_path), flush_docs=1, background=False)
+    for i in range(11):
+        index.add_many([_doc(f"d{i}", f"common word{i} tail")])
+    index.delete_many(["d3"])
+    assert len(index.segments) == 11
+    index.maybe_merge()
+    # The fully deleted segment is dropped, the other ten share a tier and merge
+    assert len(index.segments) == 1
+    assert index.segments[0].doc_count == 10
+    hits = index.search(["common", "word5"], 20, constraints=[Phrase(["common", "word5"])])
+    assert [doc_id for _, doc_id in hits] == ["d5"]
+    index.close()
+
+
+@pytest.fixture
+def segment_db(tmp_path, monkeypatch):
+    # A fresh index on the segment engine
+    database.close_pool()
+    segments.close_engine()
+    monkeypatch.setattr(database, "INDEX_ENGINE", "segment")
+    monkeypatch.setattr(database, "SHARDS", 1)
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "segment.db"))
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path / "segments"))
+    yield
+    segments.close_engine()
+    database.close_pool()
+    monkeypatch.undo()
+
+
+def test_engine_follows_commits_and_catches_up_after_crash(segment_db):
+    database.bulk_write([("index", "sega", "t", "quokka numbat")])
+    engine = segments.get_engine()
+    engine.flush()
+    with pytest.raises(RuntimeError):
+        with database.transaction() as db:
+            database.write_postings(db, [("segb", 1, {"wombat": [0]})])
+            raise RuntimeError("rolled back")
+    assert engine.search(["wombat"], 10) == []
+
+    database.bulk_write([("index", "segb", "t", "quokka wombat"), ("delete", "sega")])
+    engine.flush = lambda: None  # crash: the buffered writes never reach disk
+    segments.close_engine()
+    on_disk = SegmentIndex(segments.SEGMENT_DIR, background=False)
+    assert [doc_id for _, doc_id in on_disk.search(["quokka"], 10)] == ["sega"]
+    on_disk.close()
+    assert [hit["id"] for hit in database.search_documents("quokka")] == ["segb"]
+    assert [doc_id for _, doc_id in segments.get_engine().search(["wombat"], 10)] == ["segb"]
+
+
+def test_engine_idf_matches_live_documents(segment_db):
+    docs = [("idfa", "t", "apple"), ("idfb", "t", "apple pear pear"), ("idfc", "t", "pear plum")]
+    database.bulk_write([("index", *doc) for doc in docs])
+    assert segments.get_engine().buffer.doc_count == 3  # the first write is not replayed by the catch-up
+    for _ in range(2):
+        database.bulk_write([("index", *doc) for doc in docs])
+    doc_count, _, dfs = segments.get_engine().stats(["apple"])
+    assert (doc_count, dfs) == (3, {"apple": 2})
+    hits = segments.get_engine().search(["apple"], 10)
+    assert [doc_id for _, doc_id in hits] == ["idfa", "idfb"] and all(score > 0 for score, _ in hits)
@@ -0,0 +1,121 @@
+import sqlite3
+import time
+import pytest
+from app import cache, database, metrics, shards
+
+DOCS = [(f"s{i}", "t", " ".join(["shard"] * (i % 5 + 1) + ["common"] * (i % 3) + [f"w{i % 7}"])) for i in range(40)]
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    # Yields a function that reopens the index with a given shard count
+    def use(count, name):
+        database.close_pool()
+        monkeypatch.setattr(database, "SHARDS", count)
+        monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / f"{name}.db"))
+        database.get_pools()
+
+    yield use
+    database.close_pool()
+    monkeypatch.undo()
+
+
+def ranking(query, limit=100):
+    return [(r["id"], r["score"]) for r in database.search_documents(query, limit)]
+
+
+def test_sharded_search_matches_single_database(sharded, monkeypatch):
+    sharded(1, "single")
+    database.bulk_write([("index", *doc) for doc in DOCS])
+    expected = {query: ranking(query) for query in ("shard", "common w3", '"shard common"', "sha* comon~1")}
+
+    sharded(3, "sharded")
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 0)
+    results = database.bulk_write([("index", *doc) for doc in DOCS] + [("delete", "missing")])
+    assert [r[2] for r in results] == [201] * len(DOCS) + [404]
+    for shard in range(3):
+        with database.read_connection(shard) as db:
+            ids = [row[0] for row in db.execute("SELECT id FROM documents")]
+        assert ids and all(database.shard_for(doc_id) == shard for doc_id in ids)
+    for query, hits in expected.items():
+        assert ranking(query) == hits
+    # Same ranking from the process pool
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 2)
+    database.cache.results.clear()
+    assert ranking("common w3") == expected["common w3"]
+    assert ranking("sha* comon~1") == expected["sha* comon~1"]
+
+
+def scanned_count():
+    line = next((line for line in metrics.POSTINGS_SCANNED.render()
+                 if line.startswith('local_es_postings_scanned_count{engine="sqlite"}')), "0 0")
+    return int(line.split()[-1])
+
+
+def test_worker_metrics_reach_the_parent(sharded, monkeypatch):
+    sharded(2, "metrics")
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 2)
+    database.bulk_write([("index", *doc) for doc in DOCS])
+    before = scanned_count()
+    assert len(database.search_documents("shard", 10)) == 10
+    assert scanned_count() == before + 2  # one per shard
+
+
+class SteppingClock:
+    # time.time() for shards: `start` on the first call, `later` after that
+    def __init__(self, start, later):
+        self.calls, self.start, self.later = 0, start, later
+
+    def time(self):
+        self.calls += 1
+        return self.start if self.calls == 1 else self.later
+
+
+def test_shard_worker_stops_at_deadline(sharded, monkeypatch):
+    sharded(2, "deadline")
+    database.bulk_write([("index", *doc) for doc in DOCS])
+    path = database.shard_path(0)
+    args = (["shard"], 10, shards.global_stats(["shard"]), (), None, {})
+    monkeypatch.setattr(shards, "PROGRESS_STEPS", 1)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+            shards._search_shard(path, 0, cache.generation(), time.time() - 1, *args)  # expired while queued
+        cache.postings.clear()
+        monkeypatch.setattr(shards, "time", SteppingClock(0.0, 100.0))
+        with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+            shards._search_shard(path, 0, cache.generation(), 50.0, *args)  # expires mid-statement
+        hits, _ = shards._search_shard(path, 0, cache.generation(), None, *args)
+        assert hits
+    finally:
+        shards._connections.pop(path).close()
+
+
+def test_sharded_listings_and_paging(sharded, monkeypatch):
+    sharded(3, "listing")
+    monkeypatch.setattr(shards, "SEARCH_PROCESSES", 0)
+    database.add_documents(DOCS)
+    listed = database.get_all_documents(10, ["s2"])
+    assert [r["id"] for r in listed] == sorted(doc[0] for doc in DOCS if doc[0] > "s2")[:10]
+    assert database.document_status_counts() == {"indexed": len(DOCS)}
+    # A negative limit lists everything, as SQLite's LIMIT -1 does
+    assert [r["id"] for r in database.get_all_documents(-1)] == sorted(doc[0] for doc in DOCS)
+    pages, after = [], None
+    while True:
+        page = database.search_documents("shard", 7, after)
+        pages.extend(r["id"] for r in page)
+        if len(page) < 7:
+            break
+        after = page[-1]["sort"]
+    assert pages == [r["id"] for r in database.search_documents("shard", 100)]
+    database.bulk_write([("delete", "s1")])
+    assert database.get_document_status("s1") is None
+    assert "s1" not in [r["id"] for r in database.search_documents("shard", 100)]
+
+
+def test_shard_count_is_fixed_at_creation(sharded, monkeypatch):
+    sharded(2, "fixed")
+    database.close_pool()
+    monkeypatch.setattr(database, "DATABASE_PATH", database.shard_path(0))
+    monkeypatch.setattr(database, "SHARDS", 1)
+    with pytest.raises(RuntimeError, match="2 shard"):
+        database.get_pools()